@@ -3,7 +3,7 @@
 import argparse
 import sys
 
-from utils import ProjectHandler
+from utils.ProjectHandler import ProjectHandler
 
 def main():
 
@@ -17,7 +17,7 @@ def main():
                          action='store_const',
                          dest='action',
                          const='status',
-                         help="Check the status of a stage")
+                         help="Check the status of a stage, or of every stage of the project")
     actions.add_argument('--check',
                          action='store_const',
                          dest='action',
@@ -32,7 +32,7 @@ def main():
                          action='store_const',
                          dest='action',
                          const='submit',
-                         help="Submit a stage for processing")
+                         help="Submit a stage for processing, or every stage of the project")
     actions.add_argument('--makeup',
                          action='store_const',
                          dest='action',
@@ -43,12 +43,47 @@ def main():
                          dest='action',
                          const='statistics',
                          help="Query database for job statistics")
+    actions.add_argument('--watch',
+                         action='store_const',
+                         dest='action',
+                         const='watch',
+                         help="Follow the stages, submitting and making them up until they finish")
+    actions.add_argument('--throttle',
+                         type=int,
+                         dest='throttle',
+                         metavar='N',
+                         help="Let N tasks of each array of a stage (or of every stage) run at once, 0 for no limit")
+    actions.add_argument('--preflight',
+                         action='store_const',
+                         dest='action',
+                         const='preflight',
+                         help="Check the fcl files of a stage (or of every stage) and measure a few events")
+    actions.add_argument('--forecast',
+                         action='store_const',
+                         dest='action',
+                         const='forecast',
+                         help="Forecast when a stage (or every stage) will be finished, from the jobs that ran")
+    parser.add_argument('--preflight-events', type=int, default=5,
+        help='Events processed by each fcl with --preflight')
+    parser.add_argument('--batch', action='store_true',
+        help='Run --preflight as a single task of the scheduler instead of on this machine')
+    parser.add_argument('--replicas', type=int, default=200,
+        help='Simulations of the project run by --forecast')
+    parser.add_argument('--interval', type=int, default=300,
+        help='Seconds between two looks at the stages with --watch')
 
     args = parser.parse_args()
+    if args.throttle is not None:
+        args.action = 'throttle'
 
 
     # Create a project handler object :
     handler = ProjectHandler(config_file=args.yml, action=args.action, stage=args.stage)
+    handler.watch_interval = args.interval
+    handler.throttle_value = args.throttle
+    handler.preflight_events = args.preflight_events
+    handler.preflight_batch = args.batch
+    handler.forecast_replicas = args.replicas
 
     handler.act()
 
@@ -1,30 +1,85 @@
 #!/usr/bin/env python
+import time
+# Taken before any other import, to measure the startup overhead of the worker:
+start_time = time.time()
+
 import os
 import sys
+import json
+import argparse
 
 from config import ProjectConfig
-from utils  import RunnerTypes
 
-def main(config_file, stage):
+def main(config_file, stage, pilot=False, preflight=None, report=None, inputs=None):
     print("Creating Project Config Object")
+    # config_file can be the project yml or the json descriptor written at submission
     project = ProjectConfig(config_file)
     print("Config created, setup software ...")
-    project.software().setup()
+    # Use the environment captured at submission time, if it is valid:
+    snapshot_dir = '{0}/work/{1}/'.format(project['top_dir'], stage)
+    if not project.software().load_snapshot(snapshot_dir):
+        project.software().setup()
 
+    # Only the runner for this software type gets imported:
+    from utils.RunnerTypes import RunnerTypes
     runner_class = RunnerTypes()[project.software()['type']]
     runner = runner_class(project = project, stage=project.stage(stage))
+    runner.start_time = start_time
+
+    if preflight is not None:
+        # A few events outside of the database, see ProjectHandler.preflight:
+        print("Running preflight with {0} events ...".format(preflight))
+        result = runner.run_preflight(preflight, os.path.dirname(os.path.abspath(report)), inputs)
+        with open(report, 'w') as _report:
+            json.dump(result, _report, indent=2)
+        if not result['success']:
+            sys.exit(1)
+        return
+
+    # The task index counts from the start of the stage, across split arrays:
+    from utils.Scheduler import task_job_id
+    job_id = task_job_id()
+    print("Job ID is {0}".format(job_id))
+
+    if runner.stage.chains_per_task() > 1:
+        # Packed mode, each chain prepares its own job:
+        print("Running {0} chains ...".format(runner.stage.chains_per_task()))
+        runner.run_packed(job_id, runner.stage.chains_per_task(), pilot=pilot)
+        return
+
+    if pilot:
+        # The pilot prepares a fresh job for every iteration:
+        print("Running pilot ...")
+        runner.run_pilot(job_id)
+        return
+
     print("Preparing job ...")
     runner.prepare_job()
 
-    job_id = "{0}_{1}".format(os.environ['SLURM_ARRAY_JOB_ID'], os.environ['SLURM_ARRAY_TASK_ID'])
-    print("Job ID is {0}".format(job_id))
     print("Running job ...")
-    runner.run_job(job_id)
+    try:
+        runner.run_job(job_id)
+    except:
+        # Make sure the heartbeat reflects the failure before exiting:
+        if runner.monitor is not None:
+            runner.monitor.stop('failed')
+        raise
     return
 
 if __name__ == '__main__':
     print "Begining script execution."
-    # Command line arguments need to be yml file and stage
-    config_file = sys.argv[1]
-    stage = sys.argv[2]
-    main(config_file, stage)
+    # Command line arguments need to be yml file (or descriptor) and stage
+    parser = argparse.ArgumentParser(description='Run a job on a worker node.')
+    parser.add_argument('config_file', help='YML configuration file or json descriptor')
+    parser.add_argument('stage', help='Which stage to run')
+    parser.add_argument('--pilot', action='store_true',
+        help='Keep running jobs until the stage runs out of work or time')
+    parser.add_argument('--preflight', type=int, metavar='N',
+        help='Check the fcl files and run them on N events, without the database')
+    parser.add_argument('--report',
+        help='Json file to write the preflight report to, the run happens in its directory')
+    parser.add_argument('--inputs', nargs='*',
+        help='Input files of the preflight run')
+    args = parser.parse_args()
+    main(args.config_file, args.stage, pilot=args.pilot,
+         preflight=args.preflight, report=args.report, inputs=args.inputs)
@@ -1,12 +1,42 @@
+import os
+import json
+import time
+import hashlib
 from collections import OrderedDict
 
 import yaml
+# The C based loader is much faster, use it when libyaml is available:
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
 
 from ConfigException import ConfigException
 from LarsoftConfig   import LarsoftConfig
 from GalleryConfig   import GalleryConfig
 from StageConfig     import StageConfig
 
+# Version of the descriptor format written by ProjectConfig.compile.
+# Bump this whenever the layout of the descriptor changes.
+DESCRIPTOR_VERSION = 1
+
+def _to_str(data):
+    '''Convert the unicode strings returned by json back to plain str'''
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    if isinstance(data, list):
+        return [_to_str(item) for item in data]
+    if isinstance(data, dict):
+        return dict((_to_str(key), _to_str(value)) for key, value in data.iteritems())
+    return data
+
+def file_signature(path):
+    '''Return the size, modification time and sha1 of a file'''
+    stat = os.stat(path)
+    with open(path, 'rb') as _f:
+        sha1 = hashlib.sha1(_f.read()).hexdigest()
+    return {'path' : path, 'size' : stat.st_size, 'mtime' : stat.st_mtime, 'sha1' : sha1}
+
 class ProjectConfigException(ConfigException):
     ''' Custom exception for the entire project'''
 
@@ -25,11 +55,21 @@ class ProjectConfig(object):
     def __init__(self, config_file):
         super(ProjectConfig, self).__init__()
 
-        # Parse the configuration file:
+        # Files the configuration was read from, used to detect changes
+        # after a descriptor has been compiled:
+        self.sources = []
+        self.stale_sources = []
+
+        # Parse the configuration file.  A .json file is a descriptor
+        # written by compile(), which is already fully resolved:
         try:
             with open(config_file, 'r') as _f:
-                yml_dict = yaml.load(_f)
-        except yaml.YAMLError as exc:
+                if config_file.endswith('.json'):
+                    yml_dict = self.load_descriptor(_f, config_file)
+                else:
+                    yml_dict = yaml.load(_f, Loader=Loader)
+                    self.sources.append(os.path.abspath(config_file))
+        except (yaml.YAMLError, ProjectConfigException) as exc:
             raise exc
         except:
             raise ProjectConfigException(
@@ -48,7 +88,8 @@ class ProjectConfig(object):
         if 'type' not in self.yml_dict['software']:
             try:
               with open(self.yml_dict['software'],'r') as _sft_file:
-                temp_dict = yaml.load(_sft_file)
+                temp_dict = yaml.load(_sft_file, Loader=Loader)
+                self.sources.append(os.path.abspath(self.yml_dict['software']))
                 self.yml_dict['software'] = temp_dict
             except Exception as e:
                 print "Couldn't open or parse the specified software"
@@ -64,15 +105,103 @@ class ProjectConfig(object):
         prev_stage=None
         for stage in self.yml_dict['stages']:
             name = stage.keys()[0]
-            self.stages[name] = StageConfig(stage[name], name, prev_stage)
+            self.stages[name] = StageConfig(stage[name], name, prev_stage,
+                                            self.yml_dict['software']['type'])
             prev_stage = name
 
     def __getitem__(self, key):
         return self.yml_dict[key]
 
+    def compile(self, descriptor_file, stage=None):
+        '''Write the resolved configuration to a versioned json descriptor
+
+        The descriptor includes the software block in place, so it can be
+        loaded by ProjectConfig without reading or validating any yml file.
+        It also records the signature of every yml file the configuration
+        was read from, so later changes to them can be detected.
+
+        Arguments:
+            descriptor_file {str} -- path of the json file to write
+
+        Keyword Arguments:
+            stage {str or None} -- only keep this stage in the descriptor (default: {None})
+        '''
+        project = dict(self.yml_dict)
+        if stage is not None:
+            project['stages'] = [_stage for _stage in self.yml_dict['stages'] if stage in _stage]
+
+        descriptor = {
+            'version' : DESCRIPTOR_VERSION,
+            'created' : time.time(),
+            'sources' : [file_signature(path) for path in self.sources],
+            'project' : project,
+        }
+        with open(descriptor_file + '.tmp', 'w') as _f:
+            json.dump(descriptor, _f, default=str, separators=(',', ':'))
+        os.rename(descriptor_file + '.tmp', descriptor_file)
+
+    def load_descriptor(self, descriptor, descriptor_file):
+        '''Read a descriptor written by compile
+
+        Changes to the original yml files since the descriptor was compiled
+        are reported and kept in self.stale_sources, the configuration as
+        it was compiled is still used.
+
+        Arguments:
+            descriptor {file} -- open descriptor file
+            descriptor_file {str} -- name of the descriptor file, for messages
+
+        Returns:
+            dict -- the project configuration dictionary
+        '''
+        descriptor = _to_str(json.load(descriptor))
+        if not isinstance(descriptor, dict) or descriptor.get('version') != DESCRIPTOR_VERSION:
+            raise ProjectConfigException(
+                "Descriptor {0} has an unsupported version".format(descriptor_file))
+
+        for source in descriptor['sources']:
+            self.sources.append(source['path'])
+            self.check_source(source)
+
+        for path in self.stale_sources:
+            print("WARNING: {0} changed after {1} was compiled, using the compiled configuration.".format(
+                path, descriptor_file))
+
+        return descriptor['project']
+
+    def check_source(self, source):
+        '''Compare a yml file with the signature recorded in a descriptor
+
+        Only the size and modification time are checked first, the file is
+        read and hashed only if they differ.
+        '''
+        try:
+            stat = os.stat(source['path'])
+        except OSError:
+            self.stale_sources.append(source['path'])
+            return
+        if stat.st_size == source['size'] and stat.st_mtime == source['mtime']:
+            return
+        if file_signature(source['path'])['sha1'] != source['sha1']:
+            self.stale_sources.append(source['path'])
+
     def software(self):
         return self.software_config
 
+    def scheduler(self):
+        '''Return the settings of the batch system running the jobs
+
+        The type is slurm (default) or local, see utils.SchedulerTypes.
+        Jobs work in the scratch directory, and slurm jobs run in the
+        partition given here.
+        '''
+        settings = {'type'      : 'slurm',
+                    'partition' : 'guenette',
+                    'scratch'   : '/n/regal/guenette_lab/work/'}
+        if 'scheduler' in self.yml_dict and self.yml_dict['scheduler'] is not None:
+            settings.update(self.yml_dict['scheduler'])
+        return settings
+
     def stage(self, name):
         try:
             return self.stages[name]
@@ -1,7 +1,51 @@
 
+import os
+import re
+import json
+import time
+import socket
+import hashlib
 
 from ConfigException import ConfigException
 
+# Version of the layout of the snapshots written by write_snapshot:
+SNAPSHOT_FORMAT = 2
+
+# Lines of env output that are not variables (exported bash functions
+# span several lines), and variables bash sets for itself:
+_variable_pattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_shell_variables = ['_', 'SHLVL', 'PWD', 'OLDPWD']
+
+
+def environment_changes(before, after):
+    '''Return what a setup changed in the environment
+
+    Variables extended with ':' (PATH, LD_LIBRARY_PATH ...) only keep the
+    part that was added, so they can be applied on top of the environment
+    of another host.  Variables the setup removed are ignored.
+
+    Arguments:
+        before {dict} -- environment before the setup
+        after {dict} -- environment after the setup
+
+    Returns:
+        tuple -- ({variable : value}, {variable : prepended}, {variable : appended})
+    '''
+    env, prepend, append = dict(), dict(), dict()
+    for key, value in after.iteritems():
+        if not _variable_pattern.match(key) or key in _shell_variables:
+            continue
+        old = before.get(key, None)
+        if value == old:
+            continue
+        if old and value.endswith(':' + old):
+            prepend[key] = value[:-len(old) - 1]
+        elif old and value.startswith(old + ':'):
+            append[key] = value[len(old) + 1:]
+        else:
+            env[key] = value
+    return env, prepend, append
+
 class SoftwareConfigException(ConfigException):
     '''Specialized exception for configuration errors with larsoft block'''
 
@@ -21,6 +65,111 @@ class SoftwareConfig(object):
     def setup(self, return_env=False):
         raise NotImplementedError("Required to implement the setup function.")
 
+    def snapshot_key(self):
+        '''Return a hash identifying the software environment
+
+        The key is built from every parameter that changes the result
+        of setup: product areas, local areas, setup scripts, product,
+        version and qualifiers.
+        '''
+        keys = ['type', 'product_areas', 'local_areas', 'setup_scripts',
+                'product', 'version', 'quals']
+        values = [[key, self.yml_dict.get(key, None)] for key in keys]
+        return hashlib.sha1(json.dumps(values, sort_keys=True)).hexdigest()
+
+    def snapshot_file(self, directory):
+        return '{0}/software_env_{1}.json'.format(directory, self.snapshot_key())
+
+    def write_snapshot(self, directory):
+        '''Run the software setup once and store what it changed in directory
+
+        Workers can then load the snapshot with load_snapshot instead of
+        running the full setup themselves.  Only the variables the setup
+        added or changed are stored (see environment_changes), the rest of
+        the environment of the submit host stays out of the jobs.
+
+        Arguments:
+            directory {str} -- directory to write the snapshot to
+
+        Returns:
+            str -- path of the snapshot file
+        '''
+        env, prepend, append = environment_changes(dict(os.environ), self.setup(return_env=True))
+        snapshot = {
+            'format'  : SNAPSHOT_FORMAT,
+            'key'     : self.snapshot_key(),
+            'created' : time.time(),
+            'host'    : socket.gethostname(),
+            'env'     : env,
+            'prepend' : prepend,
+            'append'  : append,
+        }
+        path = self.snapshot_file(directory)
+        with open(path + '.tmp', 'w') as _snap:
+            json.dump(snapshot, _snap)
+        os.rename(path + '.tmp', path)
+        return path
+
+    def load_snapshot(self, directory, return_env=False):
+        '''Load a software environment snapshot written by write_snapshot
+
+        The snapshot is only used if it exists, was made for this exact
+        configuration and still points to an existing product directory.
+        Its changes are applied on top of the current environment.
+
+        Arguments:
+            directory {str} -- directory containing the snapshot
+
+        Keyword Arguments:
+            return_env {bool} -- return the environment instead of setting it (default: {False})
+
+        Returns:
+            dict, bool or None -- the environment if return_env, otherwise True
+            on success.  None if the snapshot can not be used.
+        '''
+        path = self.snapshot_file(directory)
+        try:
+            with open(path, 'r') as _snap:
+                snapshot = json.load(_snap)
+        except (IOError, ValueError) as e:
+            print('Software snapshot {0} not usable: {1}'.format(path, e))
+            return None
+
+        if snapshot.get('format', None) != SNAPSHOT_FORMAT:
+            print('Software snapshot {0} was written by another version.'.format(path))
+            return None
+
+        env = snapshot.get('env', None)
+        if snapshot.get('key', None) != self.snapshot_key() or not env:
+            print('Software snapshot {0} does not match the configuration.'.format(path))
+            return None
+
+        # Make sure the product was actually set up and is visible from here:
+        product = self.yml_dict['product'].upper()
+        if 'SETUP_{0}'.format(product) not in env:
+            print('Software snapshot {0} does not set up {1}.'.format(path, product))
+            return None
+        product_dir = env.get('{0}_DIR'.format(product), None)
+        if product_dir is not None and not os.path.isdir(product_dir):
+            print('Software snapshot {0} points to missing {1}.'.format(path, product_dir))
+            return None
+
+        print('Setting up software from snapshot {0}'.format(path))
+        result = dict(os.environ)
+        for key, value in env.iteritems():
+            result[str(key)] = str(value)
+        for key, value in snapshot['prepend'].iteritems():
+            current = result.get(str(key), '')
+            result[str(key)] = str(value) + (':' + current if current != '' else '')
+        for key, value in snapshot['append'].iteritems():
+            current = result.get(str(key), '')
+            result[str(key)] = (current + ':' if current != '' else '') + str(value)
+        if return_env:
+            return result
+        else:
+            os.environ.update(result)
+            return True
+
 
 
     def __getitem__(self, key):
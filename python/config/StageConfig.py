@@ -1,6 +1,5 @@
 
 from ConfigException import ConfigException
-from database import DatasetReader
 
 class StageConfigException(ConfigException):
     ''' Custom exception for stages'''
@@ -17,7 +16,7 @@ class StageConfig(object):
     Stores the information from the larsoft configuration and includes
     helpful functions
     '''
-    def __init__(self, yml_dict, name, previous_stage=None):
+    def __init__(self, yml_dict, name, previous_stage=None, software_type=None):
         super(StageConfig, self).__init__()
         required_keys=['fcl','n_jobs','events_per_job','input','output']
         required_subkeys={'input'  : ['dataset'],
@@ -30,6 +29,10 @@ class StageConfig(object):
                 for subkey in required_subkeys[key]:
                     if subkey not in yml_dict[key]:
                         raise StageConfigException(subkey, "{0}/{1}".format(name,key))
+        # Gallery scripts only get --files, they can not be given a range of events:
+        if software_type == 'gallery' and 'events_per_shard' in yml_dict['input']:
+            raise ConfigException(
+                "Stage {0}: events_per_shard needs larsoft, gallery scripts process whole files".format(name))
 
         self.name = name
         self.yml_dict = yml_dict
@@ -142,6 +145,9 @@ class StageConfig(object):
         else:
             if self['input']['dataset'] == 'none' or self['input']['dataset'] == None:
                 return None
+            # Imported here so that workers don't pay for the database
+            # modules just to read the configuration:
+            from database import DatasetReader
             dr = DatasetReader()
             return dr.sum(dataset=self['input']['dataset'], target='nevents', type=0)
 
@@ -183,6 +189,207 @@ class StageConfig(object):
             return int(self.yml_dict['input']['n_files'])
         return 1
 
+    def n_pilots(self):
+        '''
+        Return the number of pilot jobs to launch for this stage, or None
+        to launch one job per n_jobs.  Pilots keep running jobs until the
+        stage runs out of work or they run out of time.
+        '''
+        if 'n_pilots' in self.yml_dict:
+            return int(self.yml_dict['n_pilots'])
+        return None
+
+    def chains_per_task(self):
+        '''
+        Return the number of independent fcl chains to run in parallel in
+        each batch task, default is one
+        '''
+        if 'chains_per_task' in self.yml_dict:
+            return int(self.yml_dict['chains_per_task'])
+        return 1
+
+    def cpus_per_task(self):
+        '''
+        Return the number of cpus to request for each batch task,
+        default is one per chain
+        '''
+        if 'cpus_per_task' in self.yml_dict:
+            return int(self.yml_dict['cpus_per_task'])
+        return self.chains_per_task()
+
+    def n_tasks(self):
+        '''
+        Return the number of batch tasks needed to run n_jobs chains
+        '''
+        chains = self.chains_per_task()
+        return (self.n_jobs() + chains - 1) / chains
+
+    def time_seconds(self):
+        '''
+        Return the time limit of the stage in seconds
+
+        Accepts slurm style [D-]HH:MM:SS strings.  Unquoted HH:MM:SS values
+        are already turned into seconds by the yml parser.
+        '''
+        value = self['time']
+        if isinstance(value, int):
+            return value
+        days = 0
+        if '-' in value:
+            days, value = value.split('-')
+        seconds = 0
+        for token in value.split(':'):
+            seconds = 60*seconds + int(token)
+        return int(days)*86400 + seconds
+
+    def heartbeat_interval(self):
+        '''
+        Return the number of seconds between heartbeat updates from running jobs,
+        default is 30
+        '''
+        if 'heartbeat_interval' in self.yml_dict:
+            return int(self.yml_dict['heartbeat_interval'])
+        return 30
+
+    def resource_interval(self):
+        '''
+        Return the seconds between samples of the memory, cpu and I/O used
+        by lar/gallery, default is 10.  0 disables the sampling
+        '''
+        if 'resource_interval' in self.yml_dict:
+            return float(self.yml_dict['resource_interval'])
+        return 10
+
+    def cache(self):
+        '''
+        Return the (location, maximum size in bytes) of the product cache
+        used by this stage, or None if the stage does not use one.  The
+        size is configured in GB, default is 1000
+        '''
+        if 'cache' not in self.yml_dict or not self.yml_dict['cache']:
+            return None
+        cache = self.yml_dict['cache']
+        if 'location' not in cache:
+            raise StageConfigException('location', "{0}/cache".format(self.name))
+        return cache['location'], int(float(cache.get('max_size', 1000)) * 1e9)
+
+    def checkpoint(self):
+        '''
+        Return whether jobs running several fcl files save the output of
+        each one, so a later attempt can resume after it, default is True
+        '''
+        if 'checkpoint' in self.yml_dict:
+            return bool(self.yml_dict['checkpoint'])
+        return True
+
+    def max_attempts(self):
+        '''
+        Return the number of failed jobs an input file can be part of before
+        it is abandoned by makeups, default is 3
+        '''
+        if 'max_attempts' in self.yml_dict:
+            return int(self.yml_dict['max_attempts'])
+        return 3
+
+    def max_makeups(self):
+        '''
+        Return the number of makeups --watch submits for this stage before
+        giving up on it, default is 3
+        '''
+        if 'max_makeups' in self.yml_dict:
+            return int(self.yml_dict['max_makeups'])
+        return 3
+
+    def escalation_factor(self):
+        '''
+        Return the factor applied to the memory or time of tasks made up
+        after running out of memory or time, default is 1.5
+        '''
+        if 'escalation_factor' in self.yml_dict:
+            return float(self.yml_dict['escalation_factor'])
+        return 1.5
+
+    def right_size(self):
+        '''
+        Return the settings for deriving memory and time from completed
+        jobs, or None to use the memory and time of the configuration
+        '''
+        if 'right_size' not in self.yml_dict or not self.yml_dict['right_size']:
+            return None
+        settings = {'quantile' : 0.95, 'headroom' : 1.25, 'min_jobs' : 10}
+        if isinstance(self.yml_dict['right_size'], dict):
+            settings.update(self.yml_dict['right_size'])
+        return settings
+
+    def adaptive_throttle(self):
+        '''
+        Return the targets for adapting the number of running tasks to the
+        load on the database and output file system in --watch, or None to
+        keep concurrent_jobs
+        '''
+        if 'adaptive_throttle' not in self.yml_dict or not self.yml_dict['adaptive_throttle']:
+            return None
+        settings = {'max_claim_latency'  : 5.0,
+                    'max_declare_time'   : 10.0,
+                    'min_stage_out_rate' : 10.0,
+                    'min_running'        : 1,
+                    'max_running'        : self.concurrent_jobs(),
+                    'step'               : max(1, self.concurrent_jobs() / 10),
+                    'backoff'            : 0.5}
+        if isinstance(self.yml_dict['adaptive_throttle'], dict):
+            settings.update(self.yml_dict['adaptive_throttle'])
+        return settings
+
+    def events_per_shard(self):
+        '''
+        Return the number of events in each range the input files are
+        split into, or None if input files are processed whole
+        '''
+        if 'events_per_shard' in self.yml_dict['input']:
+            return int(self.yml_dict['input']['events_per_shard'])
+        return None
+
+    def stage_inputs(self):
+        '''
+        Return whether input files are copied to local scratch before
+        processing, default is False
+        '''
+        if 'stage_inputs' in self.yml_dict['input']:
+            return bool(self.yml_dict['input']['stage_inputs'])
+        return False
+
+    def max_transfers(self):
+        '''
+        Return the maximum number of input files copied at the same time
+        by a job, default is two
+        '''
+        if 'max_transfers' in self.yml_dict['input']:
+            return int(self.yml_dict['input']['max_transfers'])
+        return 2
+
+    def output_transfers(self):
+        '''
+        Return the maximum number of output files copied at the same time
+        by a job, default is four
+        '''
+        if 'max_transfers' in self.yml_dict['output']:
+            return int(self.yml_dict['output']['max_transfers'])
+        return 4
+
+    def checksums(self):
+        '''
+        Return the checksums computed for the output files, default is
+        adler32 and crc32c (if the crc32c module is available)
+        '''
+        if 'checksums' in self.yml_dict['output']:
+            checksums = self.yml_dict['output']['checksums']
+            if checksums is None:
+                return []
+            if isinstance(checksums, str):
+                return [checksums]
+            return list(checksums)
+        return ['adler32', 'crc32c']
+
     def fcl(self):
         '''
         Return the fcl file for this stage.
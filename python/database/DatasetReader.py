@@ -197,6 +197,8 @@ class DatasetReader(ReaderBase):
             cons = 1
         elif state == "consumed":
             cons = 2
+        elif state == "abandoned":
+            cons = 3
         else:
             raise Exception("Can't check for files in state {0}, state is not known".format(state))
 
@@ -213,3 +215,74 @@ class DatasetReader(ReaderBase):
                 return conn.fetchone()[0]
             except Exception as e:
                 return None
+
+    def yielded_file_metadata(self, dataset, jobid):
+        '''Return the metadata of the input files yielded to a job
+
+        Arguments:
+            dataset {str} -- dataset consuming the files
+            jobid {str} -- job the files were yielded to
+
+        Returns:
+            dict -- {filename : {'size' : size, 'nevents' : nevents, ...}},
+            including the checksums of the file if the table has them
+        '''
+        table_name = "{0}_consumption".format(dataset)
+        select_sql = '''
+            SELECT inputfile, inputproject
+            FROM {table}
+            WHERE jobid=%s AND consumption=1
+        '''.format(table=table_name)
+        project_lookup_sql = '''
+            SELECT dataset
+            FROM dataset_master_index
+            WHERE id=%s
+        '''
+        # The checksum columns don't exist in older tables, so take
+        # whatever columns there are:
+        file_lookup_sql = '''
+            SELECT *
+            FROM   {table}
+            WHERE  id=%s
+        '''
+        keep = ('size', 'nevents', 'adler32', 'crc32c', 'sha256')
+
+        metadata = dict()
+        with self.connect() as conn:
+            conn.execute(select_sql, (jobid,))
+            results = conn.fetchall()
+            for fileid, projectid in results:
+                conn.execute(project_lookup_sql, (projectid,))
+                name = conn.fetchone()[0]
+                conn.execute(file_lookup_sql.format(table="{0}_metadata".format(name)), (fileid,))
+                row = dict(zip([d[0] for d in conn.description], conn.fetchone()))
+                metadata[row['filename']] = dict((k, row[k]) for k in keep if k in row)
+
+        return metadata
+
+    def job_statistics(self, dataset, steps=None):
+        '''Return the resources used by the jobs of a dataset
+
+        Arguments:
+            dataset {str} -- dataset the jobs produced
+
+        Keyword Arguments:
+            steps {str or None} -- only jobs that ran this comma separated list of fcl files (default: {None})
+
+        Returns:
+            list -- one {column : value} dict per job
+        '''
+        table_name = "{0}_statistics".format(dataset)
+        select_sql = '''
+            SELECT *
+            FROM {table}
+        '''.format(table=table_name)
+        feed_list = ()
+        if steps is not None:
+            select_sql += "WHERE steps=%s"
+            feed_list = (steps,)
+
+        with self.connect() as conn:
+            conn.execute(select_sql, feed_list)
+            columns = [d[0] for d in conn.description]
+            return [dict(zip(columns, row)) for row in conn.fetchall()]
@@ -62,29 +62,143 @@ class DatasetUtils(DatasetReader):
 
 
     def declare_file(self, dataset, filename,
-                     ftype, nevents, jobid, size):
+                     ftype, nevents, jobid, size, checksums=None):
 
         '''Declare a file to a dataset
 
-        Adds this file to the dataset table.  Does not update the consumption table.
+        Adds this file to the dataset table.  Does not update this dataset's
+        consumption table, nor the ones of its daughters (see feed_daughters).
         Returns the id of the file just added for use in updating the consumption table.
+
+        checksums is an optional dict of {algorithm : hex checksum}, stored in
+        the adler32, crc32c and sha256 columns.  Tables created before these
+        columns existed get the file without its checksums.
         '''
 
         table_name = "{0}_metadata".format(dataset)
+        columns = ['filename', 'type', 'nevents', 'jobid', 'size']
+        values = [filename, ftype, nevents, jobid, size]
+        if checksums is not None:
+            for algorithm in ('adler32', 'crc32c', 'sha256'):
+                if algorithm in checksums:
+                    columns.append(algorithm)
+                    values.append(checksums[algorithm])
+
         file_addition_sql = '''
-            INSERT INTO {name}(filename, type, nevents, jobid, size)
-            VALUES(%s,%s,%s,%s,%s)
-        '''.format(name=table_name)
-        values=(filename, ftype, nevents, jobid, size)
+            INSERT INTO {name}({columns})
+            VALUES({values})
+        '''
 
+        try:
+            with  self.connect() as conn:
+                conn.execute(file_addition_sql.format(name=table_name,
+                                                      columns=', '.join(columns),
+                                                      values=','.join(['%s']*len(values))),
+                             values)
+                this_id = conn.lastrowid
+        except Error as e:
+            # 1054 is an unknown column:
+            if len(columns) == 5 or e.args[0] != 1054:
+                raise
+            print("Table {0} has no checksum columns, declaring {1} without them".format(
+                table_name, filename))
+            return self.declare_file(dataset, filename, ftype, nevents, jobid, size)
 
-        with  self.connect() as conn:
+        return this_id
 
-            conn.execute(file_addition_sql, values)
-            this_id = conn.lastrowid
+    def feed_daughters(self, dataset, file_id, nevents):
+        '''Add a new file to the consumption tables of the daughters of its dataset
 
-        return this_id
+        Consumption tables are populated with the files of the parents when
+        they are created.  When a whole project is submitted at once, the
+        daughters are created before their parents have any file, so the
+        files are added here as they are declared instead, split in ranges
+        of the events_per_shard recorded with the parentage.  Jobs call it
+        once their inputs are consumed.
 
+        Adding a file twice does nothing (the rows are unique per file and
+        first event), so a file both here and in the rows the consumption
+        table is filled with when it is created is only there once.  A
+        daughter whose consumption table does not exist yet is skipped: it
+        gets the file when its table is filled.
+
+        Arguments:
+            dataset {str} -- dataset the file was declared to
+            file_id {int} -- id of the file in the metadata table
+            nevents {int} -- number of events in the file
+        '''
+        id_query_sql = '''
+            SELECT id
+            FROM dataset_master_index
+            WHERE dataset=%s
+        '''
+        with self.connect() as conn:
+            conn.execute(id_query_sql, (dataset,))
+            dataset_id = conn.fetchone()[0]
+
+        daughter_sql = '''
+            SELECT DISTINCT dataset_master_index.dataset, dataset_master_consumption.{shard}
+            FROM dataset_master_consumption
+            JOIN dataset_master_index ON dataset_master_index.id=dataset_master_consumption.output
+            WHERE dataset_master_consumption.input=%s
+        '''
+        try:
+            with self.connect() as conn:
+                conn.execute(daughter_sql.format(shard='events_per_shard'), (dataset_id,))
+                daughters = conn.fetchall()
+        except Error as e:
+            # 1054 is an unknown column, master tables from before events_per_shard existed:
+            if e.args[0] != 1054:
+                raise
+            with self.connect() as conn:
+                conn.execute(daughter_sql.format(shard='NULL'), (dataset_id,))
+                daughters = conn.fetchall()
+
+        for daughter, events_per_shard in daughters:
+            insertion_data = []
+            if events_per_shard is None or nevents is None:
+                # Without its number of events the file can only be read whole:
+                insertion_data.append([file_id, dataset_id, 0, None])
+            else:
+                for first_event in xrange(0, nevents, events_per_shard):
+                    insertion_data.append([file_id, dataset_id, first_event,
+                                           min(events_per_shard, nevents - first_event)])
+            file_insertion_sql = '''
+                INSERT IGNORE INTO {name}(inputfile, inputproject, firstevent, nevents)
+                VALUES (%s,%s,%s,%s)
+            '''.format(name="{0}_consumption".format(daughter))
+
+            try:
+                with self.connect() as conn:
+                    conn.executemany(file_insertion_sql, insertion_data)
+            except Error as e:
+                # 1146 is an unknown table, the daughter is still being created:
+                if e.args[0] != 1146:
+                    raise
+                print("No consumption table for dataset {0} yet, it will get file {1} when created".format(
+                    daughter, file_id))
+
+
+    def record_job_statistics(self, dataset, jobid, statistics):
+        '''Store the resources used by a job
+
+        Arguments:
+            dataset {str} -- dataset the job produced files for
+            jobid {str} -- id of the job
+            statistics {dict} -- {column : value} of the statistics table
+        '''
+        table_name = "{0}_statistics".format(dataset)
+        columns = ['jobid'] + sorted(statistics.keys())
+        values = [jobid] + [statistics[c] for c in columns[1:]]
+        insert_sql = '''
+            INSERT INTO {name}({columns})
+            VALUES({values})
+        '''.format(name=table_name,
+                   columns=', '.join(columns),
+                   values=','.join(['%s']*len(values)))
+
+        with self.connect() as conn:
+            conn.execute(insert_sql, values)
 
     def delete_file(self, dataset, file_ids=None, file_names=None):
         '''Delete a file from the dataset table
@@ -122,11 +236,15 @@ class DatasetUtils(DatasetReader):
         return
 
 
-    def yield_files(self, dataset, n, jobid):
+    def yield_files(self, dataset, n, jobid, ranges=False):
         '''Pull files from the consumption table
 
         Gathers files that meet specified criteria and returns
         a tuple of ( (dataset_id, file_id), ...) up to n files
+
+        If ranges is True, returns a list of (filename, firstevent, nevents)
+        instead, for consumption tables split into event ranges.  nevents
+        is None when the whole file is to be processed.
         '''
 
         # Need to unpack the arguments:
@@ -148,11 +266,17 @@ class DatasetUtils(DatasetReader):
 
         # Now, select the files that have been marked for this job:
 
+        # Consumption tables made before event ranges existed don't
+        # have the range columns, so only ask for them when needed:
+        if ranges:
+            columns = 'inputfile, inputproject, firstevent, nevents'
+        else:
+            columns = 'inputfile, inputproject, 0, NULL'
         select_sql = '''
-            SELECT inputfile, inputproject
+            SELECT {columns}
             FROM {table}
             WHERE jobid=%s AND consumption=1
-        '''.format(table=table_name)
+        '''.format(columns=columns, table=table_name)
 
         with self.connect() as conn:
             select_list = (jobid,)
@@ -173,16 +297,105 @@ class DatasetUtils(DatasetReader):
         '''
 
         yielded_files = []
-        for [fileid, projectid] in results:
+        for [fileid, projectid, firstevent, nevents] in results:
             with self.connect() as conn:
                 conn.execute(project_lookup_sql, (projectid,))
                 name = conn.fetchone()[0]
                 table_name = "{0}_metadata".format(name)
                 conn.execute(file_lookup_sql.format(table=table_name), (fileid,) )
-                yielded_files.append(conn.fetchone()[0])
+                if ranges:
+                    yielded_files.append((conn.fetchone()[0], firstevent, nevents))
+                else:
+                    yielded_files.append(conn.fetchone()[0])
 
         return yielded_files
 
+    def release_files(self, dataset, jobid):
+        '''Give back files yielded to a job that will not process them
+
+        Arguments:
+            dataset {str} -- dataset consuming the files
+            jobid {str} -- job the files were yielded to
+        '''
+        table_name = "{0}_consumption".format(dataset)
+        update_sql = '''
+            UPDATE {table}
+            SET consumption=0, jobid=NULL
+            WHERE consumption=1 AND jobid=%s
+        '''.format(table=table_name)
+
+        with self.connect() as conn:
+            conn.execute(update_sql, (jobid,))
+        return
+
+    def reset_failed_jobs(self, dataset, jobids, max_attempts=None, whole_tasks=True):
+        '''Give back the files yielded to failed array tasks
+
+        Rows are matched on the part of their job id before the first '.',
+        so the rows of every pilot iteration or packed chain of a task are
+        reset.  With whole_tasks False, only rows of exactly these job ids
+        are, for a pilot iteration that failed while the pilot goes on.
+        Each reset row counts one more attempt, and rows that reached
+        max_attempts are abandoned (consumption=3) instead.
+
+        Arguments:
+            dataset {str} -- dataset consuming the files
+            jobids {list} -- [array job id]_[task index] of the failed tasks
+
+        Keyword Arguments:
+            max_attempts {int or None} -- attempts before a file is abandoned (default: {None})
+            whole_tasks {bool} -- match every job id of the tasks (default: {True})
+
+        Returns:
+            tuple -- (number of rows reset, number of rows abandoned)
+        '''
+        if len(jobids) == 0:
+            return 0, 0
+        table_name = "{0}_consumption".format(dataset)
+        column = "SUBSTRING_INDEX(jobid, '.', 1)" if whole_tasks else "jobid"
+        match = "consumption=1 AND {0} IN ({1})".format(column, ','.join(['%s']*len(jobids)))
+
+        if max_attempts is None:
+            max_attempts = 2**31 - 1
+
+        # Assignments are done left to right, the later ones see the new attempts:
+        update_sql = '''
+            UPDATE {table}
+            SET attempts = attempts + 1,
+                consumption = IF(attempts >= %s, 3, 0),
+                jobid = IF(attempts >= %s, jobid, NULL)
+            WHERE {match}
+        '''.format(table=table_name, match=match)
+        count_sql = '''
+            SELECT COUNT(id)
+            FROM {table}
+            WHERE {match}
+        '''.format(table=table_name, match=match.replace('consumption=1', 'consumption=3'))
+
+        try:
+            with self.connect() as conn:
+                conn.execute(count_sql, jobids)
+                n_abandoned_before = conn.fetchone()[0]
+                conn.execute(update_sql, [max_attempts, max_attempts] + list(jobids))
+                n_rows = conn.rowcount
+                conn.execute(count_sql, jobids)
+                n_abandoned = conn.fetchone()[0] - n_abandoned_before
+        except Error as e:
+            # 1054 is an unknown column, tables from before attempts existed:
+            if e.args[0] != 1054:
+                raise
+            update_sql = '''
+                UPDATE {table}
+                SET consumption=0, jobid=NULL
+                WHERE {match}
+            '''.format(table=table_name, match=match)
+            with self.connect() as conn:
+                conn.execute(update_sql, jobids)
+                n_rows = conn.rowcount
+            n_abandoned = 0
+
+        return n_rows - n_abandoned, n_abandoned
+
     def consume_files(self, dataset, jobid, output_file_id):
 
         # Update the consumpution table for these files:
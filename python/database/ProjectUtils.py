@@ -61,13 +61,14 @@ class ProjectUtils(ProjectReader):
                 return False
         return True
 
-    def create_dataset(self, dataset, parents=None):
+    def create_dataset(self, dataset, parents=None, events_per_shard=None):
         '''Create a new dataset
 
         This function creates the tables for this dataset
         This creates the tables:
          - [dataset_name]_metadata
          - [dataset_name]_search
+         - [dataset_name]_statistics
 
         If parents is not None, the table [dataset_name]_consumption is
         created and populated
@@ -76,8 +77,16 @@ class ProjectUtils(ProjectReader):
 
         If parents is None, the table dataset_master_consumption is updated
 
+        If events_per_shard is not None, each input file is split into
+        event ranges of that size in the consumption table, and each range
+        is yielded and consumed on its own.
+
         Arguments:
             dataset {[type]} -- [description]
+
+        Keyword Arguments:
+            parents {list or None} -- names of the parent datasets (default: {None})
+            events_per_shard {int or None} -- events per consumption row (default: {None})
         '''
 
 
@@ -92,20 +101,31 @@ class ProjectUtils(ProjectReader):
             parent_ids = self.dataset_ids(parents)
             if parent_ids is None:
                 raise Exception("Couldn't get primary keys for specified parents")
+            # The shard size is kept with the parentage, so files declared
+            # to the parents later are split the same way (see DatasetUtils.feed_daughters):
             consupmtion_parentage_sql = '''
+                INSERT INTO dataset_master_consumption(input,output,events_per_shard)
+                VALUES (%s,%s,%s);
+            '''
+            legacy_parentage_sql = '''
                 INSERT INTO dataset_master_consumption(input,output)
                 VALUES (%s,%s);
             '''
 
-
-
             with self.connect() as conn:
                 for parent_id in parent_ids:
                     try:
-                        conn.execute(consupmtion_parentage_sql, (parent_id, primary_index))
+                        conn.execute(consupmtion_parentage_sql, (parent_id, primary_index, events_per_shard))
                     except Error as e:
-                        print e
-                        return False
+                        # 1054 is an unknown column, master tables from before events_per_shard existed:
+                        if e.args[0] != 1054:
+                            print e
+                            return False
+                        try:
+                            conn.execute(legacy_parentage_sql, (parent_id, primary_index))
+                        except Error as e:
+                            print e
+                            return False
 
 
         # At this point, the dataset has been added to the dataset_master_index
@@ -118,8 +138,11 @@ class ProjectUtils(ProjectReader):
         if not self.create_dataset_metadata_table(dataset):
             return False
 
+        if not self.create_dataset_statistics_table(dataset):
+            return False
+
         if parents is not None:
-            if not self.create_dataset_consumption_table(dataset, parents):
+            if not self.create_dataset_consumption_table(dataset, parents, events_per_shard):
                 return False
 
         # We are finished here, return True
@@ -138,6 +161,9 @@ class ProjectUtils(ProjectReader):
                 created  TIMESTAMP     NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 jobid    VARCHAR(50)   NOT NULL,
                 size     BIGINT        NOT NULL,
+                adler32  CHAR(8),
+                crc32c   CHAR(8),
+                sha256   CHAR(64),
                 PRIMARY KEY (id)
             ); """.format(name=table_name)
 
@@ -150,7 +176,37 @@ class ProjectUtils(ProjectReader):
                 return False
         return True
 
-    def create_dataset_consumption_table(self, dataset, parents):
+    def create_dataset_statistics_table(self, dataset):
+        table_name = "{0}_statistics".format(dataset)
+        statistics_table_creation_sql = """
+            CREATE TABLE IF NOT EXISTS {name} (
+                id                INTEGER       NOT NULL AUTO_INCREMENT,
+                jobid             VARCHAR(50)   NOT NULL,
+                host              VARCHAR(100),
+                steps             TEXT(500),
+                nevents           INTEGER,
+                walltime          FLOAT,
+                cputime           FLOAT,
+                cpu_efficiency    FLOAT,
+                peak_rss          BIGINT,
+                events_per_second FLOAT,
+                read_bytes        BIGINT,
+                write_bytes       BIGINT,
+                created           TIMESTAMP     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id),
+                INDEX (jobid)
+            ); """.format(name=table_name)
+
+        with self.admin_connect() as conn:
+            try:
+                conn.execute(statistics_table_creation_sql)
+            except Error as e:
+                print e
+                print "Could not create statistics table"
+                return False
+        return True
+
+    def create_dataset_consumption_table(self, dataset, parents, events_per_shard=None):
         table_name = "{0}_consumption".format(dataset)
         output_file_table = "{0}_metadata".format(dataset)
         search_table_creation_sql = """
@@ -158,10 +214,14 @@ class ProjectUtils(ProjectReader):
                 id           INTEGER  NOT NULL AUTO_INCREMENT,
                 inputfile    INTEGER  NOT NULL,
                 inputproject INTEGER  NOT NULL,
+                firstevent   INTEGER  NOT NULL DEFAULT 0,
+                nevents      INTEGER,
                 outputfile   INTEGER,
                 jobid        VARCHAR(25),
                 consumption  INTEGER  NOT NULL DEFAULT 0,
-                PRIMARY KEY (id)
+                attempts     INTEGER  NOT NULL DEFAULT 0,
+                PRIMARY KEY (id),
+                UNIQUE KEY (inputfile, inputproject, firstevent)
             ); """.format(name=table_name)
 
         with self.admin_connect() as conn:
@@ -185,7 +245,7 @@ class ProjectUtils(ProjectReader):
             # Only take full output files
             table_name = "{0}_metadata".format(parent)
             selection_sql = """
-                SELECT id FROM {name}
+                SELECT id, nevents FROM {name}
                 WHERE (type=0)
             """.format(name=table_name)
 
@@ -193,12 +253,22 @@ class ProjectUtils(ProjectReader):
                 conn.execute(selection_sql)
                 file_ids = conn.fetchall()
 
-            # Prepare data for insertion:
-            insertion_data = [ [file_id[0], parent_id ] for file_id in file_ids]
+            # Prepare data for insertion.  A NULL nevents means the whole file,
+            # otherwise each row is one range of events of the input file:
+            insertion_data = []
+            for file_id, nevents in file_ids:
+                if events_per_shard is None or nevents is None:
+                    # Without its number of events the file can only be read whole:
+                    insertion_data.append([file_id, parent_id, 0, None])
+                    continue
+                for first_event in xrange(0, nevents, events_per_shard):
+                    insertion_data.append([file_id, parent_id, first_event,
+                                           min(events_per_shard, nevents - first_event)])
             table_name = "{0}_consumption".format(dataset)
+            # Files may also be added as they are declared, see DatasetUtils.feed_daughters:
             file_insertion_sql = '''
-                INSERT INTO {name}(inputfile, inputproject)
-                VALUES (%s,%s)
+                INSERT IGNORE INTO {name}(inputfile, inputproject, firstevent, nevents)
+                VALUES (%s,%s,%s,%s)
             '''.format(name=table_name)
 
             with self.connect() as conn:
@@ -212,6 +282,7 @@ class ProjectUtils(ProjectReader):
         Removes the following tables from the database:
          - dataset_metadata
          - dataset_consumption (if exists)
+         - dataset_statistics (if exists)
 
         Additionally, if this dataset has parents:
          - the master_dataset_consumption table is updated
@@ -295,6 +366,14 @@ class ProjectUtils(ProjectReader):
                 print e
                 return False
 
+            table_name = "{0}_statistics".format(dataset)
+            drop_table_sql = '''DROP TABLE IF EXISTS {table};'''.format(table=table_name)
+            try:
+                conn.execute(drop_table_sql)
+            except Error as e:
+                print e
+                return False
+
 
             # Remove this entry from the index:
             self.delete_dataset_from_index(dataset)
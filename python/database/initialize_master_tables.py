@@ -24,6 +24,7 @@ def main():
             id     INTEGER  NOT NULL AUTO_INCREMENT,
             input  INTEGER  NOT NULL,
             output INTEGER  NOT NULL,
+            events_per_shard INTEGER,
             FOREIGN KEY(input)  REFERENCES dataset_master_index(id) ON UPDATE CASCADE,
             FOREIGN KEY(output) REFERENCES dataset_master_index(id) ON UPDATE CASCADE,
             PRIMARY KEY (id)
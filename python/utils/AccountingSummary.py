@@ -0,0 +1,156 @@
+from ResourceEstimator import quantile
+from SlurmAccounting import FAILED_STATES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Quantiles reported for each distribution:
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def failure_class(task):
+    '''Return the class of failure of a task, None if it did not fail
+
+    Classes are out_of_memory, timeout, node_failure, preempted, cancelled
+    (by the user or a failed dependency) and error:[exit code] for tasks
+    the job itself failed.
+    '''
+    state = task['state']
+    if state not in FAILED_STATES:
+        return None
+    if state == 'OUT_OF_MEMORY':
+        return 'out_of_memory'
+    if state in ('TIMEOUT', 'DEADLINE'):
+        return 'timeout'
+    if state in ('NODE_FAIL', 'BOOT_FAIL'):
+        return 'node_failure'
+    if state == 'PREEMPTED':
+        return 'preempted'
+    if state == 'CANCELLED':
+        return 'cancelled'
+    if state == 'FAILED':
+        # sacct writes [return code]:[signal]:
+        return 'error:{0}'.format((task['exitcode'] or '?').split(':')[0])
+    return state.lower()
+
+
+def column(tasks, key):
+    '''
+    Return a column of the tasks, as a float array with nan for unknown values if numpy is there
+    '''
+    values = [task[key] for task in tasks]
+    if numpy is not None:
+        return numpy.array([value if value is not None else numpy.nan for value in values],
+                           dtype=float)
+    return values
+
+
+def ratio(numerator, denominator, scale=1.):
+    '''
+    Return scale*numerator/denominator for the tasks where both are known, and the denominator positive
+    '''
+    if numpy is not None:
+        with numpy.errstate(invalid='ignore'):
+            mask = numpy.isfinite(numerator) & numpy.isfinite(denominator) & (denominator > 0)
+        return scale * numerator[mask] / denominator[mask]
+    return [scale * n / d for n, d in zip(numerator, denominator)
+            if n is not None and d is not None and d > 0]
+
+
+def known(values):
+    '''
+    Return the values of a column that are known
+    '''
+    if numpy is not None:
+        return values[numpy.isfinite(values)]
+    return [value for value in values if value is not None]
+
+
+def product(first, second):
+    if numpy is not None:
+        return first * second
+    return [a * b if a is not None and b is not None else None for a, b in zip(first, second)]
+
+
+def distribution(values):
+    '''Summarize values with their number, mean and QUANTILES
+
+    Returns:
+        dict or None -- n, mean and p10, p50, p90, None without values
+    '''
+    if len(values) == 0:
+        return None
+    if numpy is not None:
+        points = numpy.percentile(values, [100 * q for q in QUANTILES])
+        mean = float(numpy.mean(values))
+    else:
+        points = [quantile(values, q) for q in QUANTILES]
+        mean = sum(values) / float(len(values))
+    summary = {'n' : len(values), 'mean' : mean}
+    for q, point in zip(QUANTILES, points):
+        summary['p{0:.0f}'.format(100 * q)] = float(point)
+    return summary
+
+
+def total(values):
+    return float(sum(known(values)))
+
+
+def summarize(tasks):
+    '''Summarize the accounting of the tasks of a stage
+
+    Efficiencies are computed on the completed tasks only:
+     - cpu_efficiency: TotalCPU / (Elapsed * allocated cpus)
+     - memory_headroom: 1 - MaxRSS / ReqMem, the fraction of the request unused
+     - events_per_core_hour: events in the catalog for the task / (Elapsed * cpus)
+     - queue_wait: seconds from submission to start, of every task that started
+    and the failures of all attempts are counted by failure_class.
+
+    Arguments:
+        tasks {list} -- dicts with the columns of the accounting table of the
+            ledger (SubmissionLedger.accounting)
+
+    Returns:
+        dict -- n_tasks, states, failures, distributions of the above (see
+        distribution), core_hours and events of the completed tasks, and
+        events_per_core_hour_total
+    '''
+    states = dict()
+    failures = dict()
+    for task in tasks:
+        states[task['state']] = states.get(task['state'], 0) + 1
+        failed = failure_class(task)
+        if failed is not None:
+            failures[failed] = failures.get(failed, 0) + 1
+
+    completed = [task for task in tasks if task['state'] == 'COMPLETED']
+    elapsed = column(completed, 'elapsed')
+    core_seconds = product(elapsed, column(completed, 'ncpus'))
+    cpu_efficiency = ratio(column(completed, 'totalcpu'), core_seconds)
+    memory_used = ratio(column(completed, 'maxrss'), column(completed, 'reqmem'))
+    nevents = column(completed, 'nevents')
+    events_per_core_hour = ratio(nevents, core_seconds, 3600.)
+    started = [task for task in tasks if task['start'] is not None and task['submit'] is not None]
+    queue_wait = [task['start'] - task['submit'] for task in started]
+
+    core_hours = total(core_seconds) / 3600.
+    with_events = [task for task in completed if task['nevents'] is not None]
+    events_core_hours = total(product(column(with_events, 'elapsed'),
+                                      column(with_events, 'ncpus'))) / 3600.
+
+    return {
+        'n_tasks'                    : len(tasks),
+        'states'                     : states,
+        'failures'                   : failures,
+        'elapsed'                    : distribution(known(elapsed)),
+        'cpu_efficiency'             : distribution(cpu_efficiency),
+        'memory_headroom'            : distribution([1. - used for used in memory_used]),
+        'events_per_core_hour'       : distribution(events_per_core_hour),
+        'queue_wait'                 : distribution(queue_wait),
+        'core_hours'                 : core_hours,
+        'events'                     : total(nevents),
+        'events_per_core_hour_total' : total(column(with_events, 'nevents')) / events_core_hours
+                                       if events_core_hours > 0 else None,
+    }
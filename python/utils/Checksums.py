@@ -0,0 +1,107 @@
+import os
+import zlib
+import hashlib
+
+# crc32c is only available if the (optional) crc32c module is installed:
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+# Size of the buffer reused for every read:
+BUFFER_SIZE = 8*1024*1024
+
+
+def available_algorithms():
+    '''
+    Return the names of the checksums that can be computed here
+    '''
+    algorithms = ['adler32', 'sha256']
+    if crc32c is not None:
+        algorithms.append('crc32c')
+    return algorithms
+
+
+class Checksums(object):
+    '''
+    Running checksums of a stream of data.
+
+    Values are reported as hex strings: 8 characters for adler32 and
+    crc32c (the convention of xrootd and dCache), 64 for sha256.
+    '''
+    def __init__(self, algorithms=('adler32',)):
+        super(Checksums, self).__init__()
+        self.algorithms = [a for a in algorithms if a in available_algorithms()]
+        self._adler32 = 1
+        self._crc32c = 0
+        self._sha256 = hashlib.sha256() if 'sha256' in self.algorithms else None
+
+    def update(self, data):
+        if 'adler32' in self.algorithms:
+            self._adler32 = zlib.adler32(data, self._adler32)
+        if 'crc32c' in self.algorithms:
+            self._crc32c = crc32c.crc32c(data, self._crc32c)
+        if self._sha256 is not None:
+            self._sha256.update(data)
+
+    def values(self):
+        '''
+        Return a dict of {algorithm : hex checksum}
+        '''
+        values = dict()
+        if 'adler32' in self.algorithms:
+            values['adler32'] = "{0:08x}".format(self._adler32 & 0xffffffff)
+        if 'crc32c' in self.algorithms:
+            values['crc32c'] = "{0:08x}".format(self._crc32c & 0xffffffff)
+        if self._sha256 is not None:
+            values['sha256'] = self._sha256.hexdigest()
+        return values
+
+
+def _stream(source, checksums, destination=None):
+    '''Read source once through a reused buffer, feeding the checksums
+    and optionally writing each chunk to destination
+
+    Returns:
+        int -- number of bytes read
+    '''
+    data = bytearray(BUFFER_SIZE)
+    n_bytes = 0
+    with open(source, 'rb') as _in:
+        while True:
+            n = _in.readinto(data)
+            if not n:
+                break
+            # A buffer is a view of the bytearray, nothing is copied:
+            chunk = buffer(data, 0, n)
+            checksums.update(chunk)
+            if destination is not None:
+                destination.write(chunk)
+            n_bytes += n
+    return n_bytes
+
+
+def checksum_file(path, algorithms=('adler32',)):
+    '''Compute the checksums of a file
+
+    Returns:
+        dict -- {algorithm : hex checksum}
+    '''
+    checksums = Checksums(algorithms)
+    _stream(path, checksums)
+    return checksums.values()
+
+
+def copy_with_checksums(source, destination, algorithms=('adler32',)):
+    '''Copy source to destination, computing checksums in the same pass
+
+    Returns:
+        tuple -- (number of bytes copied, {algorithm : hex checksum})
+    '''
+    checksums = Checksums(algorithms)
+    with open(destination, 'wb') as _out:
+        n_bytes = _stream(source, checksums, _out)
+        _out.flush()
+        os.fsync(_out.fileno())
+    return n_bytes, checksums.values()
+
@@ -0,0 +1,218 @@
+import heapq
+import math
+import random
+
+from ResourceEstimator import quantile
+from AccountingSummary import QUANTILES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Factors applied to the concurrency and to the events per job of every
+# stage to show how sensitive the completion is to them:
+SENSITIVITY_FACTORS = (0.5, 2.)
+
+
+def schedule(durations, waits, ready, slots):
+    '''Return the end of every job of a stage, for each replica
+
+    Jobs are started in order on the first slot that frees up, like the
+    tasks of an array held by a % cap: a job takes its slot when it is
+    released, waits in the queue, then runs.  A job is not released before
+    its ready time (the end of what it depends on).
+
+    Arguments:
+        durations {array} -- [replica][job] seconds each job runs
+        waits {array} -- [replica][job] seconds each job waits in the queue
+        ready {array} -- [replica][job] earliest release of each job
+        slots {int} -- jobs running or queued at once
+
+    Returns:
+        array -- [replica][job] end of the jobs, in seconds from now
+    '''
+    if numpy is not None:
+        durations = numpy.asarray(durations, dtype=float)
+        waits = numpy.asarray(waits, dtype=float)
+        start = numpy.asarray(ready, dtype=float)
+        n_replicas, n_jobs = durations.shape
+        if slots >= n_jobs:
+            return start + waits + durations
+        # All replicas advance together, one job at a time:
+        free = numpy.zeros((n_replicas, slots))
+        ends = numpy.empty((n_replicas, n_jobs))
+        rows = numpy.arange(n_replicas)
+        for job in xrange(n_jobs):
+            slot = free.argmin(axis=1)
+            ends[:, job] = numpy.maximum(free[rows, slot], start[:, job]) + waits[:, job] + durations[:, job]
+            free[rows, slot] = ends[:, job]
+        return ends
+
+    ends = []
+    for replica_durations, replica_waits, replica_ready in zip(durations, waits, ready):
+        free = [0.] * min(slots, len(replica_durations))
+        replica_ends = []
+        for duration, wait, job_ready in zip(replica_durations, replica_waits, replica_ready):
+            end = max(heapq.heappop(free), job_ready) + wait + duration
+            heapq.heappush(free, end)
+            replica_ends.append(end)
+        ends.append(replica_ends)
+    return ends
+
+
+def makespan(ends):
+    '''
+    Return the end of the last job of each replica, 0 without jobs
+    '''
+    if numpy is not None:
+        ends = numpy.asarray(ends, dtype=float)
+        if ends.shape[1] == 0:
+            return numpy.zeros(ends.shape[0])
+        return ends.max(axis=1)
+    return [max(replica) if len(replica) > 0 else 0. for replica in ends]
+
+
+def quantiles(values):
+    '''
+    Return the QUANTILES of the completion times, as {p10, p50, p90}
+    '''
+    if numpy is not None:
+        points = numpy.percentile(values, [100 * q for q in QUANTILES])
+    else:
+        points = [quantile(list(values), q) for q in QUANTILES]
+    return dict(('p{0:.0f}'.format(100 * q), float(point)) for q, point in zip(QUANTILES, points))
+
+
+class CompletionForecast(object):
+    '''
+    Forecasts when the stages of a project finish by simulating them many
+    times (replicas), drawing the run time and queue wait of every job
+    from what the stage and the cluster did so far.
+
+    Each stage runs its remaining jobs on a number of slots (its
+    concurrency).  A stage depending on other stages does not release a
+    job before they finish, or with correlated (aftercorr) dependencies
+    before the upstream job with the same index finishes.  The draws are
+    vectorized with numpy when it is there, and the replicas are
+    scheduled together, see schedule.
+    '''
+    def __init__(self, stages, replicas=200, seed=None):
+        '''
+        Arguments:
+            stages {list} -- one dict per stage, upstream stages first, with
+                name, n_jobs (jobs left to run), slots, durations (seconds
+                jobs of the stage ran), waits (seconds jobs waited in the
+                queue), startup (seconds of a job that do not depend on its
+                events), upstream (names of the stages it reads) and
+                correlated (whether job i only waits for upstream job i)
+
+        Keyword Arguments:
+            replicas {int} -- number of simulations (default: {200})
+            seed {int or None} -- seed of the draws, for reproducible forecasts (default: {None})
+        '''
+        super(CompletionForecast, self).__init__()
+        self.stages = stages
+        self.replicas = replicas
+        self.seed = seed
+
+    def draw(self, generator, samples, n_jobs):
+        '''
+        Return [replica][job] values drawn from the samples with replacement
+        '''
+        if numpy is not None:
+            return generator.choice(numpy.asarray(samples, dtype=float), size=(self.replicas, n_jobs))
+        return [[generator.choice(samples) for _ in xrange(n_jobs)] for _ in xrange(self.replicas)]
+
+    def run(self, concurrency=1., events_per_job=1.):
+        '''Simulate the stages, scaling their concurrency and events per job
+
+        With events_per_job f, a stage runs 1/f as many jobs, each lasting
+        its startup plus f times the rest of the duration drawn.
+
+        Keyword Arguments:
+            concurrency {float} -- factor on the slots of every stage (default: {1.})
+            events_per_job {float} -- factor on the events of every job (default: {1.})
+
+        Returns:
+            dict -- {stage name : completion of each replica}, and the
+            completion of the whole project under 'project', in seconds from now
+        '''
+        generator = numpy.random.RandomState(self.seed) if numpy is not None else random.Random(self.seed)
+        ends = dict()
+        completion = dict()
+        for stage in self.stages:
+            n_jobs = int(math.ceil(stage['n_jobs'] / events_per_job))
+            slots = max(1, int(round(stage['slots'] * concurrency)))
+            durations = [stage['startup'] + events_per_job * max(0., duration - stage['startup'])
+                         for duration in stage['durations']]
+            drawn = self.draw(generator, durations, n_jobs)
+            waits = self.draw(generator, stage['waits'], n_jobs)
+
+            upstream = [name for name in stage['upstream'] if name in ends]
+            ready = [[0.] * n_jobs for _ in xrange(self.replicas)]
+            if numpy is not None:
+                ready = numpy.zeros((self.replicas, n_jobs))
+            for name in upstream:
+                ready = self.upstream_ready(ready, ends[name], completion[name],
+                                            stage['correlated'] and len(upstream) == 1)
+
+            ends[stage['name']] = schedule(drawn, waits, ready, slots)
+            completion[stage['name']] = makespan(ends[stage['name']])
+            # A stage with nothing left finishes when what it reads does:
+            for name in upstream:
+                completion[stage['name']] = self.latest(completion[stage['name']], completion[name])
+
+        project = [0.] * self.replicas if numpy is None else numpy.zeros(self.replicas)
+        for times in completion.values():
+            project = self.latest(project, times)
+        completion['project'] = project
+        return completion
+
+    def upstream_ready(self, ready, upstream_ends, upstream_completion, correlated):
+        '''
+        Delay the release of the jobs of a stage to the end of the upstream jobs they wait for
+        '''
+        if numpy is not None:
+            if not correlated:
+                return numpy.maximum(ready, upstream_completion[:, numpy.newaxis])
+            # The jobs left are the last ones of both stages, the first jobs
+            # of the stage left have their upstream job done already:
+            n_shared = min(ready.shape[1], upstream_ends.shape[1])
+            if n_shared > 0:
+                ready[:, -n_shared:] = numpy.maximum(ready[:, -n_shared:], upstream_ends[:, -n_shared:])
+            return ready
+        updated = []
+        for replica_ready, replica_ends, replica_completion in zip(ready, upstream_ends,
+                                                                   upstream_completion):
+            if not correlated:
+                updated.append([max(job_ready, replica_completion) for job_ready in replica_ready])
+                continue
+            shift = len(replica_ends) - len(replica_ready)
+            updated.append([max(job_ready, replica_ends[job + shift]) if job + shift >= 0 else job_ready
+                            for job, job_ready in enumerate(replica_ready)])
+        return updated
+
+    def latest(self, first, second):
+        if numpy is not None:
+            return numpy.maximum(first, second)
+        return [max(a, b) for a, b in zip(first, second)]
+
+    def forecast(self):
+        '''Forecast the completion of the stages, and its sensitivity
+
+        Returns:
+            dict -- completion: {stage name or 'project' : QUANTILES of its
+            completion}, and sensitivity: one dict per scenario with
+            parameter (concurrency or events_per_job), factor and completion
+            (QUANTILES of the completion of the project)
+        '''
+        completion = dict((name, quantiles(times)) for name, times in self.run().iteritems())
+        sensitivity = []
+        for parameter in ['concurrency', 'events_per_job']:
+            for factor in SENSITIVITY_FACTORS:
+                times = self.run(**{parameter : factor})
+                sensitivity.append({'parameter'  : parameter,
+                                    'factor'     : factor,
+                                    'completion' : quantiles(times['project'])})
+        return {'completion' : completion, 'sensitivity' : sensitivity}
@@ -31,23 +31,30 @@ class GalleryRunner(JobRunner):
         Run the actual larsoft job with subprocess
         Since each stage can take multiple fcl files, this captures the information
         from each individually.  It feeds the output of one into the input for the next
+
+        Returns True if a job was run, False if there were no input files left.
         '''
 
         dataset_util = DatasetUtils()
 
+        self.start_monitor(job_id)
+
         print self.out_dir
         # To run the job, we move to the scratch directory:
         print("Changing directory to " + self.work_dir)
         with cd(self.work_dir):
 
             # Prepare the first input files, if there are any:
+            inputs, event_range = self.claim_inputs(dataset_util, job_id)
             if self.stage.has_input():
-                print self.stage.n_files()
-                inputs = dataset_util.yield_files(self.stage.output_dataset(),
-                                                  self.stage.n_files(),
-                                                  job_id)
-                print inputs
+                if len(inputs) == 0:
+                    print("No input files left to process.")
+                    self.monitor.stop('finished')
+                    self.abandon_job()
+                    return False
                 original_inputs = inputs
+                # While this job runs, start staging the inputs of the next one:
+                self.prefetch_inputs(dataset_util)
             else:
                 inputs = None
                 original_inputs = None
@@ -95,15 +102,12 @@ class GalleryRunner(JobRunner):
                     continue
                 os.remove(file_name)
 
-        # Copy the output files to the output directory
-        src_files = os.listdir(self.work_dir)
-        for file_name in src_files:
-            full_file_name = os.path.join(self.work_dir, file_name)
-            if (os.path.isfile(full_file_name)):
-                shutil.copy(full_file_name, self.out_dir)
+        # Move the output files to the output directory
+        checksums = self.stage_out()
 
 
         # Declare the output to the database
+        declare_start = time.time()
         if self.output_file is not None:
             output_size = os.path.getsize(self.out_dir + self.output_file)
             out_id = dataset_util.declare_file(dataset=self.stage.output_dataset(),
@@ -111,7 +115,8 @@ class GalleryRunner(JobRunner):
                                      ftype=0,
                                      nevents=self.n_events,
                                      jobid=job_id,
-                                     size=output_size)
+                                     size=output_size,
+                                     checksums=checksums.get(self.out_dir + self.output_file))
 
 
         ana_size = os.path.getsize(self.out_dir + self.ana_file)
@@ -120,7 +125,8 @@ class GalleryRunner(JobRunner):
                                  nevents=self.n_events,
                                  ftype=1,
                                  jobid=job_id,
-                                 size=ana_size)
+                                 size=ana_size,
+                                 checksums=checksums.get(self.out_dir + self.ana_file))
 
         if self.stage['output']['anaonly']:
             out_id = ana_id
@@ -128,10 +134,19 @@ class GalleryRunner(JobRunner):
         # finalize the input:
         if original_inputs is not None:
             dataset_util.consume_files(self.stage.output_dataset(), job_id, out_id)
+        if self.output_file is not None and not self.stage['output']['anaonly']:
+            self.feed_daughters(dataset_util, out_id)
+        self.record_declare_time(declare_start)
+
+        self.record_statistics(dataset_util, job_id)
 
         # Clear out the work directory:
         shutil.rmtree(self.work_dir)
 
+        self.monitor.stop('finished')
+
+        return True
+
     def run_script(self, fcl, input_files, env=None):
         '''Run a fcl file as part of a job
 
@@ -177,35 +192,8 @@ class GalleryRunner(JobRunner):
             _out.write(' '.join(command))
 
 
-        # Actually run the command:
-        proc = subprocess.Popen(command,
-                                cwd = self.work_dir,
-                                stdout = subprocess.PIPE,
-                                stderr = subprocess.PIPE,
-                                env=env)
-
-        retval=proc.poll()
-        # the loop executes to wait till the command finish running
-        stdout=''
-        stderr=''
-        while retval is None:
-            time.sleep(1.0)
-            # while waiting, fetch stdout (including STDERR) to avoid crogging the pipe
-            for line in iter(proc.stdout.readline, b''):
-                stdout += line
-            for line in iter(proc.stderr.readline, b''):
-                stderr += line
-            # update the return value
-            retval = proc.poll()
-
-
-        return_code = proc.returncode
-
-        # Write the output to file:
-        with open(self.work_dir + '/{0}_standard_output.log'.format(os.path.basename(fcl)), 'w') as _out:
-            _out.write(stdout)
-        with open(self.work_dir + '/{0}_standard_error.log'.format(os.path.basename(fcl)), 'w') as _out:
-            _out.write(stderr)
+        # Actually run the command, parsing the output as it streams:
+        return_code = self.run_process(command, os.path.basename(fcl), env)
 
         # Write the return code to to a file too:
         with open(self.work_dir + '/{0}_returncode'.format(os.path.basename(fcl)), 'w') as _out:
@@ -216,31 +204,11 @@ class GalleryRunner(JobRunner):
             return return_code, None, None, None
 
 
-        # We want to know how many events are in the file.
-        # We can get it by parsing the stdout stream from the job:
-        foundOutput = False
-        foundNEvents = False
-        n_events = 0
-        output_file = None
-        for line in reversed(stdout.split('\n')):
-            if 'Number of entries processed:' in line:
-                # This is the line reporting the number of events
-                n_events = int(line.split(':')[1])
-                foundNEvents = True
-            if 'Output file name' in line:
-                # This line has the name of the output file, and a lot
-                # of other garbage.  Have to sort this out:
-                tokens = line.split(':')
-                print tokens
-                output_file = tokens[-1].rstrip('\n').replace('\"', '').replace(' ', '')
-                print output_file
-                foundOutput = True
-
-
-            if foundOutput and foundNEvents:
-                break
-
-
+        # The number of events and the output file were picked
+        # up from the stdout stream while the job was running:
+        foundOutput = self.monitor.found_output
+        n_events = self.monitor.n_events
+        output_file = self.monitor.output_file
 
         if not foundOutput:
             raise Exception("Can't identify the output file.")
@@ -255,4 +223,21 @@ class GalleryRunner(JobRunner):
 
         return (return_code, n_events, output_file, ana_file)
 
+    def parse_line(self, line):
+        '''Parse a line of output from a gallery script
+
+        Arguments:
+            line {str} -- a single line of stdout from the script
+        '''
+        if 'Number of entries processed:' in line:
+            # This is the line reporting the number of events
+            n_events = int(line.split(':')[1])
+            self.monitor.record(n_events)
+            self.monitor.set_n_events(n_events)
+        elif 'Output file name' in line:
+            # This line has the name of the output file, and a lot
+            # of other garbage.  Have to sort this out:
+            tokens = line.split(':')
+            self.monitor.set_output_file(tokens[-1].rstrip('\n').replace('\"', '').replace(' ', ''))
+
 
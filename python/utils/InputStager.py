@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+import Queue
+
+from Checksums import available_algorithms, copy_with_checksums
+
+
+class StagedBatch(object):
+    '''
+    A set of input files being copied to local scratch by an InputStager.
+    '''
+    def __init__(self, files, directory, metadata=None, event_range=None):
+        super(StagedBatch, self).__init__()
+        self.files = files
+        self.directory = directory
+        self.metadata = metadata if metadata is not None else dict()
+        self.event_range = event_range
+
+        # Defaults to the original location, replaced as files are staged:
+        self.local_files = list(files)
+        self.bytes_staged = 0
+        self.started = time.time()
+        self.finished = None
+        self.waited = 0.
+
+        self._lock = threading.Lock()
+        self._remaining = len(files)
+        self._done = threading.Event()
+        if self._remaining == 0:
+            self.finished = self.started
+            self._done.set()
+
+    def file_done(self, index, local_file, n_bytes):
+        with self._lock:
+            if local_file is not None:
+                self.local_files[index] = local_file
+                self.bytes_staged += n_bytes
+            self._remaining -= 1
+            if self._remaining == 0:
+                self.finished = time.time()
+                self._done.set()
+
+    def wait(self):
+        '''Block until every file of the batch is staged
+
+        Returns:
+            list -- local paths of the files, or the original path of any
+            file that could not be staged
+        '''
+        start = time.time()
+        self._done.wait()
+        self.waited += time.time() - start
+        return self.local_files
+
+    def staging_time(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def time_saved(self):
+        '''Return the seconds of staging that overlapped with other work
+        '''
+        if self.finished is None:
+            return 0.
+        return max(self.staging_time() - self.waited, 0.)
+
+
+class InputStager(object):
+    '''
+    Copies input files from shared storage to node local scratch.
+
+    Files are copied in the background by a fixed number of threads, so the
+    number of concurrent transfers from the shared file system is bounded.
+    Each copy is checked against the size and the checksums recorded in the
+    file metadata, computed while copying, and a file that can not be staged
+    is simply read from its original location.
+    '''
+    def __init__(self, max_transfers=2):
+        super(InputStager, self).__init__()
+        self.max_transfers = max_transfers
+        self._queue = Queue.Queue()
+        self._threads = []
+
+    def _start_threads(self):
+        while len(self._threads) < self.max_transfers:
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stage(self, files, directory, metadata=None, event_range=None):
+        '''Start copying files to directory in the background
+
+        Arguments:
+            files {list} -- paths of the input files
+            directory {str} -- local directory to copy the files to
+
+        Keyword Arguments:
+            metadata {dict or None} -- expected size and checksums of each file, by path (default: {None})
+            event_range {tuple or None} -- event range claimed with the files, kept with the batch (default: {None})
+
+        Returns:
+            StagedBatch -- handle to wait on the copies
+        '''
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        batch = StagedBatch(files, directory, metadata, event_range)
+        self._start_threads()
+        for index in xrange(len(files)):
+            self._queue.put((batch, index))
+        return batch
+
+    def close(self):
+        '''
+        Stop the transfer threads once the queued copies are done
+        '''
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch, index = item
+            source = batch.files[index]
+            local_file = os.path.join(batch.directory, os.path.basename(source))
+            expected = batch.metadata.get(source, dict())
+            algorithms = [a for a in available_algorithms() if expected.get(a) is not None]
+            try:
+                n_bytes, checksums = copy_with_checksums(source, local_file, algorithms)
+                if expected.get('size') is not None and n_bytes != expected['size']:
+                    raise IOError("staged {0} bytes, metadata says {1}".format(n_bytes, expected['size']))
+                for algorithm, value in checksums.iteritems():
+                    if value != expected[algorithm]:
+                        raise IOError("{0} of the staged file is {1}, metadata says {2}".format(
+                            algorithm, value, expected[algorithm]))
+            except (IOError, OSError) as e:
+                print("Could not stage {0}, reading it in place: {1}".format(source, e))
+                if os.path.isfile(local_file):
+                    os.remove(local_file)
+                batch.file_done(index, None, 0)
+            else:
+                batch.file_done(index, local_file, n_bytes)
+            finally:
+                self._queue.task_done()
@@ -3,9 +3,24 @@ import subprocess
 import glob
 import time
 import shutil
+import threading
+import fcntl
+import multiprocessing
+import socket
+import json
+import hashlib
+
+from MySQLdb import Error
 
 from database import ProjectUtils, DatasetUtils
 
+from ProgressMonitor import ProgressMonitor
+from InputStager import InputStager
+from StageOut import StageOut, copy_file
+from ResourceSampler import ResourceSampler
+from ProductCache import ProductCache
+from Scheduler import task_job_id
+
 class cd:
     """Context manager for changing the current working directory
 
@@ -36,16 +51,49 @@ class JobRunner(object):
         self.return_code = None
         self.out_dir = None
         self.n_events = 0
+        self.monitor = None
+        self.heartbeat_dir = None
+        self.stage_work_dir = None
+        self.scratch_dir = None
+        # Input staging, and prefetching of the next job's inputs in pilot mode:
+        self.stager = None
+        self.prefetched = None
+        self.next_job = None
+        self.staging_time_saved = 0.
+        # Time the worker process started, for measuring startup overhead:
+        self.start_time = None
+        # Resource summary of each fcl/script of the current job:
+        self.resources = []
+        # Inputs claimed by the current job, before staging, and its checkpoints:
+        self.claimed_inputs = None
+        self.checkpoint_dir = None
+        self.pilot = False
+        # Process at most this many events with each fcl, for preflight runs:
+        self.event_limit = None
+        # Shared cache of the products of fcl steps, and the key of the current step:
+        self.product_cache = None
+        if self.stage.cache() is not None:
+            self.product_cache = ProductCache(*self.stage.cache())
+        self.cache_key = None
+        # Configuration of each fcl with its includes resolved, for the cache keys:
+        self.fcl_configurations = dict()
 
-    def prepare_job(self):
+    def prepare_job(self, job_dir_name=None):
         '''
         Prepare everything needed for running a job.
+
+        Keyword Arguments:
+            job_dir_name {str or None} -- name of the work and output directories
+                for this job, defaults to [array job id].[task index in the stage] (default: {None})
         '''
 
+        if job_dir_name is None:
+            job_dir_name = task_job_id().replace('_', '.')
+
         # Prepare an area on the scratch directory for working:
-        self.work_dir  = '/n/regal/guenette_lab/work/{0}/{1}/'.format(self.project['name'], self.stage.name)
-        self.work_dir += os.environ['SLURM_ARRAY_JOB_ID'] + "."
-        self.work_dir += os.environ['SLURM_ARRAY_TASK_ID'] + '/'
+        self.scratch_dir = '{0}/{1}/{2}/'.format(self.project.scheduler()['scratch'].rstrip('/'),
+                                                 self.project['name'], self.stage.name)
+        self.work_dir  = self.scratch_dir + job_dir_name + '/'
         try:
             os.makedirs(self.work_dir)
         except OSError:
@@ -56,27 +104,642 @@ class JobRunner(object):
 
         # If necessary, make the output folder.
         self.out_dir = self.stage.output_directory() + "/"
-        self.out_dir += os.environ['SLURM_ARRAY_JOB_ID'] + "."
-        self.out_dir += os.environ['SLURM_ARRAY_TASK_ID'] + '/'
+        self.out_dir += job_dir_name + '/'
         try:
             os.makedirs(self.out_dir)
         except OSError:
             if not os.path.isdir(self.out_dir):
                 raise
 
+        # Heartbeat files go to the stage work directory, where
+        # production.py --status can find them:
+        self.stage_work_dir = '{0}/work/{1}/'.format(self.project['top_dir'], self.stage.name)
+        self.heartbeat_dir  = self.stage_work_dir + 'heartbeats/'
+        try:
+            os.makedirs(self.heartbeat_dir)
+        except OSError:
+            if not os.path.isdir(self.heartbeat_dir):
+                raise
 
         # # Make sure failed files are reset:
         # db_util.reset_failed_files(dataset=self.stage.input_dataset(),
         #     stage=self.stage.name,
         #     ftype=0)
 
+    def abandon_job(self):
+        '''
+        Remove the work and output directories of a job that found nothing to do
+        '''
+        shutil.rmtree(self.work_dir)
+        if os.path.isdir(self.out_dir) and os.listdir(self.out_dir) == []:
+            os.rmdir(self.out_dir)
+
+    def stage_out(self):
+        '''Move every file left in the work directory to the output directory
+
+        Returns:
+            dict -- {output path : {algorithm : checksum}} of the moved files
+        '''
+        files = [os.path.join(self.work_dir, f) for f in os.listdir(self.work_dir)]
+        files = [f for f in files if os.path.isfile(f)]
+        engine = StageOut(self.stage.output_transfers(), self.stage.checksums())
+        start = time.time()
+        engine.stage_out(files, self.out_dir)
+        elapsed = time.time() - start
+        print("Staged out {0} files in {1:.1f}s ({2} renamed, {3:.1f} MB copied)".format(
+            len(files), elapsed, engine.n_renamed, engine.bytes_copied / 1e6))
+        # Renames don't touch the file system of the output, only copies count:
+        if self.monitor is not None and engine.bytes_copied > 0 and elapsed > 0:
+            self.monitor.set_metric('stage_out_rate', engine.bytes_copied / 1e6 / elapsed)
+        return engine.checksums
+
+    def claim_inputs(self, dataset_util, job_id):
+        '''Claim the input files for a job from the consumption table
+
+        If the stage splits its inputs in event ranges, one range is claimed.
+        If the stage stages its inputs, they are copied to the work directory
+        before returning, unless they were already prefetched for this job.
+
+        Arguments:
+            dataset_util {DatasetUtils} -- database access
+            job_id {str} -- job the files are yielded to
+
+        Returns:
+            tuple -- (list of input files, event range or None), or (None, None)
+            if this stage has no input
+        '''
+        self.claimed_inputs = None
+        if not self.stage.has_input():
+            return None, None
+
+        if self.prefetched is not None and self.prefetched[0] == job_id:
+            batch = self.prefetched[1]
+            self.prefetched = None
+            self.claimed_inputs = batch.files
+            inputs = batch.wait()
+            self.report_staging(batch)
+            return inputs, batch.event_range
+
+        start = time.time()
+        inputs, event_range = self.yield_inputs(dataset_util, job_id)
+        if self.monitor is not None:
+            self.monitor.set_metric('claim_latency', time.time() - start)
+        self.claimed_inputs = inputs
+
+        if self.stage.stage_inputs() and len(inputs) > 0:
+            batch = self.stage_batch(dataset_util, job_id, inputs, event_range,
+                                     self.work_dir + 'inputs/')
+            inputs = batch.wait()
+            self.report_staging(batch)
+            if self.next_job is None:
+                # Nothing to prefetch outside of pilots:
+                self.stager.close()
+
+        return inputs, event_range
+
+    def yield_inputs(self, dataset_util, job_id):
+        '''
+        Yield the input files, or the event range, for a job
+        '''
+        event_range = None
+        if self.stage.events_per_shard() is not None:
+            # Input files are split in event ranges, claim one range:
+            shards = dataset_util.yield_files(self.stage.output_dataset(),
+                                              1, job_id, ranges=True)
+            inputs = [shard[0] for shard in shards]
+            if len(shards) > 0:
+                event_range = shards[0][1:]
+        else:
+            print self.stage.n_files()
+            inputs = dataset_util.yield_files(self.stage.output_dataset(),
+                                              self.stage.n_files(),
+                                              job_id)
+            print inputs
+        return inputs, event_range
+
+    def stage_batch(self, dataset_util, job_id, inputs, event_range, directory):
+        '''
+        Start copying the inputs of a job to directory in the background
+        '''
+        if self.stager is None:
+            self.stager = InputStager(self.stage.max_transfers())
+        metadata = dataset_util.yielded_file_metadata(self.stage.output_dataset(), job_id)
+        return self.stager.stage(inputs, directory, metadata, event_range)
+
+    def report_staging(self, batch):
+        self.staging_time_saved += batch.time_saved()
+        print("Staged {0:.1f} MB of input in {1:.1f} s, waited {2:.1f} s for it ({3:.1f} s saved)".format(
+            batch.bytes_staged / 1.e6, batch.staging_time(), batch.waited, batch.time_saved()))
+
+    def prefetch_inputs(self, dataset_util):
+        '''Claim and start staging the inputs of the next job
+
+        Only used by pilots, which set self.next_job to the (job id, job
+        directory name) of their next iteration.  The files are staged to
+        the work directory the next job will use.
+        '''
+        if self.next_job is None or not self.stage.stage_inputs():
+            return
+        job_id, job_dir_name = self.next_job
+        inputs, event_range = self.yield_inputs(dataset_util, job_id)
+        batch = self.stage_batch(dataset_util, job_id, inputs, event_range,
+                                 self.scratch_dir + job_dir_name + '/inputs/')
+        self.prefetched = (job_id, batch)
+
+    def release_prefetched(self):
+        '''
+        Give back the inputs prefetched for a job that will not run
+        '''
+        if self.prefetched is None:
+            return
+        job_id, batch = self.prefetched
+        self.prefetched = None
+        batch.wait()
+        DatasetUtils().release_files(self.stage.output_dataset(), job_id)
+        shutil.rmtree(os.path.dirname(batch.directory.rstrip('/')), ignore_errors=True)
+
+    def checkpoint_directory(self, job_id, event_range=None):
+        '''Return the directory holding the checkpoints of a job, or None
+
+        Jobs with input are identified by the inputs (and event range) they
+        claimed, so any later job claiming the same inputs finds the work
+        of a failed one.  Jobs without input are identified by their array
+        task and chain, which a makeup resubmits.  Pilots without input
+        have no stable identity and are not checkpointed.
+        '''
+        if not self.stage.checkpoint() or len(self.stage.fcl()) < 2:
+            return None
+        if self.stage.has_input():
+            identity = ','.join(sorted(self.claimed_inputs))
+            if event_range is not None:
+                identity += ':{0}:{1}'.format(event_range[0], event_range[1])
+        elif not self.pilot and '_' in job_id:
+            identity = 'task ' + job_id.split('_', 1)[1]
+        else:
+            return None
+        key = hashlib.sha1(self.stage.name + '\n' + identity).hexdigest()[:20]
+        return self.stage_work_dir + 'checkpoints/' + key + '/'
+
+    def start_cache(self, dataset_util, job_id, event_range=None):
+        '''Compute the product cache key of a job, before its first fcl
+
+        Jobs with input are keyed on the checksums of their inputs (or their
+        names and sizes if the checksums are not known).  Nothing pins the
+        random seeds of jobs without input, so they are keyed on their output
+        dataset and array task (and chain): a task made again reuses its
+        products, but no other dataset gets the same events.  Pilots without
+        input are not cached.
+        '''
+        self.cache_key = None
+        if self.product_cache is None:
+            return
+        if self.stage.has_input():
+            metadata = dataset_util.yielded_file_metadata(self.stage.output_dataset(), job_id)
+            inputs = []
+            for name, meta in metadata.iteritems():
+                checksum = meta.get('sha256') or meta.get('adler32')
+                if checksum is None:
+                    checksum = os.path.basename(name)
+                inputs.append('{0}:{1}'.format(checksum, meta.get('size')))
+        elif not self.pilot and '_' in job_id:
+            inputs = ['dataset {0} task {1}'.format(self.stage.output_dataset(), job_id.split('_', 1)[1])]
+        else:
+            return
+        n_events = event_range if event_range is not None else self.stage.events_per_job()
+        self.cache_key = ProductCache.base_key(self.project.software().snapshot_key(),
+                                               inputs, n_events)
+
+    def load_checkpoint(self):
+        '''Copy the products of the fcls completed by an earlier attempt to the work directory
+
+        Returns:
+            dict or None -- the checkpoint marker, with the number of fcls
+            completed, their output and ana files and the number of events
+        '''
+        if self.checkpoint_dir is None:
+            return None
+        marker_file = self.checkpoint_dir + 'progress.json'
+        try:
+            with open(marker_file, 'r') as _marker:
+                marker = json.load(_marker)
+        except (IOError, ValueError):
+            return None
+        fcls = [os.path.basename(fcl) for fcl in self.stage.fcl()]
+        if marker['fcls'] != fcls[:marker['completed']]:
+            print("Checkpoint {0} was made with other fcl files, ignoring it".format(self.checkpoint_dir))
+            return None
+        # File names come back from json as unicode:
+        marker['files'] = [str(f) for f in marker['files']]
+        marker['ana_files'] = [str(f) for f in marker['ana_files']]
+        if marker['output_file'] is not None:
+            marker['output_file'] = str(marker['output_file'])
+        for file_name in marker['files']:
+            copy_file(self.checkpoint_dir + file_name, self.work_dir + file_name)
+        print("Resuming after fcl {0} of {1} from checkpoint {2}".format(
+            marker['completed'], len(fcls), self.checkpoint_dir))
+        return marker
+
+    def save_checkpoint(self, completed, output_file, ana_files, n_events):
+        '''Save the products of the first completed fcls of the chain
+
+        The files are copied first and the marker is replaced last, so an
+        interrupted checkpoint leaves the previous one valid.  A failure to
+        checkpoint is reported but does not fail the job.
+        '''
+        if self.checkpoint_dir is None:
+            return
+        files = [f for f in [output_file] + list(ana_files) if f is not None]
+        try:
+            if not os.path.isdir(self.checkpoint_dir):
+                os.makedirs(self.checkpoint_dir)
+            for file_name in files:
+                tmp_file = self.checkpoint_dir + '.' + file_name + '.part'
+                copy_file(self.work_dir + file_name, tmp_file)
+                os.rename(tmp_file, self.checkpoint_dir + file_name)
+            marker = {
+                'completed'   : completed,
+                'fcls'        : [os.path.basename(fcl) for fcl in self.stage.fcl()[:completed]],
+                'output_file' : output_file,
+                'ana_files'   : list(ana_files),
+                'files'       : files,
+                'n_events'    : n_events,
+            }
+            with open(self.checkpoint_dir + 'progress.json.tmp', 'w') as _marker:
+                json.dump(marker, _marker)
+            os.rename(self.checkpoint_dir + 'progress.json.tmp', self.checkpoint_dir + 'progress.json')
+        except (IOError, OSError) as e:
+            print("Could not checkpoint fcl {0}: {1}".format(completed, e))
+            return
+        # Products of earlier fcls that are not needed anymore:
+        for file_name in os.listdir(self.checkpoint_dir):
+            if file_name not in files and file_name != 'progress.json':
+                os.remove(self.checkpoint_dir + file_name)
+
+    def clear_checkpoint(self):
+        '''
+        Remove the checkpoints of a job that completed
+        '''
+        if self.checkpoint_dir is not None:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def claim_slot(self):
+        '''Claim one of the n_jobs job slots of a stage
+
+        Stages without input have no consumption table to pull from, so
+        pilots share a counter in the stage work directory instead.  The
+        counter is protected with a lock on the file.
+
+        Returns:
+            bool -- True if a slot was claimed, False if all slots are taken
+        '''
+        slot_file = self.stage_work_dir + 'pilot_slots'
+        with open(slot_file, 'a+') as _slots:
+            fcntl.lockf(_slots, fcntl.LOCK_EX)
+            try:
+                _slots.seek(0)
+                content = _slots.read().strip()
+                claimed = int(content) if content != '' else 0
+                if claimed >= self.stage.n_jobs():
+                    return False
+                _slots.seek(0)
+                _slots.truncate()
+                _slots.write(str(claimed + 1))
+                _slots.flush()
+                os.fsync(_slots.fileno())
+                return True
+            finally:
+                fcntl.lockf(_slots, fcntl.LOCK_UN)
+
+    def release_slot(self):
+        '''
+        Give back a job slot claimed by a job that failed, see claim_slot
+        '''
+        slot_file = self.stage_work_dir + 'pilot_slots'
+        with open(slot_file, 'a+') as _slots:
+            fcntl.lockf(_slots, fcntl.LOCK_EX)
+            try:
+                _slots.seek(0)
+                content = _slots.read().strip()
+                claimed = int(content) if content != '' else 0
+                _slots.seek(0)
+                _slots.truncate()
+                _slots.write(str(max(0, claimed - 1)))
+                _slots.flush()
+                os.fsync(_slots.fileno())
+            finally:
+                fcntl.lockf(_slots, fcntl.LOCK_UN)
+
+    def run_pilot(self, job_id, env=None, max_failures=3):
+        '''Run jobs in a loop until there is no work left or time runs out
 
+        Each iteration is a complete job: it claims its own inputs (or a
+        job slot for stages without input), runs the fcl chain and declares
+        its outputs, under the job id [job_id].[iteration].  A new iteration
+        is only started if the longest iteration so far still fits in the
+        remaining walltime of the stage.
 
+        Arguments:
+            job_id {str} -- job id of the pilot
+
+        Keyword Arguments:
+            env {dict or None} -- over ride the environment (default: {None})
+            max_failures {int} -- stop after this many failed iterations in a row (default: {3})
+        '''
+        start_time = self.start_time if self.start_time is not None else time.time()
+        walltime = self.stage.time_seconds()
+        job_dir_name = job_id.replace('_', '.')
+        self.pilot = True
+
+        iteration = 0
+        failures = 0
+        longest = 0.
+        try:
+            while True:
+                elapsed = time.time() - start_time
+                if walltime is not None and elapsed + 1.2*longest > walltime:
+                    print("Pilot stopping, not enough walltime left for another job.")
+                    break
+
+                self.prepare_job('{0}.{1}'.format(job_dir_name, iteration))
+                if not self.stage.has_input() and not self.claim_slot():
+                    print("Pilot stopping, all job slots are taken.")
+                    self.abandon_job()
+                    break
+
+                iteration_id = '{0}.{1}'.format(job_id, iteration)
+                self.next_job = ('{0}.{1}'.format(job_id, iteration + 1),
+                                 '{0}.{1}'.format(job_dir_name, iteration + 1))
+                print("Pilot running job {0}".format(iteration_id))
+                iteration_start = time.time()
+                try:
+                    if not self.run_job(iteration_id, env):
+                        print("Pilot stopping, no input files left.")
+                        break
+                    failures = 0
+                except Exception as e:
+                    print("Pilot job {0} failed: {1}".format(iteration_id, e))
+                    if self.monitor is not None:
+                        self.monitor.stop('failed')
+                    # Its inputs go back to the queue with one more attempt,
+                    # the makeup would only see them if the whole task failed:
+                    if self.stage.has_input():
+                        DatasetUtils().reset_failed_jobs(self.stage.output_dataset(), [iteration_id],
+                                                         self.stage.max_attempts(), whole_tasks=False)
+                    else:
+                        self.release_slot()
+                    # The next iteration starts from a clean directory:
+                    shutil.rmtree(self.work_dir, ignore_errors=True)
+                    failures += 1
+                    if failures >= max_failures:
+                        raise
+                longest = max(longest, time.time() - iteration_start)
+                iteration += 1
+        finally:
+            # Inputs prefetched for a job that won't run go back to the queue,
+            # also when the pilot gives up after failures:
+            self.release_prefetched()
+            if self.stager is not None:
+                self.stager.close()
+
+        print("Pilot ran {0} jobs in {1:.0f} s".format(iteration, time.time() - start_time))
+        if self.stage.stage_inputs():
+            print("Prefetching inputs saved {0:.0f} s".format(self.staging_time_saved))
+
+    def run_packed(self, job_id, n_chains, env=None, pilot=False):
+        '''Run several independent fcl chains in parallel in one batch task
+
+        Each chain runs in its own process with the job id [job_id].[chain],
+        its own work and output directories, its own claimed inputs and its
+        own database declarations.  A failing chain does not stop the others,
+        the failures are reported once all of the chains have finished.
+
+        Arguments:
+            job_id {str} -- job id of the batch task
+            n_chains {int} -- number of chains to run in parallel
+
+        Keyword Arguments:
+            env {dict or None} -- over ride the environment (default: {None})
+            pilot {bool} -- run each chain as a pilot (default: {False})
+        '''
+        job_dir_name = job_id.replace('_', '.')
+
+        chains = []
+        for chain in xrange(n_chains):
+            chain_id = '{0}.{1}'.format(job_id, chain)
+
+            # Without input, every chain is one of the n_jobs job slots:
+            if not pilot and not self.stage.has_input():
+                task = int(job_id.split('_')[-1])
+                if task*n_chains + chain >= self.stage.n_jobs():
+                    break
+
+            process = multiprocessing.Process(target=self._run_chain,
+                args=(chain_id, '{0}.{1}'.format(job_dir_name, chain), env, pilot))
+            process.start()
+            chains.append((chain_id, process))
+
+        print("Started {0} chains".format(len(chains)))
+
+        failed = []
+        for chain_id, process in chains:
+            process.join()
+            if process.exitcode != 0:
+                print("Chain {0} failed with exit code {1}".format(chain_id, process.exitcode))
+                failed.append(chain_id)
+
+        print("{0} of {1} chains finished successfully".format(
+            len(chains) - len(failed), len(chains)))
+        if len(failed) > 0:
+            raise Exception("Chains {0} failed.".format(', '.join(failed)))
+
+    def _run_chain(self, chain_id, job_dir_name, env, pilot):
+        '''
+        Entry point of the child process running a single chain for run_packed
+        '''
+        if pilot:
+            self.run_pilot(chain_id, env)
+            return
+        self.prepare_job(job_dir_name)
+        try:
+            self.run_job(chain_id, env)
+        except:
+            if self.monitor is not None:
+                self.monitor.stop('failed')
+            raise
 
     def run_job(self, job_id, env=None):
         '''
         Run the actual larsoft job with subprocess
         Since each stage can take multiple fcl files, this captures the information
         from each individually.  It feeds the output of one into the input for the next
+
+        Returns True if a job was run, False if there were no input files left.
         '''
         raise NotImplementedError("Required to implement the run_job function.")
+
+    def parse_line(self, line):
+        '''Parse a single line of output from the running process
+
+        Implemented by each runner to update self.monitor with the
+        progress markers of the software it runs.
+        '''
+        raise NotImplementedError("Required to implement the parse_line function.")
+
+    def run_preflight(self, n_events, work_dir, inputs=None):
+        '''Check the configuration of the stage and run it on a few events
+
+        Implemented by each runner that supports --preflight.  Nothing is
+        claimed from or declared to the database.
+
+        Returns:
+            dict -- the report of the run, see LarsoftRunner.run_preflight
+        '''
+        raise NotImplementedError("Preflight runs are not available for this software.")
+
+    def start_monitor(self, job_id):
+        '''
+        Create the progress monitor for this job and start publishing heartbeats
+        '''
+        heartbeat_file = None
+        if self.heartbeat_dir is not None:
+            heartbeat_file = self.heartbeat_dir + '{0}.json'.format(job_id)
+        self.monitor = ProgressMonitor(heartbeat_file,
+                                       job_id     = job_id,
+                                       stage_name = self.stage.name,
+                                       n_steps    = len(self.stage.fcl()),
+                                       interval   = self.stage.heartbeat_interval())
+        self.monitor.start()
+        self.resources = []
+
+    def record_declare_time(self, start):
+        '''
+        Publish the seconds spent declaring the outputs of the job since start
+        '''
+        if self.monitor is not None:
+            self.monitor.set_metric('declare_time', time.time() - start)
+
+    def feed_daughters(self, dataset_util, file_id):
+        '''Add the output file of this job to the consumption tables of the later stages
+
+        Called once the inputs of the job are consumed, so running the job
+        again would not feed the file.  If the database fails, the file is
+        recorded in unfed_files in the stage work directory, for
+        ProjectHandler.feed_unfed to feed it later, and the job fails.
+        '''
+        try:
+            dataset_util.feed_daughters(self.stage.output_dataset(), file_id, self.n_events)
+        except Error as e:
+            print("Could not add file {0} to the later stages: {1}".format(file_id, e))
+            with open(self.stage_work_dir + 'unfed_files', 'a') as _unfed:
+                fcntl.lockf(_unfed, fcntl.LOCK_EX)
+                try:
+                    _unfed.write('{0} {1}\n'.format(file_id, self.n_events))
+                    _unfed.flush()
+                    os.fsync(_unfed.fileno())
+                finally:
+                    fcntl.lockf(_unfed, fcntl.LOCK_UN)
+            raise
+
+    def record_statistics(self, dataset_util, job_id):
+        '''Store the resources used by this job in the statistics table
+
+        The statistics are only informational, a database error is
+        reported but does not fail the job.
+        '''
+        if len(self.resources) == 0:
+            return
+        walltime = sum(step['walltime'] for step in self.resources)
+        cputime = sum(step['cpu'] for step in self.resources)
+        cpus = max(1, self.stage.cpus_per_task() / self.stage.chains_per_task())
+        # Events read by the first fcl, the ones the job time scales with:
+        n_events = self.resources[0]['events'] if self.resources[0]['events'] else self.n_events
+        statistics = {
+            'host'              : socket.gethostname(),
+            'steps'             : ','.join(step['step'] for step in self.resources),
+            'nevents'           : n_events,
+            'walltime'          : walltime,
+            'cputime'           : cputime,
+            'cpu_efficiency'    : cputime / (walltime * cpus) if walltime > 0 else None,
+            'peak_rss'          : max(step['peak_rss'] for step in self.resources),
+            'events_per_second' : n_events / walltime if walltime > 0 and n_events else None,
+            'read_bytes'        : sum(step['read'] for step in self.resources),
+            'write_bytes'       : sum(step['write'] for step in self.resources),
+        }
+        print("Peak RSS {0:.0f} MB, cpu efficiency {1}, {2} events/s".format(
+            statistics['peak_rss'] / 1e6, statistics['cpu_efficiency'],
+            statistics['events_per_second']))
+        try:
+            dataset_util.record_job_statistics(self.stage.output_dataset(), job_id, statistics)
+        except Error as e:
+            print("Could not record the statistics of job {0}: {1}".format(job_id, e))
+
+    def run_process(self, command, name, env=None, events_target=None):
+        '''Run a command, parsing its output as it streams
+
+        stdout is parsed line by line with self.parse_line and written to
+        [name]_standard_output.log as it arrives, stderr is drained to
+        [name]_standard_error.log on a separate thread.  The resources used
+        by the process tree are sampled to [name]_resources.csv, and the
+        summary is appended to self.resources.
+
+        Arguments:
+            command {list} -- command to run
+            name {str} -- basename used for the log files
+
+        Keyword Arguments:
+            env {dict or None} -- over ride the environment (default: {None})
+            events_target {int or None} -- expected number of events, for the ETA (default: {None})
+
+        Returns:
+            int -- return code of the process
+        '''
+        if self.monitor is None:
+            self.monitor = ProgressMonitor(None, None, self.stage.name)
+        self.monitor.begin_step(name, events_target)
+
+        stdout_log = open(self.work_dir + '/{0}_standard_output.log'.format(name), 'w')
+        stderr_log = open(self.work_dir + '/{0}_standard_error.log'.format(name), 'w')
+
+        try:
+            proc = subprocess.Popen(command,
+                                    cwd = self.work_dir,
+                                    stdout = subprocess.PIPE,
+                                    stderr = subprocess.PIPE,
+                                    env=env)
+
+            sampler = None
+            if self.stage.resource_interval() > 0:
+                sampler = ResourceSampler(proc.pid,
+                                          self.work_dir + '/{0}_resources.csv'.format(name),
+                                          self.stage.resource_interval())
+                sampler.start()
+
+            if self.start_time is not None and self.monitor.startup is None:
+                self.monitor.startup = time.time() - self.start_time
+                print("Time to first {0} invocation: {1:.2f} s".format(
+                    command[0], self.monitor.startup))
+
+            # Drain stderr in the background so the pipe never fills up:
+            def drain(stream, log):
+                for line in iter(stream.readline, b''):
+                    log.write(line)
+            stderr_thread = threading.Thread(target=drain, args=(proc.stderr, stderr_log))
+            stderr_thread.daemon = True
+            stderr_thread.start()
+
+            for line in iter(proc.stdout.readline, b''):
+                stdout_log.write(line)
+                self.parse_line(line)
+
+            proc.wait()
+            stderr_thread.join()
+            if sampler is not None:
+                summary = sampler.stop()
+                summary['step'] = name
+                summary['events'] = self.monitor.n_records
+                self.resources.append(summary)
+        finally:
+            stdout_log.close()
+            stderr_log.close()
+
+        return proc.returncode
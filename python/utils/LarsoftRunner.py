@@ -3,10 +3,14 @@ import subprocess
 import glob
 import time
 import shutil
+import re
+import resource
 
 from database import ProjectUtils, DatasetUtils
 
 from JobRunner import cd, JobRunner
+from ProductCache import ProductCache, fcl_content
+from ProgressMonitor import ProgressMonitor
 
 class cd:
     """Context manager for changing the current working directory
@@ -28,6 +32,8 @@ class LarsoftRunner(JobRunner):
     Class for running a single larsoft job.  Can use multiple files
     at once and handle larsoft commands
     """
+    record_pattern = re.compile(r'Begin processing the (\d+)(?:st|nd|rd|th) record')
+
     def __init__(self, project, stage):
         super(LarsoftRunner, self).__init__(project, stage)
         self.project = project
@@ -46,23 +52,30 @@ class LarsoftRunner(JobRunner):
         Run the actual larsoft job with subprocess
         Since each stage can take multiple fcl files, this captures the information
         from each individually.  It feeds the output of one into the input for the next
+
+        Returns True if a job was run, False if there were no input files left.
         '''
 
         dataset_util = DatasetUtils()
 
+        self.start_monitor(job_id)
+
         print self.out_dir
         # To run the job, we move to the scratch directory:
         print("Changing directory to " + self.work_dir)
         with cd(self.work_dir):
 
             # Prepare the first input files, if there are any:
+            inputs, event_range = self.claim_inputs(dataset_util, job_id)
             if self.stage.has_input():
-                print self.stage.n_files()
-                inputs = dataset_util.yield_files(self.stage.output_dataset(),
-                                                  self.stage.n_files(),
-                                                  job_id)
-                print inputs
+                if len(inputs) == 0:
+                    print("No input files left to process.")
+                    self.monitor.stop('finished')
+                    self.abandon_job()
+                    return False
                 original_inputs = inputs
+                # While this job runs, start staging the inputs of the next one:
+                self.prefetch_inputs(dataset_util)
             else:
                 inputs = None
                 original_inputs = None
@@ -71,10 +84,34 @@ class LarsoftRunner(JobRunner):
             # Since we only keep the final output file,
             # outputs get deleted after the are used
 
-            for fcl in self.stage.fcl():
+            # An earlier attempt at the same job may have completed
+            # the first fcls already, resume after them:
+            self.start_cache(dataset_util, job_id, event_range)
+            self.checkpoint_dir = self.checkpoint_directory(job_id, event_range)
+            checkpoint = self.load_checkpoint()
+            first_step = 0
+            ana_files = []
+            if checkpoint is not None:
+                first_step = checkpoint['completed']
+                output_file = checkpoint['output_file']
+                n_events = checkpoint['n_events']
+                ana_files = checkpoint['ana_files']
+                ana_file = ana_files[-1] if len(ana_files) > 0 else None
+                inputs = [output_file] if output_file is not None else None
+                event_range = None
+
+            for step, fcl in enumerate(self.stage.fcl()):
+                if step < first_step:
+                    if self.cache_key is not None:
+                        self.cache_key = ProductCache.step_key(self.cache_key,
+                                                               self.fcl_configuration(fcl, env))
+                    continue
                 print("Running fcl: " + fcl)
                 print("Using as inputs: " + str(inputs))
-                return_code, n_events, output_file, ana_file = self.run_fcl(fcl, inputs, env)
+                return_code, n_events, output_file, ana_file = self.run_fcl(fcl, inputs, env, event_range)
+                # Only the first fcl reads the original input, the
+                # following ones process everything they are given:
+                event_range = None
                 if return_code != 0:
                     # Copy all log files back:
                     for _file in glob.glob('./*.log'):
@@ -92,6 +129,12 @@ class LarsoftRunner(JobRunner):
                 else:
                     inputs = None
 
+                # Save the progress through the chain, except after the last fcl:
+                if ana_file is not None:
+                    ana_files.append(ana_file)
+                if step < len(self.stage.fcl()) - 1:
+                    self.save_checkpoint(step + 1, output_file, ana_files, n_events)
+
 
 
             # Here, all the fcl files have run.  Save the final products:
@@ -113,15 +156,12 @@ class LarsoftRunner(JobRunner):
             print "Output file is {0}".format(self.output_file)
             print "Ana file is {0}".format(self.ana_file)
 
-        # Copy the output files to the output directory
-        src_files = os.listdir(self.work_dir)
-        for file_name in src_files:
-            full_file_name = os.path.join(self.work_dir, file_name)
-            if (os.path.isfile(full_file_name)):
-                shutil.copy(full_file_name, self.out_dir)
+        # Move the output files to the output directory
+        checksums = self.stage_out()
 
 
         # Declare the output to the database
+        declare_start = time.time()
         out_id = -1
         if self.output_file is not None and self.stage['output']['anaonly'] == False:
             output_size = os.path.getsize(self.out_dir + self.output_file)
@@ -130,7 +170,8 @@ class LarsoftRunner(JobRunner):
                                      ftype=0,
                                      nevents=self.n_events,
                                      jobid=job_id,
-                                     size=output_size)
+                                     size=output_size,
+                                     checksums=checksums.get(self.out_dir + self.output_file))
 
         if self.ana_file is not None:
             ana_size = os.path.getsize(self.out_dir + self.ana_file)
@@ -139,18 +180,29 @@ class LarsoftRunner(JobRunner):
                                      nevents=self.n_events,
                                      ftype=1,
                                      jobid=job_id,
-                                     size=ana_size)
+                                     size=ana_size,
+                                     checksums=checksums.get(self.out_dir + self.ana_file))
             if self.stage['output']['anaonly']:
                 out_id = _id
 
         # finalize the input:
         if original_inputs is not None:
             dataset_util.consume_files(self.stage.output_dataset(), job_id, out_id)
+        if self.output_file is not None and self.stage['output']['anaonly'] == False:
+            self.feed_daughters(dataset_util, out_id)
+        self.record_declare_time(declare_start)
+
+        self.record_statistics(dataset_util, job_id)
+        self.clear_checkpoint()
 
         # Clear out the work directory:
         shutil.rmtree(self.work_dir)
 
-    def run_fcl(self, fcl, input_files, env=None):
+        self.monitor.stop('finished')
+
+        return True
+
+    def run_fcl(self, fcl, input_files, env=None, event_range=None):
         '''Run a fcl file as part of a job
 
         This function takes inventory of the current root files, runs the
@@ -165,11 +217,20 @@ class LarsoftRunner(JobRunner):
 
         Keyword Arguments:
             env {dict or None} -- over ride the environment (default: {None})
+            event_range {tuple or None} -- (first event, number of events) of the input to process (default: {None})
 
         Returns:
             bool {tuple} -- (number of events processed, output files or None)
         '''
 
+        # Reuse the products of this step if another job already made them:
+        if self.cache_key is not None:
+            self.cache_key = ProductCache.step_key(self.cache_key, self.fcl_configuration(fcl, env))
+            entry = self.product_cache.fetch(self.cache_key, self.work_dir)
+            if entry is not None:
+                print("Product cache hit for {0}, saved {1:.0f} cpu seconds".format(fcl, entry['cpu']))
+                return (0, entry['n_events'], entry['output_file'], entry['ana_file'])
+
         # Take survey of the root files before the job starts:
         initial_root_files = [os.path.basename(x) for x in glob.glob(self.work_dir + '/*.root')]
 
@@ -187,8 +248,15 @@ class LarsoftRunner(JobRunner):
                 command.append(_file)
 
 
-        # Number of events to generate:
-        if self.stage.events_per_job() is not None:
+        # Number of events to generate, or range of events to process:
+        events_target = self.stage.events_per_job()
+        if event_range is not None and event_range[1] is not None:
+            command += ['--nskip', str(event_range[0]), '-n', str(event_range[1])]
+            events_target = event_range[1]
+        elif self.event_limit is not None:
+            command += ['-n', str(self.event_limit)]
+            events_target = self.event_limit
+        elif self.stage.events_per_job() is not None:
             command += ['-n', str(self.stage.events_per_job())]
 
         # Configure the environment:
@@ -200,35 +268,9 @@ class LarsoftRunner(JobRunner):
             _out.write(' '.join(command))
 
 
-        # Actually run the command:
-        proc = subprocess.Popen(command,
-                                cwd = self.work_dir,
-                                stdout = subprocess.PIPE,
-                                stderr = subprocess.PIPE,
-                                env=env)
-
-        retval=proc.poll()
-        # the loop executes to wait till the command finish running
-        stdout=''
-        stderr=''
-        while retval is None:
-            time.sleep(1.0)
-            # while waiting, fetch stdout (including STDERR) to avoid crogging the pipe
-            for line in iter(proc.stdout.readline, b''):
-                stdout += line
-            for line in iter(proc.stderr.readline, b''):
-                stderr += line
-            # update the return value
-            retval = proc.poll()
-
-
-        return_code = proc.returncode
-
-        # Write the output to file:
-        with open(self.work_dir + '/{0}_standard_output.log'.format(os.path.basename(fcl)), 'w') as _out:
-            _out.write(stdout)
-        with open(self.work_dir + '/{0}_standard_error.log'.format(os.path.basename(fcl)), 'w') as _out:
-            _out.write(stderr)
+        # Actually run the command, parsing the output as it streams:
+        return_code = self.run_process(command, os.path.basename(fcl), env,
+                                       events_target=events_target)
 
         # Write the return code to to a file too:
         with open(self.work_dir + '/{0}_returncode'.format(os.path.basename(fcl)), 'w') as _out:
@@ -239,30 +281,11 @@ class LarsoftRunner(JobRunner):
             return return_code, None, None, None
 
 
-        # We want to know how many events are in the file.
-        # We can get it by parsing the stdout stream from the job:
-        foundOutput = False
-        foundNEvents = False
-        n_events = 0
-        output_file = None
-        for line in reversed(stdout.split('\n')):
-            if 'TrigReport Events total = ' in line:
-                # This is the line reporting the number of events
-                # Split the line on the spaces and take the 8th element ('passed = #8')
-                n_events = int(line.split(' ')[7])
-                foundNEvents = True
-            if 'Closed output file' in line:
-                # This line has the name of the output file, and a lot
-                # of other garbage.  Have to sort this out:
-                tokens = line.split('Closed output file')
-                output_file = tokens[-1].rstrip('\n').replace('\"', '').replace(' ', '')
-                foundOutput = True
-
-
-            if foundOutput and foundNEvents:
-                break
-
-
+        # The number of events and the output file were picked
+        # up from the stdout stream while the job was running:
+        foundOutput = self.monitor.found_output
+        n_events = self.monitor.n_events
+        output_file = self.monitor.output_file
 
         if not foundOutput and not self.stage['output']['anaonly']:
             raise Exception("Can't identify the output file.")
@@ -280,6 +303,139 @@ class LarsoftRunner(JobRunner):
             if self.stage.ana_name() in _file and _file not in initial_root_files:
                 ana_file = _file
 
+        if self.cache_key is not None:
+            cpu = self.resources[-1]['cpu'] if len(self.resources) > 0 else 0.
+            self.product_cache.store(self.cache_key, self.work_dir,
+                                     output_file, ana_file, n_events, cpu)
+
         return (return_code, n_events, output_file, ana_file)
 
+    def validate_fcl(self, fcl, env=None):
+        '''Check that lar can read a fcl file, with lar --debug-config
+
+        Returns:
+            tuple -- (True if the configuration is valid, last lines of the lar output)
+        '''
+        name = os.path.basename(fcl)
+        command = ['lar', '-c', str(fcl), '--debug-config', self.work_dir + name + '.debug']
+        proc = subprocess.Popen(command, cwd=self.work_dir, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        with open(self.work_dir + '{0}_debug_config.log'.format(name), 'w') as _log:
+            _log.write(output)
+        return proc.returncode == 0, '\n'.join(output.strip().splitlines()[-5:])
+
+    def fcl_configuration(self, fcl, env=None):
+        '''Return the configuration of an fcl file with its includes resolved
+
+        Production fcls are mostly #includes, so the product cache keys hash
+        what lar --debug-config makes of them (see validate_fcl), not the top
+        file.  If lar can't resolve it, the content of the fcl file is used.
+        '''
+        if fcl not in self.fcl_configurations:
+            valid, message = self.validate_fcl(fcl, env)
+            debug_file = self.work_dir + os.path.basename(fcl) + '.debug'
+            if valid and os.path.isfile(debug_file):
+                with open(debug_file, 'r') as _debug:
+                    self.fcl_configurations[fcl] = _debug.read()
+            else:
+                print("Could not resolve the configuration of {0}, hashing the file itself: {1}".format(
+                    fcl, message))
+                self.fcl_configurations[fcl] = fcl_content(fcl)
+        return self.fcl_configurations[fcl]
+
+    def run_preflight(self, n_events, work_dir, inputs=None):
+        '''Check the fcl files of the stage and run the chain on a few events
+
+        Every fcl is validated with lar --debug-config first, and the chain
+        only runs if they all are.  Each fcl then processes at most n_events,
+        each one reading the output of the previous one.  The time of each
+        fcl is split in startup (until the first event), time per event and
+        the rest.  Peak memory is the largest resident size of any process
+        the chain ran.  Nothing is claimed from or declared to the database.
+
+        Arguments:
+            n_events {int} -- events to process with each fcl
+            work_dir {str} -- directory to run in, the outputs stay there
+
+        Keyword Arguments:
+            inputs {list or None} -- input files of the first fcl (default: {None})
+
+        Returns:
+            dict -- success, n_events, peak_rss (bytes), output_file, and fcls: one
+            dict per fcl with fcl, valid, message, return_code, events, startup,
+            per_event, walltime and cpu (seconds)
+        '''
+        self.work_dir = work_dir.rstrip('/') + '/'
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+        self.event_limit = n_events
+        self.monitor = ProgressMonitor(None, None, self.stage.name)
+
+        report = {'success' : False, 'n_events' : n_events, 'peak_rss' : None,
+                  'output_file' : None, 'fcls' : []}
+        for fcl in self.stage.fcl():
+            valid, message = self.validate_fcl(fcl)
+            print("{0} {1}".format(fcl, 'is valid' if valid else 'is not valid:\n' + message))
+            report['fcls'].append({'fcl' : os.path.basename(fcl), 'valid' : valid,
+                                   'message' : message if not valid else None})
+        if not all(step['valid'] for step in report['fcls']):
+            return report
+
+        with cd(self.work_dir):
+            for fcl, step in zip(self.stage.fcl(), report['fcls']):
+                before = resource.getrusage(resource.RUSAGE_CHILDREN)
+                try:
+                    return_code, n_events, output_file, ana_file = self.run_fcl(fcl, inputs)
+                except Exception as e:
+                    step['message'] = str(e)
+                    return_code, n_events, output_file = -1, None, None
+                end = time.time()
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+                monitor = self.monitor
+                step['return_code'] = return_code
+                step['events'] = monitor.n_records
+                step['walltime'] = end - monitor.step_started
+                step['cpu'] = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+                step['startup'] = None
+                step['per_event'] = None
+                if monitor.first_event_time is not None and monitor.n_records > 0:
+                    step['startup'] = monitor.first_event_time - monitor.step_started
+                    # From the start of the first event to the end, closing files included:
+                    step['per_event'] = (end - monitor.first_event_time) / monitor.n_records
+                # ru_maxrss is in kB on linux, and covers every child waited for so far:
+                report['peak_rss'] = after.ru_maxrss * 1024.
+                if return_code != 0:
+                    print("fcl {0} failed with status {1}".format(fcl, return_code))
+                    return report
+                inputs = [output_file] if output_file is not None else None
+                report['output_file'] = self.work_dir + output_file if output_file is not None else None
+
+        report['success'] = True
+        return report
+
+    def parse_line(self, line):
+        '''Parse a line of lar output
+
+        Picks up the per event "Begin processing the Nth record" lines,
+        the TrigReport event summary and the name of the closed output file.
+
+        Arguments:
+            line {str} -- a single line of stdout from lar
+        '''
+        if 'Begin processing the ' in line:
+            match = self.record_pattern.search(line)
+            if match is not None:
+                self.monitor.record(int(match.group(1)))
+        elif 'TrigReport Events total = ' in line:
+            # This is the line reporting the number of events
+            # Split the line on the spaces and take the 8th element ('passed = #8')
+            self.monitor.set_n_events(int(line.split(' ')[7]))
+        elif 'Closed output file' in line:
+            # This line has the name of the output file, and a lot
+            # of other garbage.  Have to sort this out:
+            tokens = line.split('Closed output file')
+            self.monitor.set_output_file(tokens[-1].rstrip('\n').replace('\"', '').replace(' ', ''))
+
 
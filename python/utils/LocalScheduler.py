@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import subprocess
+import multiprocessing
+
+from Scheduler import Scheduler
+from ResourceEstimator import parse_slurm_time
+
+# States of tasks that will not run anymore, and did not succeed:
+_failed_states = ['FAILED', 'TIMEOUT', 'CANCELLED']
+
+
+def parse_array(array):
+    '''Return the indices and the concurrency cap of a slurm style array spec
+
+    '0-2,5%2' becomes ([0, 1, 2, 5], 2), the cap is None without a %
+    '''
+    cap = None
+    if '%' in array:
+        array, cap = array.split('%')
+        cap = int(cap)
+    indices = []
+    for token in array.split(','):
+        if '-' in token:
+            first, last = token.split('-')
+            indices += range(int(first), int(last) + 1)
+        else:
+            indices.append(int(token))
+    return indices, cap
+
+
+class LocalScheduler(Scheduler):
+    '''
+    Runs the arrays on this machine, for small productions and tests.
+
+    Submitting an array starts a background process that runs the tasks
+    of the array with bash, at most max_workers at a time (default: the
+    number of cpus, or the % cap of the array if lower).  Tasks get the
+    SLURM_ARRAY_* variables and working directory they would have under
+    slurm, and are killed when they run over their time limit.  Memory is
+    not enforced.
+
+    The state of the tasks of each array is kept in local_jobs/ in the
+    project work directory, where queue_counts and array_tasks read it.
+    Array job ids are counted from 1 in each project.
+    '''
+    def __init__(self, settings, work_dir):
+        super(LocalScheduler, self).__init__(settings, work_dir)
+        self.jobs_dir = work_dir + 'local_jobs/'
+
+    def next_job_id(self):
+        with open(self.jobs_dir + 'next_id', 'a+') as _id:
+            fcntl.lockf(_id, fcntl.LOCK_EX)
+            try:
+                _id.seek(0)
+                content = _id.read().strip()
+                job_id = int(content) if content != '' else 1
+                _id.seek(0)
+                _id.truncate()
+                _id.write(str(job_id + 1))
+            finally:
+                fcntl.lockf(_id, fcntl.LOCK_UN)
+        return job_id
+
+    def submit(self, array, script_name, cwd, dependency=None, memory=None, time_limit=None,
+               env=None):
+        try:
+            os.makedirs(self.jobs_dir)
+        except OSError:
+            if not os.path.isdir(self.jobs_dir):
+                raise
+
+        indices, cap = parse_array(array)
+        workers = int(self.settings.get('max_workers', multiprocessing.cpu_count()))
+        if cap is not None:
+            workers = min(workers, cap)
+
+        job_id = self.next_job_id()
+        state = {
+            'jobid'      : job_id,
+            'script'     : script_name,
+            'cwd'        : cwd,
+            'workers'    : workers,
+            'dependency' : dependency,
+            'timelimit'  : parse_slurm_time(time_limit) if time_limit is not None else None,
+            'reqmem'     : memory * 1024.**2 if memory is not None else None,
+            'env'        : env or dict(),
+            'tasks'      : dict((str(i), {'state' : 'PENDING', 'elapsed' : None,
+                                          'maxrss' : 0, 'exitcode' : None})
+                                for i in indices),
+        }
+        write_state(self.jobs_dir, job_id, state)
+
+        # The runner is this module run as a script, detached from this process:
+        command = [sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + '.py',
+                   self.jobs_dir, str(job_id)]
+        self.last_command = ' '.join(command)
+        print("Starting local array {0} with {1} tasks, {2} at a time ...".format(
+            job_id, len(indices), workers))
+        with open(cwd + '/local_array_{0}.log'.format(job_id), 'a') as _log:
+            subprocess.Popen(command, cwd=cwd, stdout=_log, stderr=subprocess.STDOUT,
+                             close_fds=True, preexec_fn=os.setsid, env=dict(os.environ))
+        return job_id
+
+    def queue_counts(self, job_ids):
+        counts = dict()
+        for job_id in job_ids:
+            state = read_state(self.jobs_dir, job_id)
+            if state is None:
+                continue
+            for task in state['tasks'].values():
+                if task['state'] in ('PENDING', 'RUNNING'):
+                    counts[task['state']] = counts.get(task['state'], 0) + 1
+        if len(counts) == 0:
+            return None
+        return counts
+
+    def array_tasks(self, job_ids, offsets=None):
+        if offsets is None:
+            offsets = dict()
+        tasks = dict()
+        # Later arrays win, like in SlurmAccounting.array_tasks:
+        for job_id in job_ids:
+            state = read_state(self.jobs_dir, job_id)
+            if state is None:
+                continue
+            for index, task in state['tasks'].iteritems():
+                if task['state'] == 'PENDING':
+                    continue
+                index = int(index) + int(offsets.get(job_id, offsets.get(str(job_id), 0)))
+                tasks[index] = {'array'     : str(job_id),
+                                'jobid'     : '{0}_{1}'.format(job_id, index),
+                                'state'     : str(task['state']),
+                                'elapsed'   : task['elapsed'],
+                                'timelimit' : state['timelimit'],
+                                'reqmem'    : state['reqmem'],
+                                'maxrss'    : task['maxrss']}
+        return tasks
+
+    def throttle(self, job_ids, max_running):
+        '''
+        The runner of each array reads the new number of workers on its next pass
+        '''
+        if max_running == 0:
+            # No limit, like slurm, but still one task per worker:
+            max_running = int(self.settings.get('max_workers', multiprocessing.cpu_count()))
+        updated = []
+        for job_id in job_ids:
+            if read_state(self.jobs_dir, job_id) is None:
+                continue
+            with open(state_file(self.jobs_dir, job_id) + '.throttle', 'w') as _throttle:
+                _throttle.write(str(max_running))
+            updated.append(job_id)
+        return updated
+
+
+def state_file(jobs_dir, job_id):
+    return '{0}/{1}.json'.format(jobs_dir.rstrip('/'), job_id)
+
+
+def read_state(jobs_dir, job_id):
+    try:
+        with open(state_file(jobs_dir, job_id), 'r') as _state:
+            return json.load(_state)
+    except (IOError, ValueError):
+        return None
+
+
+def write_state(jobs_dir, job_id, state):
+    path = state_file(jobs_dir, job_id)
+    with open(path + '.tmp', 'w') as _state:
+        json.dump(state, _state)
+    os.rename(path + '.tmp', path)
+
+
+def dependency_state(jobs_dir, dependency, index):
+    '''Return whether a task can start: 'ok', 'wait' or 'never'
+
+    Follows the slurm semantics of afterok (every task of the upstream
+    arrays completed) and aftercorr (the task with the same index did).
+    '''
+    if dependency is None:
+        return 'ok'
+    kind, upstream = dependency.split(':', 1)
+    result = 'ok'
+    for job_id in upstream.split(':'):
+        state = read_state(jobs_dir, job_id)
+        if state is None:
+            continue
+        if kind == 'aftercorr':
+            tasks = [state['tasks'][str(index)]] if str(index) in state['tasks'] else []
+        else:
+            tasks = state['tasks'].values()
+        for task in tasks:
+            if task['state'] in _failed_states:
+                return 'never'
+            if task['state'] != 'COMPLETED':
+                result = 'wait'
+    return result
+
+
+def run_array(jobs_dir, job_id):
+    '''Run the tasks of a local array, see LocalScheduler
+    '''
+    state = read_state(jobs_dir, job_id)
+    pending = sorted(int(i) for i in state['tasks'])
+    running = dict()
+
+    def cancel(signum, frame):
+        for pid, (index, started, proc) in running.iteritems():
+            os.killpg(pid, signal.SIGTERM)
+            state['tasks'][str(index)]['state'] = 'CANCELLED'
+        for index in pending:
+            state['tasks'][str(index)]['state'] = 'CANCELLED'
+        write_state(jobs_dir, job_id, state)
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, cancel)
+
+    while len(pending) > 0 or len(running) > 0:
+        changed = False
+
+        # The number of workers can be changed with LocalScheduler.throttle:
+        try:
+            with open(state_file(jobs_dir, job_id) + '.throttle', 'r') as _throttle:
+                workers = int(_throttle.read())
+            if workers != state['workers']:
+                state['workers'] = workers
+                changed = True
+        except (IOError, ValueError):
+            pass
+
+        # Collect the tasks that finished, and stop the ones over their time:
+        for pid in running.keys():
+            index, started, proc = running[pid]
+            task = state['tasks'][str(index)]
+            wait_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wait_pid == 0:
+                if state['timelimit'] is not None and time.time() - started > state['timelimit'] \
+                    and task['state'] != 'TIMEOUT':
+                    os.killpg(pid, signal.SIGTERM)
+                    task['state'] = 'TIMEOUT'
+                    changed = True
+                continue
+            proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            if task['state'] != 'TIMEOUT':
+                task['state'] = 'COMPLETED' if proc.returncode == 0 else 'FAILED'
+            task['exitcode'] = proc.returncode
+            task['elapsed'] = time.time() - started
+            # ru_maxrss is in kB on linux:
+            task['maxrss'] = rusage.ru_maxrss * 1024.
+            del running[pid]
+            changed = True
+
+        # Start the tasks that can, up to the number of workers:
+        for index in list(pending):
+            if len(running) >= state['workers']:
+                break
+            ready = dependency_state(jobs_dir, state['dependency'], index)
+            if ready == 'wait':
+                continue
+            pending.remove(index)
+            changed = True
+            if ready == 'never':
+                state['tasks'][str(index)]['state'] = 'CANCELLED'
+                continue
+            env = dict(os.environ)
+            env['SLURM_ARRAY_JOB_ID'] = str(job_id)
+            env['SLURM_ARRAY_TASK_ID'] = str(index)
+            env['SLURM_JOB_ID'] = str(job_id)
+            env.update((str(key), str(value)) for key, value in state['env'].iteritems())
+            log_name = os.path.join(state['cwd'], 'array_{0}-{1}.log'.format(job_id, index))
+            with open(log_name, 'w') as _log:
+                proc = subprocess.Popen(['bash', state['script']], cwd=state['cwd'], env=env,
+                                        stdout=_log, stderr=subprocess.STDOUT,
+                                        preexec_fn=os.setsid)
+            running[proc.pid] = (index, time.time(), proc)
+            state['tasks'][str(index)]['state'] = 'RUNNING'
+
+        if changed:
+            write_state(jobs_dir, job_id, state)
+        time.sleep(1.0)
+
+
+if __name__ == '__main__':
+    run_array(sys.argv[1], sys.argv[2])
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+
+from StageOut import copy_file
+
+
+def fcl_content(fcl):
+    '''Return the content of an fcl file, looked up in FHICL_FILE_PATH
+
+    Returns the name of the file if it can't be found, so the key still
+    depends on which fcl is run.
+    '''
+    candidates = [fcl]
+    if not os.path.isabs(fcl):
+        for directory in os.environ.get('FHICL_FILE_PATH', '').split(':'):
+            if directory != '':
+                candidates.append(os.path.join(directory, fcl))
+    for path in candidates:
+        if os.path.isfile(path):
+            with open(path, 'r') as _fcl:
+                return _fcl.read()
+    print("Could not find {0} to hash its content, using its name".format(fcl))
+    return fcl
+
+
+class ProductCache(object):
+    '''
+    Shared, content addressed store of the products of fcl steps.
+
+    An entry holds the output and ana files of one fcl step, and is keyed
+    by a hash of the software environment, the inputs of the job (their
+    checksums, or the dataset and array task for jobs without input), and
+    the configuration of every fcl run up to and including that step, with
+    its includes resolved.  So two projects running the same g4 and reco
+    fcls on the same inputs share the entries of those steps, even if their
+    later fcls differ.
+
+    Entries are directories named after their key.  They are written
+    under a temporary name and renamed into place, so a partial entry is
+    never used.  Using an entry updates its time stamp, and the least
+    recently used entries are evicted when the cache grows over max_size.
+    Every lookup is appended to usage.log, see cache_report.
+    '''
+    def __init__(self, location, max_size):
+        super(ProductCache, self).__init__()
+        self.location = location.rstrip('/') + '/'
+        self.max_size = max_size
+
+    @staticmethod
+    def base_key(software_key, inputs, n_events=None):
+        '''Return the key of a job before any fcl ran
+
+        Arguments:
+            software_key {str} -- key of the software environment
+            inputs {list} -- checksums (or names and sizes) of the input files,
+                or the identity of the job for stages without input
+
+        Keyword Arguments:
+            n_events {str or None} -- events or event range processed (default: {None})
+        '''
+        key = hashlib.sha1(software_key)
+        for item in sorted(inputs):
+            key.update('\n' + item)
+        key.update('\n' + str(n_events))
+        return key.hexdigest()
+
+    @staticmethod
+    def step_key(previous_key, configuration):
+        '''Return the key after running an fcl on the products of previous_key
+
+        Arguments:
+            previous_key {str} -- key of the products the fcl reads
+            configuration {str} -- configuration of the fcl, with its includes
+                resolved (see LarsoftRunner.fcl_configuration)
+        '''
+        return hashlib.sha1(previous_key + '\n' + configuration).hexdigest()
+
+    def entry_dir(self, key):
+        return self.location + key[:2] + '/' + key + '/'
+
+    def fetch(self, key, work_dir):
+        '''Copy the products of an entry to work_dir
+
+        Returns:
+            dict or None -- the entry (output_file, ana_file, n_events, cpu), or None on a miss
+        '''
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(entry_dir + 'entry.json', 'r') as _entry:
+                entry = json.load(_entry)
+            for file_name in entry['files']:
+                copy_file(entry_dir + file_name, os.path.join(work_dir, file_name))
+            # Mark it as recently used:
+            os.utime(entry_dir + 'entry.json', None)
+        except (IOError, OSError, ValueError):
+            self.log_usage(key, False, 0.)
+            return None
+        for name in ('output_file', 'ana_file'):
+            if entry[name] is not None:
+                entry[name] = str(entry[name])
+        self.log_usage(key, True, entry.get('cpu', 0.))
+        return entry
+
+    def store(self, key, work_dir, output_file, ana_file, n_events, cpu):
+        '''Add the products of a step to the cache
+
+        Failing to store (full disk, existing entry) is reported and ignored.
+        '''
+        files = [f for f in (output_file, ana_file) if f is not None]
+        entry_dir = self.entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        tmp_dir = None
+        try:
+            if not os.path.isdir(os.path.dirname(entry_dir.rstrip('/'))):
+                os.makedirs(os.path.dirname(entry_dir.rstrip('/')))
+            tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.location)
+            size = 0
+            for file_name in files:
+                size += copy_file(os.path.join(work_dir, file_name), os.path.join(tmp_dir, file_name))
+            with open(os.path.join(tmp_dir, 'entry.json'), 'w') as _entry:
+                json.dump({'output_file' : output_file,
+                           'ana_file'    : ana_file,
+                           'files'       : files,
+                           'n_events'    : n_events,
+                           'cpu'         : cpu,
+                           'size'        : size,
+                           'created'     : time.time()}, _entry)
+            os.rename(tmp_dir, entry_dir.rstrip('/'))
+            tmp_dir = None
+        except (IOError, OSError) as e:
+            print("Could not add {0} to the product cache: {1}".format(key, e))
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache fits in max_size
+        '''
+        with open(self.location + '.lock', 'a') as _lock:
+            fcntl.lockf(_lock, fcntl.LOCK_EX)
+            try:
+                entries = []
+                total = 0
+                for prefix in os.listdir(self.location):
+                    prefix_dir = self.location + prefix + '/'
+                    if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                        continue
+                    for key in os.listdir(prefix_dir):
+                        try:
+                            used = os.path.getmtime(prefix_dir + key + '/entry.json')
+                            size = sum(os.path.getsize(prefix_dir + key + '/' + f)
+                                       for f in os.listdir(prefix_dir + key))
+                        except OSError:
+                            continue
+                        entries.append((used, size, prefix_dir + key))
+                        total += size
+                entries.sort()
+                while total > self.max_size and len(entries) > 0:
+                    used, size, entry_dir = entries.pop(0)
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    total -= size
+            finally:
+                fcntl.lockf(_lock, fcntl.LOCK_UN)
+
+    def log_usage(self, key, hit, cpu):
+        try:
+            with open(self.location + 'usage.log', 'a') as _log:
+                _log.write(json.dumps({'key' : key, 'hit' : hit, 'cpu' : cpu, 'time' : time.time()}) + '\n')
+        except IOError:
+            pass
+
+
+def cache_report(location):
+    '''Summarize the lookups of a product cache
+
+    Returns:
+        dict -- number of lookups and hits, and core hours saved by the hits
+    '''
+    report = {'lookups' : 0, 'hits' : 0, 'core_hours_saved' : 0.}
+    try:
+        with open(location.rstrip('/') + '/usage.log', 'r') as _log:
+            for line in _log:
+                try:
+                    usage = json.loads(line)
+                except ValueError:
+                    continue
+                report['lookups'] += 1
+                if usage['hit']:
+                    report['hits'] += 1
+                    report['core_hours_saved'] += usage['cpu'] / 3600.
+    except IOError:
+        pass
+    return report
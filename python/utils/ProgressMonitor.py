@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import socket
+import threading
+
+
+class ProgressMonitor(object):
+    '''
+    Keeps track of the live progress of a job and publishes it to a heartbeat file.
+
+    The runners feed this object as they parse the output stream of lar/gallery,
+    and a background thread periodically writes a small json file to a shared
+    location (the stage work directory) so that `production.py --status` can
+    aggregate the progress of all the running tasks.
+    '''
+    def __init__(self, heartbeat_file, job_id, stage_name, n_steps=1, interval=30):
+        super(ProgressMonitor, self).__init__()
+        self.heartbeat_file = heartbeat_file
+        self.job_id = job_id
+        self.stage_name = stage_name
+        self.n_steps = n_steps
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.state = 'starting'
+        self.started = time.time()
+        # Seconds from process start to the first lar/gallery invocation:
+        self.startup = None
+        self.step = None
+        self.step_index = 0
+        self.step_started = None
+        self.events_target = None
+        self.first_event_time = None
+        self.last_event_time = None
+
+        # Parsed from the output stream of the current step:
+        self.n_records = 0
+        self.n_events = 0
+        self.output_file = None
+        self.found_n_events = False
+        self.found_output = False
+
+        # Latest timings of the shared services the job used (database
+        # and output file system), see set_metric:
+        self.metrics = dict()
+
+    def start(self):
+        '''Start the background thread that writes the heartbeat file
+        '''
+        self.write()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, state):
+        '''Stop the heartbeat thread and write the final state of the job
+
+        Arguments:
+            state {str} -- final state of the job, 'finished' or 'failed'
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self.state = state
+        self.write()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def begin_step(self, step, events_target=None):
+        '''Reset the per step counters before running a new fcl or script
+
+        Arguments:
+            step {str} -- name of the fcl file or script
+
+        Keyword Arguments:
+            events_target {int or None} -- number of events expected from this step (default: {None})
+        '''
+        with self._lock:
+            self.state = 'running'
+            self.step = os.path.basename(step)
+            self.step_index += 1
+            self.step_started = time.time()
+            self.events_target = events_target
+            self.first_event_time = None
+            self.last_event_time = None
+            self.n_records = 0
+            self.n_events = 0
+            self.output_file = None
+            self.found_n_events = False
+            self.found_output = False
+
+    def record(self, n_records):
+        '''Mark that the n-th record of the current step has started processing
+        '''
+        with self._lock:
+            self.n_records = n_records
+            self.last_event_time = time.time()
+            if self.first_event_time is None:
+                self.first_event_time = self.last_event_time
+
+    def set_n_events(self, n_events):
+        with self._lock:
+            self.n_events = n_events
+            self.found_n_events = True
+
+    def set_output_file(self, output_file):
+        with self._lock:
+            self.output_file = output_file
+            self.found_output = True
+
+    def set_metric(self, name, value):
+        '''Publish the latest measurement of a service the job depends on
+
+        The metrics published by the runners are claim_latency and
+        declare_time (seconds spent in database calls) and stage_out_rate
+        (MB/s written to the output location).  They are published with
+        the time they were measured, [value, time], and --watch uses them to
+        adapt the number of tasks running at once (ThrottleController).
+        '''
+        with self._lock:
+            self.metrics[name] = [value, time.time()]
+
+    def rate(self):
+        '''Return the events/s of the current step, or None if unknown
+        '''
+        if self.step_started is None or self.last_event_time is None:
+            return None
+        elapsed = self.last_event_time - self.step_started
+        if elapsed <= 0:
+            return None
+        return self.n_records / elapsed
+
+    def eta(self):
+        '''Return the estimated seconds left in the current step, or None if unknown
+        '''
+        rate = self.rate()
+        if rate is None or rate == 0 or self.events_target is None:
+            return None
+        return max(self.events_target - self.n_records, 0) / rate
+
+    def summary(self):
+        with self._lock:
+            return {
+                'job_id'      : self.job_id,
+                'stage'       : self.stage_name,
+                'host'        : socket.gethostname(),
+                'pid'         : os.getpid(),
+                'state'       : self.state,
+                'step'        : self.step,
+                'step_index'  : self.step_index,
+                'n_steps'     : self.n_steps,
+                'events'      : self.n_records,
+                'target'      : self.events_target,
+                'rate'        : self.rate(),
+                'eta'         : self.eta(),
+                'started'     : self.started,
+                'step_started': self.step_started,
+                'startup'     : self.startup,
+                'last_event'  : self.last_event_time,
+                'updated'     : time.time(),
+                'interval'    : self.interval,
+                'metrics'     : dict(self.metrics),
+            }
+
+    def write(self):
+        '''Atomically write the heartbeat file
+
+        The heartbeat is only informational, so failing to write it
+        (full disk, flaky shared file system) must never kill the job.
+        '''
+        if self.heartbeat_file is None:
+            return
+        tmp_file = self.heartbeat_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as _hb:
+                json.dump(self.summary(), _hb)
+            os.rename(tmp_file, self.heartbeat_file)
+        except (IOError, OSError) as e:
+            print("Could not write heartbeat file {0}: {1}".format(self.heartbeat_file, e))
+
+
+def read_heartbeats(heartbeat_dir):
+    '''Read all of the heartbeat files in a directory
+
+    Arguments:
+        heartbeat_dir {str} -- directory containing [job_id].json heartbeat files
+
+    Returns:
+        list -- list of heartbeat dictionaries
+    '''
+    heartbeats = []
+    if not os.path.isdir(heartbeat_dir):
+        return heartbeats
+    for file_name in os.listdir(heartbeat_dir):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(heartbeat_dir, file_name), 'r') as _hb:
+                heartbeats.append(json.load(_hb))
+        except (IOError, ValueError):
+            # Partially written or removed in the mean time, skip it
+            continue
+    return heartbeats
@@ -1,25 +1,50 @@
 import os
+import json
+import math
 import subprocess
 import time
+import fcntl
 import shutil
 
-from database import DatasetReader, ProjectUtils, ProjectReader
+from MySQLdb import Error
+
+from database import DatasetReader, DatasetUtils, ProjectUtils, ProjectReader
 
 from config import ProjectConfig
+from config.ConfigException import ConfigException
+
+from ProgressMonitor import read_heartbeats
+from ResourceEstimator import ResourceEstimator, format_slurm_time, parse_slurm_time
+from SlurmAccounting import compact_array, task_accounting, FAILED_STATES
+from AccountingSummary import summarize
+from ProductCache import cache_report
+from SubmissionLedger import SubmissionLedger
+from SchedulerTypes import SchedulerTypes
+from Scheduler import TASK_OFFSET_VARIABLE
+from ThrottleController import ThrottleController
+from CompletionForecast import CompletionForecast
 
 class ProjectHandler(object):
     '''
     This class takes the input from the command line, parses,
     and takes the action needed.
     '''
+
+    # Preflights see only a few events, leave more room than right_size:
+    preflight_headroom = 1.5
+    # States of the stages watch is done with:
+    finished_states = ('complete', 'incomplete', 'failed')
+
     def __init__(self, config_file, action, stage=None):
         super(ProjectHandler, self).__init__()
         self.config_file = config_file
         self.stage = stage
         self.action = action
 
-        self.stage_actions = ['submit', 'clean', 'status', 'check', 'statistics']
-        self.project_actions = ['check', 'clean']
+        self.stage_actions = ['submit', 'clean', 'status', 'check', 'makeup', 'statistics', 'watch',
+                              'throttle', 'preflight', 'forecast']
+        self.project_actions = ['submit', 'check', 'clean', 'status', 'watch', 'throttle', 'preflight',
+                                'forecast']
 
         if stage is None and self.action not in self.project_actions:
             raise Exception("Action {} not available".format(self.action))
@@ -36,9 +61,30 @@ class ProjectHandler(object):
         # Create the work directory:
         self.project_work_dir = self.config['top_dir'] + '/work/'
 
-        if stage is not None:
-            self.stage_work_dir = self.project_work_dir + stage + '/'
+        settings = self.config.scheduler()
+        self.scheduler = SchedulerTypes()[settings['type']](settings, self.project_work_dir)
 
+        if stage is not None:
+            self.select_stage(stage)
+
+        # Seconds between two looks at the stages in watch mode:
+        self.watch_interval = 300
+        # Tasks of each array running at once, for the throttle action:
+        self.throttle_value = None
+        # Limits of the scheduler, looked up once:
+        self._limits = None
+        # Events per fcl of preflight runs, and whether they run as a batch task:
+        self.preflight_events = 5
+        self.preflight_batch = False
+        # Simulations of the project run by the forecast action:
+        self.forecast_replicas = 200
+
+    def select_stage(self, stage):
+        '''
+        Make a stage the one acted on, for actions over the whole project
+        '''
+        self.stage = stage
+        self.stage_work_dir = self.project_work_dir + stage + '/'
 
     def build_directory(self):
 
@@ -51,7 +97,10 @@ class ProjectHandler(object):
 
     def act(self):
         if self.action == 'submit':
-            self.submit()
+            if self.stage is None:
+                self.submit_project()
+            else:
+                self.submit()
         elif self.action == 'clean':
             self.clean()
         elif self.action == 'status':
@@ -62,12 +111,119 @@ class ProjectHandler(object):
             self.makeup()
         elif self.action == 'statistics':
             self.statistics()
+        elif self.action == 'watch':
+            self.watch()
+        elif self.action == 'throttle':
+            self.throttle()
+        elif self.action == 'preflight':
+            self.preflight()
+        elif self.action == 'forecast':
+            self.forecast()
         else:
             return
 
 
 
-    def submit(self, makeup = False):
+    def submit_project(self):
+        '''Submit every stage of the project at once
+
+        The stages are submitted in the order of the configuration, and each
+        one waits in the queue for the arrays of the stages producing its
+        input, see dependency.  The datasets of all stages are created before
+        anything runs, and the files of the upstream stages are added to the
+        consumption tables of the later ones as they are declared.
+
+        Stages reading a stage with arrays held back by MaxSubmitJobs (see
+        submit_tasks) are not submitted, --watch submits them once their
+        input is finished.
+        '''
+        # Check every stage can be submitted before queueing any of them:
+        for name in self.config.stages:
+            work_dir = self.project_work_dir + name + '/'
+            if os.path.isdir(work_dir) and os.listdir(work_dir) != []:
+                print('Error: work directory of stage {0} is not empty.'.format(name))
+                raise Exception('Please clean the work directory and resubmit.')
+
+        print('Initializing database entries .......')
+        for name, stage in self.config.stages.iteritems():
+            self.initialize_dataset(stage)
+
+        job_ids = dict()
+        held = []
+        submitted = []
+        for name, stage in self.config.stages.iteritems():
+            if stage.has_input() and any(dataset in held for dataset in stage.input_dataset()):
+                print('Stage {0} reads a stage not fully submitted, submit it with --watch.'.format(name))
+                held.append(stage.output_dataset())
+                continue
+            print('Submitting stage {0} ...'.format(name))
+            self.select_stage(name)
+            dependency = self.dependency(stage, job_ids)
+            jobids = self.submit(dependency=dependency, initialize=False)
+            if jobids is None:
+                print('Could not submit stage {0}, the later stages are not submitted.'.format(name))
+                break
+            offsets = self.ledger().offsets(name)
+            job_ids[stage.output_dataset()] = (stage, dict(
+                (offsets.get(str(jobid), 0), jobid) for jobid in jobids))
+            if len(self.ledger().deferred(name)) > 0:
+                held.append(stage.output_dataset())
+            submitted.append((name, jobids, dependency))
+
+        for name, jobids, dependency in submitted:
+            if isinstance(dependency, dict):
+                dependency = ', '.join(dependency[offset] for offset in sorted(dependency))
+            print('  Stage {0}: arrays {1}, depends on {2}'.format(
+                name, ', '.join(str(j) for j in jobids), dependency))
+        self.stage = None
+
+    def dependency(self, stage, job_ids):
+        '''Return the slurm dependency of a stage on the arrays producing its input
+
+        When the stage reads only one upstream stage with the same number of
+        tasks, and each upstream task produces at least the files a task of
+        the stage reads, task i only waits for task i upstream (aftercorr).
+        At any time fewer tasks of the stage started than upstream tasks
+        finished, so there is always a file to claim.  Otherwise the stage
+        waits for all the upstream arrays (afterok).
+
+        Stages split in several arrays (see submit_tasks) are split the same
+        way, so with aftercorr each array waits for the upstream array with
+        the same task offset.
+
+        Arguments:
+            stage {StageConfig} -- stage to submit
+            job_ids {dict} -- {output dataset : (stage, {task offset : array job id})}
+                of the submitted stages
+
+        Returns:
+            str, dict or None -- slurm dependency, {task offset : slurm dependency}
+            for aftercorr, None if the stage depends on no submitted stage
+        '''
+        if not stage.has_input():
+            return None
+        upstream = [job_ids[dataset] for dataset in stage.input_dataset() if dataset in job_ids]
+        if len(upstream) == 0:
+            return None
+
+        if len(upstream) == 1 and len(stage.input_dataset()) == 1:
+            parent, arrays = upstream[0]
+            if self.correlated(parent, stage):
+                return dict((offset, 'aftercorr:{0}'.format(jobid))
+                            for offset, jobid in arrays.iteritems())
+
+        return 'afterok:' + ':'.join(str(arrays[offset]) for parent, arrays in upstream
+                                     for offset in sorted(arrays))
+
+    def correlated(self, parent, stage):
+        '''
+        Return whether task i of a stage only needs task i of the stage producing its input, see dependency
+        '''
+        return parent.n_pilots() is None and stage.n_pilots() is None \
+            and parent.n_tasks() == stage.n_tasks() \
+            and stage.chains_per_task() * stage.n_files() <= parent.chains_per_task()
+
+    def submit(self, makeup = False, dependency = None, initialize = True):
         '''
         Build a submission script, then call it to launch
         batch jobs.
@@ -75,6 +231,15 @@ class ProjectHandler(object):
         Slurm copies environment variables from the process that launches jobs,
         so we will make a child of the launching process in python and launch jobs
         with larsoft env variables set up.
+
+        Keyword Arguments:
+            makeup {bool} -- resubmission of a stage already initialized (default: {False})
+            dependency {str, dict or None} -- slurm dependency of the arrays, see
+                submit_tasks (default: {None})
+            initialize {bool} -- create the dataset of the stage (default: {True})
+
+        Returns:
+            list or None -- ids of the array jobs submitted, None if a submission failed
         '''
 
         self.build_directory()
@@ -91,31 +256,192 @@ class ProjectHandler(object):
         print('Verifying stage work directory ......')
         self.make_directory(self.stage_work_dir)
 
-        if not makeup:
+        if not makeup and initialize:
             print('Initializing database entries .......')
-            # Make sure the datasets for this project are initialized:
-            proj_util = ProjectUtils()
-
-            proj_util.create_dataset(dataset = stage.output_dataset(),
-                                     parents = stage.input_dataset())
-
+            self.initialize_dataset(stage)
 
         # If the stage work directory is not empty, force the user to clean it:
         if os.listdir(self.stage_work_dir) != [] and not makeup:
             print('Error: stage work directory is not empty.')
             raise Exception('Please clean the work directory and resubmit.')
 
-        print('Building submission script ..........')
+        print('Capturing software environment .....')
+        # Workers load this snapshot instead of running the full setup.
+        # If it can't be made here, they fall back to setting up themselves:
+        try:
+            self.config.software().write_snapshot(self.stage_work_dir)
+        except ConfigException as e:
+            print('Could not capture the software environment, jobs will set up on their own: {0}'.format(e))
+
         # Next, build a submission script to actually submit the jobs
         job_name = self.config['name'] + '.' + stage.name
+
+        print('Writing project descriptor ..........')
+        # Workers load this resolved copy of the configuration instead of
+        # parsing the yml files again:
+        descriptor = self.descriptor_file(stage)
+        self.config.compile(descriptor, stage=stage.name)
+
+        print('Building submission script ..........')
         script_name = self.stage_work_dir + '{0}_submission_script.slurm'.format(job_name)
+        memory, time_limit = self.job_resources(stage)
+        self.write_script(stage, script_name, memory, time_limit)
+
+        # Here is the command to actually submit jobs.  In pilot mode, only
+        # n_pilots tasks are launched and they share the work of n_jobs:
+        if stage.n_pilots() is not None:
+            indices = range(stage.n_pilots())
+        else:
+            indices = range(stage.n_tasks())
+
+        return self.submit_tasks(indices, script_name, dependency,
+                                 memory=memory, time_limit=time_limit)
+
+    def submit_tasks(self, indices, script_name, dependency=None,
+                     memory=None, time_limit=None, generation=0):
+        '''Submit tasks of the stage as arrays within the limits of the scheduler
+
+        Array indices must be lower than MaxArraySize, and a user can't have
+        more than MaxSubmitJobs tasks queued.  The task indices are split in
+        blocks of the smaller of the two (one block when neither is known),
+        each submitted as an array counting from 0, with the index of the
+        first task of its block in PRODUCTION_TASK_OFFSET (see
+        Scheduler.task_job_id).  The concurrent jobs of the stage are shared
+        between its arrays.
+
+        Arrays that don't fit under MaxSubmitJobs with the tasks already
+        queued are kept in the ledger, and submitted by submit_deferred once
+        there is room (--watch does it on every pass).
+
+        Arguments:
+            indices {list} -- task indices in the stage
+            script_name {str} -- path of the script
+
+        Keyword Arguments:
+            dependency {str, dict or None} -- slurm dependency of all the arrays, or
+                {task offset : dependency} of each array (default: {None})
+            memory {int or None} -- memory per chain in MB (default: {None})
+            time_limit {str or None} -- slurm time limit (default: {None})
+            generation {int} -- makeup generation, for the ledger (default: {0})
+
+        Returns:
+            list or None -- ids of the array jobs submitted, None if a submission failed
+        '''
+        stage = self.config.stage(self.stage)
+        limits = self.limits()
+        known = [limit for limit in limits.values() if limit is not None]
+        # Without limits, one array from 0 holds every index, however scattered:
+        block = min(known) if len(known) > 0 else max(indices + [0]) + 1
+        blocks = dict()
+        for index in indices:
+            blocks.setdefault(index // block * block, []).append(index)
+
+        cap = min(len(indices), stage.concurrent_jobs())
+        cap = max(1, int(math.ceil(float(cap) / max(len(blocks), 1))))
+        if len(blocks) > 1:
+            print('Splitting {0} tasks in {1} arrays of at most {2}, {3} running at once each'.format(
+                len(indices), len(blocks), block, cap))
+
+        room = None
+        if limits['max_submit_jobs'] is not None:
+            room = limits['max_submit_jobs'] - self.scheduler.queued_tasks()
+
+        jobids = []
+        deferring = False
+        for offset in sorted(blocks):
+            array = '{0}%{1}'.format(compact_array([index - offset for index in blocks[offset]]), cap)
+            array_dependency = dependency.get(offset) if isinstance(dependency, dict) else dependency
+            if room is not None:
+                # Arrays are submitted in order, nothing goes before a deferred one:
+                deferring = deferring or room < len(blocks[offset])
+                if deferring:
+                    self.ledger().defer(self.stage, script_name, array, len(blocks[offset]),
+                                        task_offset=offset, memory=memory, time_limit=time_limit,
+                                        dependency=array_dependency, generation=generation)
+                    print('Deferred the array of tasks {0} to {1}, over MaxSubmitJobs'.format(
+                        blocks[offset][0], blocks[offset][-1]))
+                    continue
+                room -= len(blocks[offset])
+            jobid = self.submit_array(array, script_name, array_dependency, memory=memory,
+                                      time_limit=time_limit, generation=generation,
+                                      task_offset=offset)
+            if jobid is None:
+                return None
+            jobids.append(jobid)
+        return jobids
+
+    def submit_deferred(self):
+        '''Submit the arrays of the stage held back by MaxSubmitJobs that fit now
+
+        Returns:
+            int -- number of tasks submitted
+        '''
+        deferred = self.ledger().deferred(self.stage)
+        if len(deferred) == 0:
+            return 0
+        room = None
+        max_submit_jobs = self.limits()['max_submit_jobs']
+        if max_submit_jobs is not None:
+            room = max_submit_jobs - self.scheduler.queued_tasks()
+
+        n_submitted = 0
+        for array in deferred:
+            if room is not None:
+                if room < array['n_tasks']:
+                    break
+                room -= array['n_tasks']
+            jobid = self.submit_array(array['array'], array['script'], array['dependency'],
+                                      memory=array['memory'], time_limit=array['time_limit'],
+                                      generation=array['generation'],
+                                      task_offset=array['task_offset'])
+            if jobid is None:
+                break
+            self.ledger().remove_deferred(array['id'])
+            n_submitted += array['n_tasks']
+        return n_submitted
+
+    def limits(self):
+        '''
+        Return the limits of the scheduler on arrays, see Scheduler.limits
+        '''
+        if self._limits is None:
+            self._limits = self.scheduler.limits()
+        return self._limits
+
+    def initialize_dataset(self, stage):
+        '''
+        Make sure the dataset of a stage is initialized
+        '''
+        proj_util = ProjectUtils()
+
+        proj_util.create_dataset(dataset = stage.output_dataset(),
+                                 parents = stage.input_dataset(),
+                                 events_per_shard = stage.events_per_shard())
+
+    def write_script(self, stage, script_name, memory, time_limit, arguments=None):
+        '''Write the slurm script running the jobs of a stage
+
+        Arguments:
+            stage {StageConfig} -- stage to run
+            script_name {str} -- path of the script
+            memory {int} -- memory per chain, in MB
+            time_limit {str} -- slurm time limit
+
+        Keyword Arguments:
+            arguments {str or None} -- arguments of run_job.py, instead of the
+                descriptor and stage of the jobs (default: {None})
+        '''
+        job_name = self.config['name'] + '.' + stage.name
         with open(script_name, 'w') as script:
             script.write('#!/bin/bash\n')
             script.write('#SBATCH --job-name={0}\n'.format(job_name))
             script.write('#SBATCH --ntasks=1\n')
-            script.write('#SBATCH -p guenette\n')
-            script.write('#SBATCH --mem={0}mb\n'.format(stage['memory']))
-            script.write('#SBATCH --time={0}\n'.format(stage['time']))
+            if stage.cpus_per_task() > 1:
+                script.write('#SBATCH --cpus-per-task={0}\n'.format(stage.cpus_per_task()))
+            script.write('#SBATCH -p {0}\n'.format(self.scheduler.settings['partition']))
+            # Memory is set per chain, packed tasks need enough for all of them:
+            script.write('#SBATCH --mem={0}mb\n'.format(memory*stage.chains_per_task()))
+            script.write('#SBATCH --time={0}\n'.format(time_limit))
             script.write('#SBATCH --output=array_%A-%a.log\n')
             script.write('\n')
             script.write('pwd; hostname; date;\n')
@@ -125,64 +451,63 @@ class ProjectHandler(object):
             script.write('unset helmod\n')
             script.write('\n')
             script.write('#Below is the python script that runs on each node:\n')
-            script.write('run_job.py {0} {1} \n'.format(
-                os.environ['PWD'] + '/' + self.config_file,
-                self.stage))
+            if arguments is not None:
+                script.write('run_job.py {0}\n'.format(arguments))
+            elif stage.n_pilots() is not None:
+                script.write('run_job.py {0} {1} --pilot\n'.format(
+                    self.descriptor_file(stage),
+                    stage.name))
+            else:
+                script.write('run_job.py {0} {1} \n'.format(
+                    self.descriptor_file(stage),
+                    stage.name))
             script.write('date;\n')
             script.write('\n')
 
-        # Maximum running jobs is not set by default, but can be specified:
-
-        n_jobs = stage.n_jobs()-1
-        if makeup:
-            with open(self.stage_work_dir + "makeup_jobs.txt", 'r') as _mj:
-                n_jobs = int(_mj.readline())
-
-
-        # Here is the command to actually submit jobs:
-        command = ['sbatch', '-a', '0-{0}%{1}'.format(stage.n_jobs()-1, stage.concurrent_jobs()), script_name]
-
-        with open(self.stage_work_dir + '/slurm_submission_command.txt', 'w') as _com:
-            _com.write(' '.join(command))
+    def submit_array(self, array, script_name, dependency=None,
+                     memory=None, time_limit=None, generation=0, task_offset=0):
+        '''Submit a job script as an array with the scheduler, and record it in the ledger
 
-        print("Submitting jobs ...")
-        # Run the command:
-        proc = subprocess.Popen(command,
-                                cwd = self.stage_work_dir,
-                                stdout = subprocess.PIPE,
-                                stderr = subprocess.PIPE,
-                                env = dict(os.environ))
-        retval=proc.poll()
-        # the loop executes to wait till the command finish running
-        stdout=''
-        stderr=''
-        while retval is None:
-            time.sleep(1.0)
-            # while waiting, fetch stdout (including STDERR) to avoid crogging the pipe
-            for line in iter(proc.stdout.readline, b''):
-                stdout += line
-            for line in iter(proc.stderr.readline, b''):
-                stderr += line
-            # update the return value
-            retval = proc.poll()
-
-        with open(self.stage_work_dir + '/submission_log.out', 'w') as _log:
-            _log.write(stdout)
-        with open(self.stage_work_dir + '/submission_log.err', 'w') as _log:
-            _log.write(stderr)
-
-
-        return_code = proc.returncode
-        if return_code == 0:
-            print("Submitted jobs successfully.")
-
-            # Make sure to store the currently running jobID:
-            jobid = int(stdout.split(' ')[-1])
-            with open(self.stage_work_dir + 'current_running_jobid', 'w') as _log:
-                _log.write(str(jobid))
-        else:
-            print("sbatch exited with status {0}, check output logs in the work directory".format(return_code))
+        Arguments:
+            array {str} -- slurm --array specification
+            script_name {str} -- path of the script
+
+        Keyword Arguments:
+            dependency {str or None} -- slurm --dependency specification (default: {None})
+            memory {int or None} -- memory per chain in MB (default: {None})
+            time_limit {str or None} -- slurm time limit (default: {None})
+            generation {int} -- makeup generation, for the ledger (default: {0})
+            task_offset {int} -- index in the stage of task 0 of the array (default: {0})
+
+        Returns:
+            int or None -- id of the array job, None if the submission failed
+        '''
+        env = {TASK_OFFSET_VARIABLE : task_offset} if task_offset != 0 else None
+        jobid = self.scheduler.submit(array, script_name, self.stage_work_dir,
+                                      dependency=dependency, memory=memory,
+                                      time_limit=time_limit, env=env)
+        if jobid is not None:
+            self.ledger().record(self.stage, jobid, array,
+                                 memory=memory, time_limit=time_limit,
+                                 dependency=dependency, generation=generation,
+                                 command=self.scheduler.last_command,
+                                 task_offset=task_offset)
+        return jobid
+
+
+    def descriptor_file(self, stage):
+        '''
+        Return the path of the compiled descriptor for a stage
+        '''
+        return self.project_work_dir + stage.name + '/{0}.{1}_project.json'.format(
+            self.config['name'], stage.name)
 
+    def ledger(self):
+        '''
+        Return the submission ledger of the project
+        '''
+        self.make_directory(self.project_work_dir)
+        return SubmissionLedger(self.project_work_dir)
 
     def make_directory(self, path):
         '''
@@ -217,6 +542,7 @@ class ProjectHandler(object):
 
             shutil.rmtree(stage.output_directory())
             shutil.rmtree(self.stage_work_dir)
+            self.ledger().forget(self.stage)
         else:
             # Clean ALL stages plus the work directory and the top level directory
             for name, stage in self.config.stages.iteritems():
@@ -250,121 +576,267 @@ class ProjectHandler(object):
             return True
         return False
 
-    def squeue_parse(self, jobid):
+    def status(self):
+        '''
+        The status function reads in the job id number from the work directory
+        and queries the scheduler to get job status.
+        '''
+        # The job submission output is stored in the work directory.
 
-        # Going to use squeue for this command and parse the output
+        # Get the job ID from the submission script:
 
-        command = ['/usr/bin/squeue', '--format=%.25i %.9P %.8j %.8u %.8T %.10M %.9l %.6D %R', '-j', str(jobid)]
 
-        proc = subprocess.Popen(command,
-                                cwd = self.stage_work_dir,
-                                stdout = subprocess.PIPE,
-                                stderr = subprocess.PIPE,
-                                env = dict(os.environ))
-        retval=proc.poll()
-        # the loop executes to wait till the command finish running
-        stdout=''
-        stderr=''
-        while retval is None:
-            time.sleep(1.0)
-            # while waiting, fetch stdout (including STDERR) to avoid crogging the pipe
-            for line in iter(proc.stdout.readline, b''):
-                stdout += line
-            for line in iter(proc.stderr.readline, b''):
-                stderr += line
-            # update the return value
-            retval = proc.poll()
+        if self.stage is None:
+            # Every stage of the project, for example after submit_project:
+            for name in self.config.stages:
+                self.select_stage(name)
+                if len(self.job_ids()) == 0:
+                    print('Stage {0} has not been submitted.'.format(name))
+                    continue
+                print('Stage {0}:'.format(name))
+                self.status()
+            self.stage = None
+            return
 
-        if retval != 0:
+        # All the arrays of the stage (first submission and makeups) at once:
+        job_ids = self.job_ids()
+        job_status_counts = self.scheduler.queue_counts(job_ids)
 
-            raise Exception('Error when querying the job status.')
+        print('Condensed information for jobids {0}:'.format(', '.join(str(j) for j in job_ids)))
+        if job_status_counts is None:
+            print('  No jobs in the queue')
+        else:
+            for state, count in job_status_counts.iteritems():
+                print('  {0} jobs in state {1}'.format(count, state))
+        deferred = self.ledger().deferred(self.stage)
+        if len(deferred) > 0:
+            print('  {0} jobs in {1} arrays waiting for room under MaxSubmitJobs'.format(
+                sum(array['n_tasks'] for array in deferred), len(deferred)))
+
+        self.heartbeat_status(self.config.stage(self.stage))
+
+        if self.config.stage(self.stage).cache() is not None:
+            report = cache_report(self.config.stage(self.stage).cache()[0])
+            if report['lookups'] > 0:
+                print('Product cache: {0} hits in {1} lookups ({2:.0f}%), {3:.1f} core hours saved'.format(
+                    report['hits'], report['lookups'], 100. * report['hits'] / report['lookups'],
+                    report['core_hours_saved']))
+
+        # Loading the descriptor the jobs run with reports any change
+        # made to the yml files since this stage was submitted:
+        descriptor = self.descriptor_file(self.config.stage(self.stage))
+        if os.path.isfile(descriptor):
+            if len(ProjectConfig(descriptor).stale_sources) == 0:
+                print('Configuration unchanged since submission.')
+
+    def heartbeat_status(self, stage):
+        '''Aggregate the live progress published by the running jobs
+
+        Each running job writes a heartbeat file to the stage work directory.
+        Jobs that have not processed an event in a long time (counting from
+        the start of their current fcl) are flagged as stalled, jobs whose
+        heartbeat stopped updating are flagged as lost
+        (most likely killed by the scheduler), and jobs running at less than
+        half of the median rate are flagged as slow.
 
-        # Now, start digging through the output
-        lines = stdout.split('\n')
-        if len(lines) <= 1:
-            # No jobs running
-            return None
+        Arguments:
+            stage {StageConfig} -- stage to report on
+        '''
+        heartbeats = read_heartbeats(self.stage_work_dir + 'heartbeats/')
+        if len(heartbeats) == 0:
+            print('  No heartbeats published for this stage yet')
+            return
 
-        # Else, sort the jobs.
-        job_status_counts = dict()
-        keys = lines[0].split()
-        state_index = -1
-        jobid_index = -1
-        i = 0
-        for key in keys:
-            if key == 'STATE':
-                state_index = i
-            if key == 'JOBID':
-                jobid_index = i
-            i += 1
-
-        for line in lines[1:]:
-            line  = line.split()
-            if len(line) == 0:
-                continue
-            state = line[state_index]
-            jobid = line[jobid_index]
-            if state == 'PENDING':
-                # have to do something special to count the number of pending jobs
-                pnd_split = jobid.split('_')[-1]
-                pnd_split = pnd_split.replace('[', '').replace(']', '')
-                pnd_split = pnd_split.split('%')[0]
-                n_jobs = int(pnd_split.split('-')[-1]) - int(pnd_split.split('-')[0]) + 1
-                job_status_counts[state] = n_jobs
-            else:
-                if state not in job_status_counts.keys():
-                    job_status_counts[state] = 1
+        now = time.time()
+        stall_timeout = max(600, 10*stage.heartbeat_interval())
+
+        state_counts = dict()
+        running = []
+        stalled = []
+        lost = []
+        events_done = 0
+        for hb in heartbeats:
+            state = hb['state']
+            if state in ['starting', 'running']:
+                if now - hb['updated'] > 3*hb['interval']:
+                    lost.append(hb)
+                    state = 'lost'
                 else:
-                    job_status_counts[state] += 1
-
-        return job_status_counts
-
-    def status(self):
+                    # A step still starting up has no event yet, it is not
+                    # stalled before the step itself ran for stall_timeout:
+                    last_progress = hb['last_event'] or hb.get('step_started') or hb['started']
+                    if now - last_progress > stall_timeout:
+                        stalled.append(hb)
+                    running.append(hb)
+            if state not in state_counts:
+                state_counts[state] = 1
+            else:
+                state_counts[state] += 1
+            if hb['events'] is not None:
+                events_done += hb['events']
+
+        rates = sorted([hb['rate'] for hb in running if hb['rate'] is not None])
+        slow = []
+        if len(rates) > 0:
+            median_rate = rates[len(rates)/2]
+            slow = [hb for hb in running
+                    if hb['rate'] is not None and hb['rate'] < 0.5*median_rate]
+
+        print('Live progress from {0} job heartbeats:'.format(len(heartbeats)))
+        for state, count in state_counts.iteritems():
+            print('  {0} jobs {1}'.format(count, state))
+        print('  {0} events processed in the current step of each job'.format(events_done))
+        if len(rates) > 0:
+            print('  {0:.3f} events/s in total, median {1:.3f} events/s per job'.format(
+                sum(rates), median_rate))
+        etas = [hb['eta'] for hb in running if hb['eta'] is not None]
+        if len(etas) > 0:
+            print('  Longest ETA of a running step: {0:.0f} s'.format(max(etas)))
+        for label, jobs in [('stalled', stalled), ('slow', slow), ('lost', lost)]:
+            for hb in jobs:
+                print('  {0:8} job {1} on {2}, step {3} ({4}/{5}), {6} events'.format(
+                    label, hb['job_id'], hb['host'], hb['step'],
+                    hb['step_index'], hb['n_steps'], hb['events']))
+
+    def job_resources(self, stage):
+        '''Return the memory (MB, per chain) and time limit requested for a stage
+
+        With right_size set in the stage, these are derived from completed
+        jobs, see resource_history.  Otherwise, and when there are not enough
+        completed jobs, they come from the configuration.
+
+        Returns:
+            tuple -- (memory in MB, slurm time string)
         '''
-        The status function reads in the job id number from the work directory
-        and queries the scheduler to get job status.
+        memory = stage['memory']
+        time_limit = stage.time_seconds()
+
+        settings = stage.right_size()
+        if settings is None:
+            return memory, format_slurm_time(time_limit)
+
+        samples = self.resource_history(stage, settings['min_jobs'])
+        if len(samples) < settings['min_jobs']:
+            print('Only {0} completed jobs to size the request from, using the configured memory and time.'.format(
+                len(samples)))
+            return memory, format_slurm_time(time_limit)
+
+        estimator = ResourceEstimator(samples, settings['quantile'], settings['headroom'])
+        if estimator.memory() is not None:
+            memory = estimator.memory()
+        # Pilots run jobs until their time is spent, so only single jobs are sized:
+        if stage.n_pilots() is None:
+            estimate = estimator.time(self.expected_events(stage))
+            if estimate is not None:
+                time_limit = estimate
+
+        print('Sized from {0} completed jobs: {1} MB and {2} per job (configured: {3} MB and {4})'.format(
+            len(samples), memory, format_slurm_time(time_limit),
+            stage['memory'], format_slurm_time(stage.time_seconds())))
+        return memory, format_slurm_time(time_limit)
+
+    def resource_history(self, stage, min_jobs):
+        '''Collect the peak memory and time of completed jobs like the ones of a stage
+
+        Uses the statistics recorded by the runners for this stage, then for
+        any other dataset produced with the same fcl files, and finally the scheduler accounting
+        for the last array of this stage, until there are min_jobs samples.
+        Only jobs that ran every fcl file count: jobs resumed from a
+        checkpoint or served from the product cache ran part of the chain.
+
+        Returns:
+            list -- dicts with peak_rss (bytes), walltime (s) and, if known, nevents
         '''
-        # The job submission output is stored in the work directory.
-
-        # Get the job ID from the submission script:
+        reader = DatasetReader()
+        steps = ','.join(os.path.basename(fcl) for fcl in stage.fcl())
+        samples = []
+        try:
+            samples += reader.job_statistics(stage.output_dataset(), steps=steps)
+        except Error:
+            pass
 
+        if len(samples) < min_jobs:
+            for (dataset,) in ProjectReader().list_datasets():
+                if dataset == stage.output_dataset():
+                    continue
+                try:
+                    samples += reader.job_statistics(dataset, steps=steps)
+                except Error:
+                    # Datasets from before the statistics table existed
+                    continue
 
-        if self.stage is None:
-            raise Exception('Please specify a stage.')
+        if len(samples) < min_jobs:
+            samples += self.scheduler_history(stage)
 
-        # Get the jobid, first:
-        jobid = self.job_id()
+        return samples
 
-        job_status_counts = self.squeue_parse(jobid)
+    def scheduler_history(self, stage):
+        '''Return the peak memory and time of the completed tasks of the stage
 
-        print('Condensed information for jobid {0}:'.format(jobid))
-        for state, count in job_status_counts.iteritems():
-            print('  {0} jobs in state {1}'.format(count, state))
+        Taken from the scheduler accounting (sacct for slurm).
 
-    def job_id(self):
-        '''Look up the job id
+        Returns:
+            list -- dicts with peak_rss (bytes, per chain) and walltime (s)
+        '''
+        job_ids = self.job_ids()
+        if len(job_ids) == 0:
+            return []
 
+        try:
+            tasks = self.scheduler.array_tasks(job_ids, self.ledger().offsets(self.stage))
+        except (OSError, subprocess.CalledProcessError) as e:
+            print('Could not query the scheduler accounting: {0}'.format(e))
+            return []
+
+        return [{'walltime'  : task['elapsed'],
+                 'peak_rss'  : task['maxrss'] / stage.chains_per_task()}
+                for task in tasks.values()
+                if task['state'] == 'COMPLETED' and task['maxrss'] > 0]
+
+    def expected_events(self, stage):
+        '''Return the number of events each job of a stage is expected to read, or None
         '''
-        # Get the job ID from the submission script:
-        submission_log = self.stage_work_dir + '/current_running_jobid'
-        with open(submission_log, 'r') as sl:
-            line = sl.readline()
-            job_id = int(line.split(' ')[-1])
+        if stage.events_per_shard() is not None:
+            return stage.events_per_shard()
+        if not stage.has_input():
+            return stage.events_per_job()
+
+        # Whole input files, take the average events of the input files:
+        reader = DatasetReader()
+        n_files = 0
+        n_events = 0
+        for parent in stage.input_dataset():
+            n_files += reader.count_files(parent, type=0)
+            n_events += reader.sum(parent, 'nevents', type=0) or 0
+        if n_files == 0:
+            return None
+        expected = stage.n_files() * float(n_events) / n_files
+        if stage.events_per_job() is not None:
+            expected = min(expected, stage.events_per_job())
+        return expected
 
-        return job_id
+    def job_ids(self):
+        '''Look up the ids of all the arrays of the stage, in order of submission
+
+        The first submission and every makeup are in the ledger.  Stages
+        submitted before the ledger existed have their last array ids in
+        current_running_jobid.
+        '''
+        job_ids = self.ledger().job_ids(self.stage)
+        if len(job_ids) == 0 and os.path.isfile(self.stage_work_dir + 'current_running_jobid'):
+            with open(self.stage_work_dir + 'current_running_jobid', 'r') as sl:
+                job_ids = [int(j) for j in sl.read().split()]
+        return job_ids
 
     def is_running_jobs(self):
         '''Find out how many jobs are running or queued
 
         '''
 
-        # Get the jobid, first:
-        jobid = self.job_id()
-
-        if self.squeue_parse(jobid) is None:
+        job_ids = self.job_ids()
+        if len(job_ids) == 0:
             return False
-        else:
-            return True
+        return self.scheduler.queue_counts(job_ids) is not None
 
     def check(self):
         '''
@@ -393,56 +865,76 @@ class ProjectHandler(object):
         Arguments:
             stage {StageConfig} -- stage identifier
         '''
+        report = self.stage_report(stage)
+
+        print('Report for stage {0}: '.format(stage.name))
+        print('  Completed {n_ana} events of {target} specified, across {n_ana_files} ana files.'.format(
+            n_ana = report['n_ana_events'], target = report['total_ana_events'],
+            n_ana_files = report['n_ana_files']))
+        print('  Completed {n_out} events of {target} specified, across {n_out_files} output files.'.format(
+            n_out = report['n_out_events'], target = report['total_out_events'],
+            n_out_files = report['n_out_files']))
+
+        if report['has_input']:
+            print('  {0} files have been consumed from the input'.format(report['n_consumed']))
+            print('  {0} files have been yielded from the input without finishing'.format(report['n_yielded']))
+            print('  {0} files are unprocessed from the input'.format(report['n_unyielded']))
+
+        # How many events were produced over how many files?
+        print('  Need to run {0} makeup jobs, use --makeup to resubmit the failed tasks.'.format(
+            report['n_makeup_jobs']))
+
+        # Keep the number of required makeup jobs in the ledger:
+        self.ledger().record_check(stage.name, report['n_missing_events'], report['n_makeup_jobs'])
+
+    def stage_report(self, stage):
+        '''Count what a stage produced and consumed, from the database
+
+        Returns:
+            dict -- target and declared events and files, the consumption
+            counts of stages with input (has_input, n_consumed, n_yielded,
+            n_unyielded, n_abandoned), n_missing_events and n_makeup_jobs
+        '''
 
         # First figure out what are the goals of this stage
-        total_out_events = stage.total_output_events()
-        total_ana_events = stage.total_output_events()
+        total_out_events = stage.total_output_events() or 0
+        total_ana_events = stage.total_output_events() or 0
         if stage['output']['anaonly']:
             total_out_events = 0
 
         dataset_reader = DatasetReader()
         project_reader = ProjectReader()
 
+        report = {'total_out_events' : total_out_events,
+                  'total_ana_events' : total_ana_events}
+
         # Next, count the events declared to the database for this stage:
-        n_ana_events = dataset_reader.sum(
+        report['n_ana_events'] = dataset_reader.sum(
             dataset=stage.output_dataset(),
             target='nevents',
             type=1)
-        n_out_events = dataset_reader.sum(
+        report['n_out_events'] = dataset_reader.sum(
             dataset=stage.output_dataset(),
             target='nevents',
             type=0)
 
-        n_ana_files = dataset_reader.count_files(
+        report['n_ana_files'] = dataset_reader.count_files(
             dataset=stage.output_dataset(),
             type=1)
-        n_out_files = dataset_reader.count_files(
+        report['n_out_files'] = dataset_reader.count_files(
             dataset=stage.output_dataset(),
             type=0)
 
-        print('Report for stage {0}: '.format(stage.name))
-        print('  Completed {n_ana} events of {target} specified, across {n_ana_files} ana files.'.format(
-            n_ana = n_ana_events, target = total_ana_events, n_ana_files=n_ana_files))
-        print('  Completed {n_out} events of {target} specified, across {n_out_files} output files.'.format(
-            n_out = n_out_events, target = total_out_events, n_out_files=n_out_files))
-
         # If this stage has an input, and therefore a consumption table,
         # Find out how many files are remaining to be processed and
         # How many are yielded but not consumed.
 
-        if project_reader.has_parents(stage.output_dataset()):
-            n_consumed = dataset_reader.count_consumption_files(
-                dataset=stage.output_dataset(),
-                state='consumed')
-            n_unyielded = dataset_reader.count_consumption_files(
-                dataset=stage.output_dataset(),
-                state='unyielded')
-            n_yielded = dataset_reader.count_consumption_files(
-                dataset=stage.output_dataset(),
-                state='yielded')
-            print('  {0} files have been consumed from the input'.format(n_consumed))
-            print('  {0} files have been yielded from the input without finishing'.format(n_yielded))
-            print('  {0} files are unprocessed from the input'.format(n_unyielded))
+        report['has_input'] = project_reader.has_parents(stage.output_dataset())
+        if report['has_input']:
+            for state in ['consumed', 'unyielded', 'yielded', 'abandoned']:
+                report['n_' + state] = dataset_reader.count_consumption_files(
+                    dataset=stage.output_dataset(),
+                    state=state)
 
         #Calculate how many makeup jobs to run
         # Look at:
@@ -452,70 +944,680 @@ class ProjectHandler(object):
 
         # Since we don't always know how many events are in each job,
         # compare the number of produced events to the number of produced files:
-        n_missing_events = 0
-        out_events_per_file = 0
         if stage['output']['anaonly']:
-            if n_ana_events is None or n_ana_events == 0:
-                n_makeup_jobs = stage.n_jobs()
-            else:
-                n_missing_events = total_ana_events - n_ana_events
-                out_events_per_file = n_ana_events / n_ana_files
-                n_makeup_jobs = int(n_missing_events / out_events_per_file + 1)
+            n_events, n_files, total = report['n_ana_events'], report['n_ana_files'], total_ana_events
+        else:
+            n_events, n_files, total = report['n_out_events'], report['n_out_files'], total_out_events
 
+        if n_events is None or n_events == 0:
+            report['n_missing_events'] = total
+            report['n_makeup_jobs'] = stage.n_jobs()
         else:
-            if n_out_events is None or n_out_events == 0:
-                n_makeup_jobs = stage.n_jobs()
+            report['n_missing_events'] = total - n_events
+            out_events_per_file = n_events / n_files
+            report['n_makeup_jobs'] = int(report['n_missing_events'] / out_events_per_file + 1)
+
+        return report
+
+    def makeup(self):
+        '''Resubmit the failed tasks of a stage
+
+        Asks the scheduler for the final state of every task of all the arrays of
+        the stage in the ledger, the latest array of each task index wins.
+        The input files claimed by the failed tasks
+        are given back to the consumption table in one update, and exactly
+        the failed task indices are resubmitted.  Tasks that ran out of
+        memory or time are resubmitted separately, asking for escalation_factor
+        times the memory or time they had.
+
+        Returns:
+            int or None -- number of tasks resubmitted, None if the stage can't
+            be made up now (tasks still queued, or the accounting could not be read)
+        '''
+        stage = self.config.stage(self.stage)
+
+        if self.is_running_jobs():
+            print('Tasks of stage {0} are still queued or running, make up once they are done.'.format(stage.name))
+            return None
+
+        if len(self.ledger().deferred(stage.name)) > 0:
+            print('Tasks of stage {0} are waiting to be submitted, make up once they are done.'.format(stage.name))
+            return None
+
+        self.feed_unfed()
+
+        job_ids = self.job_ids()
+        try:
+            tasks = self.scheduler.array_tasks(job_ids, self.ledger().offsets(stage.name))
+        except (OSError, subprocess.CalledProcessError) as e:
+            print('Could not query the scheduler accounting: {0}'.format(e))
+            return None
+
+        states = dict()
+        for task in tasks.values():
+            states[task['state']] = states.get(task['state'], 0) + 1
+        print('Tasks of arrays {0}: {1}'.format(
+            ', '.join(str(j) for j in job_ids),
+            ', '.join('{0} {1}'.format(n, state) for state, n in sorted(states.items()))))
+
+        failed = dict((index, task) for index, task in tasks.iteritems()
+                      if task['state'] in FAILED_STATES)
+        if len(failed) == 0:
+            print('No failed tasks to make up.')
+            return 0
+
+        # Give the inputs claimed by the failed tasks back:
+        if stage.has_input():
+            n_reset, n_abandoned = DatasetUtils().reset_failed_jobs(
+                stage.output_dataset(),
+                [task['jobid'] for task in failed.values()],
+                stage.max_attempts())
+            print('Reset {0} input files claimed by failed tasks.'.format(n_reset))
+            if n_abandoned > 0:
+                print('Abandoned {0} input files that failed {1} times.'.format(
+                    n_abandoned, stage.max_attempts()))
+        elif stage.n_pilots() is not None:
+            # Pilots without input count the jobs they start, so only the
+            # completed ones (one output file each) keep their slot:
+            n_done = DatasetReader().count_files(stage.output_dataset(),
+                type=1 if stage['output']['anaonly'] else 0)
+            with open(self.stage_work_dir + 'pilot_slots', 'w') as _slots:
+                _slots.write(str(n_done))
+
+        # Group the tasks by the resources to ask for:
+        memory, time_limit = self.job_resources(stage)
+        time_limit = parse_slurm_time(time_limit)
+        groups = dict()
+        for index, task in failed.iteritems():
+            task_memory = memory
+            task_time = time_limit
+            if task['state'] == 'OUT_OF_MEMORY' and task['reqmem'] is not None:
+                per_chain = task['reqmem'] / 1024.**2 / stage.chains_per_task()
+                task_memory = int(math.ceil(per_chain * stage.escalation_factor() / 100.)) * 100
+            if task['state'] == 'TIMEOUT' and task['timelimit'] is not None:
+                task_time = task['timelimit'] * stage.escalation_factor()
+            key = (max(task_memory, memory), format_slurm_time(max(task_time, time_limit)))
+            groups.setdefault(key, []).append(index)
+
+        job_name = self.config['name'] + '.' + stage.name
+        generation = (self.ledger().generation(stage.name) or 0) + 1
+        n_resubmitted = 0
+        for i, ((task_memory, task_time), indices) in enumerate(sorted(groups.items())):
+            print('Resubmitting {0} tasks with {1} MB and {2}'.format(len(indices), task_memory, task_time))
+            script_name = self.stage_work_dir + '{0}_makeup_{1}_{2}_submission_script.slurm'.format(
+                job_name, generation, i)
+            self.write_script(stage, script_name, task_memory, task_time)
+            if self.submit_tasks(sorted(indices), script_name, memory=task_memory,
+                                 time_limit=task_time, generation=generation) is not None:
+                n_resubmitted += len(indices)
+        return n_resubmitted
+
+    def feed_unfed(self):
+        '''Feed the later stages the output files the jobs of the stage could not
+
+        The files are recorded in unfed_files in the stage work directory
+        by JobRunner.feed_daughters.  Feeding a file twice does not add its
+        rows again, the ones that fail again stay recorded.
+
+        Returns:
+            int -- number of files fed
+        '''
+        path = self.stage_work_dir + 'unfed_files'
+        if not os.path.isfile(path):
+            return 0
+        stage = self.config.stage(self.stage)
+        dataset_util = DatasetUtils()
+        n_fed = 0
+        with open(path, 'r+') as _unfed:
+            fcntl.lockf(_unfed, fcntl.LOCK_EX)
+            try:
+                left = []
+                for line in _unfed.read().splitlines():
+                    file_id, nevents = line.split()
+                    try:
+                        dataset_util.feed_daughters(stage.output_dataset(), int(file_id),
+                                                    int(nevents) if nevents != 'None' else None)
+                        n_fed += 1
+                    except Error as e:
+                        print('Could not add file {0} to the later stages: {1}'.format(file_id, e))
+                        left.append(line + '\n')
+                _unfed.seek(0)
+                _unfed.truncate()
+                _unfed.write(''.join(left))
+            finally:
+                fcntl.lockf(_unfed, fcntl.LOCK_UN)
+        if n_fed > 0:
+            print('Fed {0} output files left unfed by their jobs to the later stages.'.format(n_fed))
+        return n_fed
+
+    def watch(self):
+        '''Follow the stages of the project until they are all finished
+
+        Every watch_interval seconds, each stage (or only the selected one)
+        is looked at in the order of the configuration:
+         - a stage not submitted yet is submitted once the stages producing
+           its input are finished
+         - a stage with tasks queued or running is left alone, apart from
+           submitting its arrays held back by MaxSubmitJobs when they fit,
+           and adapting its throttle to the load on the database and output
+           file system if the stage has adaptive_throttle (adapt_throttle)
+         - a stage with no task left in the queue feeds the later stages
+           the output files its jobs could not (feed_unfed), is checked
+           against the database (stage_report), and made up if events or
+           input files are missing, until it ran max_makeups makeups
+
+        A stage is only checked once the stages producing its input are
+        finished, so it is not made up while its input is still coming.
+        A query of the scheduler or the database that fails is logged, and
+        the stage is looked at again in the next pass (see watch_stage).
+        Every decision is logged, with the time, to watch.log in the project
+        work directory.
+        '''
+        names = [self.stage] if self.stage is not None else list(self.config.stages.keys())
+        finished = self.finished_states
+
+        states = dict()
+        last_counts = dict()
+        controllers = dict()
+        for name in names:
+            self.select_stage(name)
+            submitted = len(self.job_ids()) > 0 or len(self.ledger().deferred(name)) > 0
+            states[name] = 'running' if submitted else 'waiting'
+        self.log_event('Watching stages {0}'.format(', '.join(
+            '{0} ({1})'.format(name, states[name]) for name in names)))
+
+        while True:
+            for name in names:
+                if states[name] in finished:
+                    continue
+                self.select_stage(name)
+                try:
+                    self.watch_stage(name, names, states, last_counts, controllers)
+                except (subprocess.CalledProcessError, OSError, Error) as e:
+                    # squeue, sbatch or the database failing once does not end the watch:
+                    if states[name] == 'waiting' and os.path.isdir(self.stage_work_dir) \
+                        and os.listdir(self.stage_work_dir) != []:
+                        # A partial submission leaves the work directory to clean:
+                        states[name] = 'failed'
+                        self.log_event('{0}: submission failed, {1}'.format(name, e))
+                    else:
+                        self.log_event('{0}: {1}, trying again in the next pass'.format(name, e))
+
+            if all(states[name] in finished for name in names):
+                break
+            time.sleep(self.watch_interval)
+
+        self.log_event('Finished: {0}'.format(', '.join(
+            '{0} {1}'.format(name, states[name]) for name in names)))
+
+    def watch_stage(self, name, names, states, last_counts, controllers):
+        '''Take one look at a stage in watch mode, and act on it
+
+        Arguments:
+            name {str} -- stage to look at, the selected one
+            names {list} -- stages watched
+            states {dict} -- {stage : state in the watch}, updated
+            last_counts {dict} -- {stage : last counts of its tasks in the queue}, updated
+            controllers {dict} -- {stage : its ThrottleController}, updated
+        '''
+        finished = self.finished_states
+        stage = self.config.stage(name)
+
+        # Stages of this watch producing the input of this stage:
+        upstream = [other for other in names
+                    if stage.has_input() and
+                    self.config.stage(other).output_dataset() in stage.input_dataset()]
+        upstream_finished = all(states[other] in finished for other in upstream)
+
+        if states[name] == 'waiting':
+            if not upstream_finished:
+                return
+            jobids = self.submit()
+            if jobids is None:
+                states[name] = 'failed'
+                self.log_event('{0}: submission failed'.format(name))
             else:
-                n_missing_events = total_out_events - n_out_events
-                out_events_per_file = n_out_events / n_out_files
-                n_makeup_jobs = int(n_missing_events / out_events_per_file + 1)
+                states[name] = 'running'
+                self.log_event('{0}: submitted arrays {1}'.format(
+                    name, ', '.join(str(j) for j in jobids)))
+            return
 
+        n_deferred = self.submit_deferred()
+        if n_deferred > 0:
+            self.log_event('{0}: submitted {1} deferred tasks'.format(name, n_deferred))
+        counts = self.scheduler.queue_counts(self.job_ids())
+        if counts is not None:
+            if counts != last_counts.get(name):
+                self.log_event('{0}: {1}'.format(name, ', '.join(
+                    '{0} {1}'.format(n, state) for state, n in sorted(counts.items()))))
+                last_counts[name] = counts
+            if stage.adaptive_throttle() is not None:
+                if name not in controllers:
+                    controllers[name] = ThrottleController(stage.adaptive_throttle(),
+                                                           stage.concurrent_jobs())
+                self.adapt_throttle(controllers[name], counts.get('RUNNING', 0))
+            return
+        if not upstream_finished or len(self.ledger().deferred(name)) > 0:
+            return
 
-        # How many events were produced over how many files?
-        print('  Need to run {0} makeup jobs, makeup is not implemented yet.'.format(n_makeup_jobs))
+        # Before the stages reading this one can see it finished:
+        n_fed = self.feed_unfed()
+        if n_fed > 0:
+            self.log_event('{0}: fed {1} output files to the later stages'.format(name, n_fed))
+        report = self.stage_report(stage)
+        if report['has_input']:
+            missing = report['n_yielded'] + report['n_unyielded'] > 0
+            summary = '{0} input files unprocessed, {1} abandoned'.format(
+                report['n_yielded'] + report['n_unyielded'], report['n_abandoned'])
+        else:
+            missing = report['n_missing_events'] > 0
+            summary = '{0} events missing'.format(max(report['n_missing_events'], 0))
+        if not missing:
+            states[name] = 'complete'
+            self.log_event('{0}: complete, {1} events in {2} output files'.format(
+                name, report['n_out_events'] or report['n_ana_events'],
+                report['n_out_files'] or report['n_ana_files']))
+            return
 
-        # Write the number of required makeup jobs to the work directory:
-        makeup_log = self.stage_work_dir + "makeup_jobs.txt"
-        with open(makeup_log, 'w') as _ml:
-            _ml.write(str(n_makeup_jobs))
+        n_makeups = self.ledger().generation(name) or 0
+        if n_makeups >= stage.max_makeups():
+            states[name] = 'failed'
+            self.log_event('{0}: giving up after {1} makeups, {2}'.format(name, n_makeups, summary))
+            return
+        n_resubmitted = self.makeup()
+        if n_resubmitted is None:
+            self.log_event('{0}: could not be made up, trying again in the next pass'.format(name))
+        elif n_resubmitted > 0:
+            self.log_event('{0}: drained with {1}, made up {2} tasks (makeup {3} of {4})'.format(
+                name, summary, n_resubmitted, n_makeups + 1, stage.max_makeups()))
+        else:
+            states[name] = 'incomplete'
+            self.log_event('{0}: drained with {1} and no failed task to make up'.format(name, summary))
 
+    def adapt_throttle(self, controller, n_running):
+        '''Let the controller of the stage decide its tasks running at once, and apply it
 
-    def makeup(self):
-        '''Run makeup jobs
+        The limit of the controller is for the whole stage, it is shared
+        between the arrays of the stage still in the queue.  Decisions are
+        logged when the limit or its reason change.
+        '''
+        previous = controller.limit
+        previous_reason = controller.reason
+        reason, medians, throughput = controller.update(
+            read_heartbeats(self.stage_work_dir + 'heartbeats/'), n_running)
+        measured = ', '.join('{0} {1:.2f}'.format(name, value) for name, value in sorted(medians.items()))
+        if controller.limit != previous:
+            queued = self.queued_arrays()
+            per_array = int(math.ceil(float(controller.limit) / max(len(queued), 1)))
+            if len(queued) > 0:
+                self.scheduler.throttle(queued, per_array)
+            self.ledger().throttle_deferred(self.stage, per_array)
+            self.log_event('{0}: throttle {1} -> {2} tasks, {3} ({4:.0f} events/hour{5})'.format(
+                self.stage, previous, controller.limit, reason, throughput,
+                ', ' + measured if measured != '' else ''))
+        elif reason != previous_reason:
+            self.log_event('{0}: throttle kept at {1} tasks, {2} ({3:.0f} events/hour{4})'.format(
+                self.stage, controller.limit, reason, throughput,
+                ', ' + measured if measured != '' else ''))
+
+    def queued_arrays(self):
+        '''
+        Return the ids of the arrays of the stage with tasks still in the queue
+        '''
+        return [jobid for jobid in self.job_ids()
+                if self.scheduler.queue_counts([jobid]) is not None]
 
-        Search the list of completed jobs, and query how many jobs are not running
+    def throttle(self):
+        '''Change the number of tasks running at once of the stage, or of every stage
 
-        If no jobs are running, submit jobs to complete the previous stage of running.
+        Applies throttle_value to every array of the stage still in the
+        queue (scontrol update ArrayTaskThrottle for slurm), and to the
+        arrays held back by MaxSubmitJobs.
         '''
+        if self.throttle_value is None or self.throttle_value < 0:
+            raise Exception('The throttle needs a number of tasks, 0 for no limit.')
 
-        # Makeup behavior is different for jobs with input than without.
-        # For jobs without input, we look at the target number of events,
-        # compare with the produced number of events/per file, calculate
-        # the approximate number of needed jobs to meet the target, and submit that
+        if self.stage is None:
+            for name in self.config.stages:
+                self.select_stage(name)
+                self.throttle()
+            self.stage = None
+            return
 
-        # For jobs with input, we reset the consumption status of failed jobs,
-        # then compare the number of files per job in the yml to the number of unprocessed
-        # files.  We submit the number of needed jobs to process remaining files.
+        queued = self.queued_arrays()
+        updated = self.scheduler.throttle(queued, self.throttle_value) if len(queued) > 0 else []
+        self.ledger().throttle_deferred(self.stage, self.throttle_value)
+        if len(updated) > 0:
+            print('Stage {0}: arrays {1} now run {2} tasks at once.'.format(
+                self.stage, ', '.join(str(j) for j in updated), self.throttle_value))
+        elif len(queued) > 0:
+            print('Stage {0}: could not throttle arrays {1}.'.format(
+                self.stage, ', '.join(str(j) for j in queued)))
+        else:
+            print('Stage {0}: no array in the queue.'.format(self.stage))
 
+    def log_event(self, message):
+        '''
+        Print a time stamped message of the watch, and add it to watch.log
+        '''
+        line = '{0} {1}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), message)
+        print(line)
+        self.make_directory(self.project_work_dir)
+        with open(self.project_work_dir + 'watch.log', 'a') as _log:
+            _log.write(line + '\n')
+
+    def preflight(self):
+        '''Check a stage, or every stage, on a few events before submitting it
+
+        Runs run_job.py --preflight, on this machine or as a single task of
+        the scheduler (preflight_batch), in [project work dir]/preflight/[stage]/.
+        Each fcl is validated with lar --debug-config, then the chain runs on
+        preflight_events events of the first input files of the stage, and
+        nothing goes to the database.  For the whole project, a stage whose
+        input is not in the catalog yet reads the preflight output of the
+        stage producing it.  The memory, time and events_per_job to use are
+        printed, and saved with the report in recommendation.json.
+        '''
+        if self.stage is None:
+            outputs = dict()
+            for name, stage in self.config.stages.iteritems():
+                self.select_stage(name)
+                report = self.preflight_stage(stage, outputs)
+                if report is None or not report['success']:
+                    print('Stopping the preflight at stage {0}.'.format(name))
+                    break
+                if report['output_file'] is not None:
+                    outputs[stage.output_dataset()] = report['output_file']
+            self.stage = None
+            return
+        self.preflight_stage(self.config.stage(self.stage), dict())
 
-        # First, make sure there are no jobs running for the current submission
-        # of this project
+    def preflight_stage(self, stage, upstream_outputs):
+        '''Run the preflight of a stage and print the recommendations
 
-        # Now, move the file containing the job id to a list of old job ids, and
-        # clean the old file to make room for the new one.
+        Arguments:
+            stage {StageConfig} -- stage to check
+            upstream_outputs {dict} -- {dataset : output file of its preflight}
 
-        # First,
-        n_makeup_jobs
+        Returns:
+            dict or None -- the report of run_job.py --preflight, None if it could not run
+        '''
+        if self.config.software()['type'] != 'larsoft':
+            print('Preflight runs are only available for larsoft stages.')
+            return None
 
-        # Makeup command requires a check stage command first
-        print ('Submission of makeup jobs is not implemented yet.')
+        inputs = self.preflight_inputs(stage, upstream_outputs)
+        if stage.has_input() and len(inputs) == 0:
+            print('No input file for stage {0} yet, run the preflight of the stages producing it.'.format(
+                stage.name))
+            return None
+
+        preflight_dir = self.project_work_dir + 'preflight/' + stage.name + '/'
+        if os.path.isdir(preflight_dir):
+            shutil.rmtree(preflight_dir)
+        self.make_directory(preflight_dir)
+        report_file = preflight_dir + 'report.json'
+        arguments = [os.path.abspath(self.config_file), stage.name,
+                     '--preflight', str(self.preflight_events), '--report', report_file]
+        if len(inputs) > 0:
+            arguments += ['--inputs'] + inputs
+
+        print('Preflight of stage {0} on {1} events ...'.format(stage.name, self.preflight_events))
+        if self.preflight_batch:
+            script_name = preflight_dir + 'preflight_script.slurm'
+            self.write_script(stage, script_name, stage['memory'], format_slurm_time(stage.time_seconds()),
+                              arguments=' '.join(arguments))
+            jobid = self.scheduler.submit('0', script_name, preflight_dir, memory=stage['memory'],
+                                          time_limit=format_slurm_time(stage.time_seconds()))
+            if jobid is None:
+                return None
+            print('Waiting for preflight job {0} ...'.format(jobid))
+            while self.scheduler.queue_counts([jobid]) is not None:
+                time.sleep(30)
+        else:
+            with open(preflight_dir + 'preflight.log', 'w') as _log:
+                subprocess.call(['run_job.py'] + arguments, cwd=preflight_dir,
+                                stdout=_log, stderr=subprocess.STDOUT, env=dict(os.environ))
+
+        try:
+            with open(report_file, 'r') as _report:
+                report = json.load(_report)
+        except (IOError, ValueError):
+            print('The preflight of stage {0} did not finish, see the logs in {1}'.format(
+                stage.name, preflight_dir))
+            return None
+
+        for step in report['fcls']:
+            if not step['valid'] or step.get('return_code', 0) != 0:
+                print('  {0} failed: {1}'.format(step['fcl'], step['message'] or
+                      'status {0}, see the logs in {1}'.format(step.get('return_code'), preflight_dir)))
+        if report['success']:
+            recommendation = self.preflight_recommendation(stage, report)
+            with open(preflight_dir + 'recommendation.json', 'w') as _recommendation:
+                json.dump({'report' : report, 'recommendation' : recommendation}, _recommendation,
+                          indent=2)
+        return report
+
+    def preflight_inputs(self, stage, upstream_outputs):
+        '''
+        Return the input files of a preflight run, the first files of the input datasets
+        '''
+        if not stage.has_input():
+            return []
+        inputs = []
+        for parent in stage.input_dataset():
+            if parent in upstream_outputs:
+                inputs.append(upstream_outputs[parent])
+                continue
+            try:
+                inputs += [row[0] for row in DatasetReader().select(parent, 'filename',
+                                                                     limit=stage.n_files(), type=0)]
+            except Error as e:
+                print('Could not read the files of dataset {0}: {1}'.format(parent, e))
+        return inputs[:stage.n_files()]
+
+    def preflight_recommendation(self, stage, report):
+        '''Derive the memory, time and events per job of a stage from its preflight
+
+        A job is modelled as the startup of each fcl plus its time per event
+        times the events of the job.  The memory is the peak of the preflight.
+        Both are given preflight_headroom.
+
+        Returns:
+            dict -- memory (MB per chain), and when known time (for the events
+            expected per job) and events_per_job (the most that fit in the
+            configured time)
+        '''
+        steps = report['fcls']
+        peak = report['peak_rss'] / 1024.**2
+        memory = int(math.ceil(peak * self.preflight_headroom / 100.)) * 100
+        recommendation = {'memory' : max(memory, ResourceEstimator.min_memory)}
+        print('Stage {0}: peak memory {1:.0f} MB'.format(stage.name, peak))
+
+        if any(step['per_event'] is None for step in steps):
+            print('  No event was processed by some fcl, the time per event is unknown.')
+        else:
+            startup = sum(step['startup'] for step in steps)
+            per_event = sum(step['per_event'] for step in steps)
+            print('  {0:.1f} s to the first event, {1:.2f} s per event ({2})'.format(
+                startup, per_event, ', '.join('{0} {1:.2f} s'.format(step['fcl'], step['per_event'])
+                                              for step in steps)))
+            fit = int((stage.time_seconds() / self.preflight_headroom - startup) / per_event)
+            if fit > 0:
+                recommendation['events_per_job'] = fit
+            expected = self.expected_events(stage)
+            # Pilots run jobs until their time is spent, only single jobs are sized:
+            if expected is not None and stage.n_pilots() is None:
+                needed = (startup + expected * per_event) * self.preflight_headroom
+                recommendation['time'] = format_slurm_time(max(needed, ResourceEstimator.min_time))
+                print('  {0:.0f} events per job need about {1}'.format(
+                    expected, format_slurm_time((startup + expected * per_event))))
+
+        print('  Recommended: memory {0}, time {1}, events_per_job {2}'.format(
+            recommendation['memory'], recommendation.get('time', 'unknown'),
+            recommendation.get('events_per_job', 'unknown')))
+        print('  Configured:  memory {0}, time {1}, events_per_job {2}'.format(
+            stage['memory'], format_slurm_time(stage.time_seconds()), stage.events_per_job()))
+        if stage['memory'] < recommendation['memory']:
+            print('  Warning: the configured memory is below the peak of the preflight.')
+        if 'time' in recommendation and \
+            parse_slurm_time(recommendation['time']) > stage.time_seconds():
+            print('  Warning: jobs are not expected to finish in the configured time.')
+        return recommendation
+
+    def forecast(self):
+        '''Forecast when a stage, or every stage, and the project will be finished
+
+        Every stage is simulated forecast_replicas times with CompletionForecast:
+        the jobs left (n_jobs minus the jobs in the statistics of the stage)
+        run max_concurrent_jobs tasks at a time, each drawing its run time
+        from the completed jobs of the stage (see resource_history) and its
+        queue wait from the project (see queue_waits).  Jobs running now are
+        counted as not started.  The completion is printed with its
+        sensitivity to the concurrency and the events per job of all the
+        stages, and saved in forecast.json in the project work directory.
+        '''
+        names = self.config.stages.keys()
+        if self.stage is not None:
+            # Only the stage and the stages it waits for:
+            names = [self.stage]
+            for name in reversed(self.config.stages.keys()):
+                if name in names and self.config.stage(name).has_input():
+                    names += [parent for parent, stage in self.config.stages.iteritems()
+                              if stage.output_dataset() in self.config.stage(name).input_dataset()
+                              and parent not in names]
+            names = [name for name in self.config.stages if name in names]
+
+        waits = self.queue_waits()
+        if len(waits) == 0:
+            print('No queue wait measured in this project yet, run --statistics on its stages.')
+            waits = [0.]
+
+        stage_name = self.stage
+        stages = []
+        for name in names:
+            self.select_stage(name)
+            stages.append(self.forecast_stage(self.config.stage(name), waits, names))
+        self.stage = stage_name
+
+        print('Simulating the project {0} times ...'.format(self.forecast_replicas))
+        forecast = CompletionForecast(stages, replicas=self.forecast_replicas).forecast()
+        forecast['stages'] = [dict((key, stage[key]) for key in ['name', 'n_jobs', 'slots', 'source'])
+                              for stage in stages]
+
+        def hours(completion):
+            return 'median {0:.1f} h, 10% {1:.1f} h, 90% {2:.1f} h'.format(
+                completion['p50'] / 3600., completion['p10'] / 3600., completion['p90'] / 3600.)
+
+        for stage in stages:
+            print('Stage {0}: {1} jobs left, {2} at a time, run times from {3}'.format(
+                stage['name'], stage['n_jobs'], stage['slots'], stage['source']))
+            print('  Done in {0}'.format(hours(forecast['completion'][stage['name']])))
+        print('Project done in {0}'.format(hours(forecast['completion']['project'])))
+        for scenario in forecast['sensitivity']:
+            print('  With {0} x{1:g}: {2}'.format(scenario['parameter'].replace('_', ' '),
+                                                  scenario['factor'], hours(scenario['completion'])))
+
+        with open(self.project_work_dir + 'forecast.json', 'w') as _forecast:
+            json.dump(forecast, _forecast, indent=2, sort_keys=True)
+
+    def forecast_stage(self, stage, waits, names):
+        '''Describe a stage for CompletionForecast
+
+        Run times come from the completed jobs of the stage, then from its
+        preflight (see preflight), and at worst are its time limit.  The
+        time a job spends before its first event is also taken from the
+        preflight, 0 without one.
+
+        Arguments:
+            stage {StageConfig} -- stage to forecast
+            waits {list} -- queue waits of the project, in seconds
+            names {list} -- stages forecast, the others are not waited for
+        '''
+        try:
+            done = len(DatasetReader().job_statistics(stage.output_dataset()))
+        except Error:
+            done = 0
+        left = max(0, stage.n_jobs() - done)
+        chains = stage.chains_per_task()
+        if stage.n_pilots() is not None:
+            # Pilots run the jobs one after the other, chains_per_task at a time:
+            n_jobs = left
+            slots = min(stage.n_pilots(), stage.concurrent_jobs()) * chains
+        else:
+            n_jobs = (left + chains - 1) / chains
+            slots = stage.concurrent_jobs()
+
+        startup = 0.
+        preflight = None
+        try:
+            with open(self.project_work_dir + 'preflight/' + stage.name + '/recommendation.json', 'r') as _pre:
+                preflight = json.load(_pre)['report']
+        except (IOError, ValueError):
+            pass
+        if preflight is not None and all(step['per_event'] is not None for step in preflight['fcls']):
+            startup = sum(step['startup'] for step in preflight['fcls'])
+
+        min_jobs = stage.right_size()['min_jobs'] if stage.right_size() is not None else 10
+        durations = [sample['walltime'] for sample in self.resource_history(stage, min_jobs)
+                     if sample['walltime'] is not None]
+        source = '{0} completed jobs'.format(len(durations))
+        if len(durations) == 0 and startup > 0 and self.expected_events(stage) is not None:
+            durations = [startup + self.expected_events(stage) *
+                         sum(step['per_event'] for step in preflight['fcls'])]
+            source = 'the preflight'
+        if len(durations) == 0:
+            durations = [stage.time_seconds()]
+            source = 'the time limit'
+
+        upstream = [name for name in names if stage.has_input()
+                    and self.config.stage(name).output_dataset() in stage.input_dataset()]
+        correlated = len(upstream) == 1 and len(stage.input_dataset()) == 1 \
+            and self.correlated(self.config.stage(upstream[0]), stage)
+        return {'name'       : stage.name,
+                'n_jobs'     : n_jobs,
+                'slots'      : slots,
+                'durations'  : durations,
+                'waits'      : waits,
+                'startup'    : startup,
+                'upstream'   : upstream,
+                'correlated' : correlated,
+                'source'     : source}
+
+    def queue_waits(self):
+        '''Return the seconds tasks of the project waited in the queue
+
+        Taken from the accounting collected by --statistics, for the first
+        tasks of the arrays that did not wait for another array: the only
+        ones whose wait is not spent behind a dependency or the % cap.
+        '''
+        accounting = self.ledger().accounting()
+        waits = []
+        for submission in self.ledger().submissions():
+            if submission['dependency'] is not None:
+                continue
+            cap = int(submission['array'].split('%')[1]) if '%' in submission['array'] else None
+            for task in accounting:
+                if task['stage'] != submission['stage'] or task['array'] != str(submission['jobid']) \
+                    or task['start'] is None or task['submit'] is None:
+                    continue
+                if cap is None or task['task'] - submission['task_offset'] < cap:
+                    waits.append(task['start'] - task['submit'])
+        return waits
 
     def statistics(self):
 
-        ''' Call sacct to get the statistics for this job in long form.
+        ''' Call sacct to get the statistics for this stage in long form.
 
-        Saves to a file in the work area for this job.
+        Covers all the arrays of the stage in the ledger.  Saves to a file
+        in the work area for this stage, then stores the accounting of every
+        task in the ledger (collect_accounting) and prints its summary, also
+        saved as sacct_summary_[stage].json.
         '''
+        if self.scheduler.settings['type'] != 'slurm':
+            print('sacct statistics are only available for stages run by slurm.')
+            return
+
         command = ['sacct']
 
 
@@ -540,8 +1642,9 @@ class ProjectHandler(object):
         # command.append('--long')
 
 
+        job_ids = ','.join(str(j) for j in self.job_ids())
         command.append('-j')
-        command.append(str(self.job_id()))
+        command.append(job_ids)
 
         proc = subprocess.Popen(command,
                                 cwd = self.stage_work_dir,
@@ -569,11 +1672,66 @@ class ProjectHandler(object):
 
 
         # Finished querying, write the output to a log file.
-        file_name = "/sacct_long_job_{0}.out".format(self.job_id())
+        file_name = "/sacct_long_{0}.out".format(self.stage)
         with open(self.stage_work_dir + file_name, 'w') as _job_sacct_log:
             _job_sacct_log.write(stdout)
 
 
-        print('sacct files for job_id {job_id} have been written to {path}'.format(
-            job_id=self.job_id(),
-            path=self.stage_work_dir + file_name))
\ No newline at end of file
+        print('sacct files for job_ids {job_id} have been written to {path}'.format(
+            job_id=job_ids,
+            path=self.stage_work_dir + file_name))
+
+        self.collect_accounting()
+        summary = summarize(self.ledger().accounting(self.stage))
+        with open(self.stage_work_dir + 'sacct_summary_{0}.json'.format(self.stage), 'w') as _summary:
+            json.dump(summary, _summary, indent=2, sort_keys=True)
+        self.print_accounting_summary(summary)
+
+    def collect_accounting(self):
+        '''Store the sacct accounting of every task of the stage in the ledger
+
+        Each task is joined with the events of the files it declared in the
+        catalog (the output files, or the ana files of anaonly stages), by
+        job id.  Pilot iterations and packed chains are added to their task.
+        '''
+        stage = self.config.stage(self.stage)
+        tasks = task_accounting(self.job_ids(), self.ledger().offsets(self.stage))
+
+        events = dict()
+        try:
+            for jobid, nevents in DatasetReader().select(stage.output_dataset(), 'jobid, nevents',
+                                                         type=1 if stage['output']['anaonly'] else 0):
+                if jobid is None or nevents is None:
+                    continue
+                task = str(jobid).split('.')[0]
+                events[task] = events.get(task, 0) + nevents
+        except Error as e:
+            print('Could not read the events of the stage from the catalog: {0}'.format(e))
+        for task in tasks:
+            task['nevents'] = events.get(task['jobid'])
+
+        self.ledger().store_accounting(self.stage, tasks)
+        print('Stored the accounting of {0} tasks in {1}'.format(len(tasks), self.ledger().path))
+
+    def print_accounting_summary(self, summary):
+        '''
+        Print the summary of the accounting of a stage, see AccountingSummary.summarize
+        '''
+        print('{0} tasks: {1}'.format(summary['n_tasks'], ', '.join(
+            '{0} {1}'.format(n, state) for state, n in sorted(summary['states'].items()))))
+        if len(summary['failures']) > 0:
+            print('Failures: {0}'.format(', '.join(
+                '{0} {1}'.format(n, failure) for failure, n in sorted(summary['failures'].items()))))
+        for key, title, scale, unit in [('elapsed', 'Elapsed', 1/60., ' min'),
+                                        ('queue_wait', 'Queue wait', 1/60., ' min'),
+                                        ('cpu_efficiency', 'CPU efficiency', 100., '%'),
+                                        ('memory_headroom', 'Unused memory', 100., '%'),
+                                        ('events_per_core_hour', 'Events per core hour', 1., '')]:
+            if summary[key] is None:
+                continue
+            print('{0}: median {1:.1f}{4}, 10% {2:.1f}{4}, 90% {3:.1f}{4} ({5} tasks)'.format(
+                title, summary[key]['p50'] * scale, summary[key]['p10'] * scale,
+                summary[key]['p90'] * scale, unit, summary[key]['n']))
+        print('{0:.1f} core hours for {1:.0f} events'.format(summary['core_hours'], summary['events']))
+        if summary['events_per_core_hour_total'] is not None:
+            print('{0:.1f} events per core hour overall'.format(summary['events_per_core_hour_total']))
\ No newline at end of file
@@ -0,0 +1,103 @@
+import math
+
+
+def quantile(values, q):
+    '''Return the q quantile of values, interpolating between samples
+
+    Arguments:
+        values {list} -- numbers, need not be sorted
+        q {float} -- quantile, between 0 and 1
+    '''
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    position = q * (len(values) - 1)
+    low = int(math.floor(position))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def format_slurm_time(seconds):
+    '''Format a number of seconds as a slurm [D-]HH:MM:SS time limit
+    '''
+    seconds = int(math.ceil(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    time_string = '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+    if days > 0:
+        time_string = '{0}-{1}'.format(days, time_string)
+    return time_string
+
+
+def parse_slurm_time(time_string):
+    '''Return the seconds of a slurm [D-][HH:]MM:SS[.mmm] time, as printed by sacct
+    '''
+    days = 0
+    if '-' in time_string:
+        days, time_string = time_string.split('-')
+    seconds = 0.
+    for token in time_string.split(':'):
+        seconds = 60*seconds + float(token)
+    return 86400*int(days) + seconds
+
+
+def parse_slurm_memory(memory_string):
+    '''Return the bytes of a slurm memory value like 1234K or 2.5G
+    '''
+    units = {'K' : 1024., 'M' : 1024.**2, 'G' : 1024.**3, 'T' : 1024.**4}
+    memory_string = memory_string.strip()
+    if memory_string[-1] in units:
+        return float(memory_string[:-1]) * units[memory_string[-1]]
+    return float(memory_string)
+
+
+class ResourceEstimator(object):
+    '''
+    Derives the memory and time requests of a stage from completed jobs.
+
+    Each sample is a dict with the peak_rss (bytes) and walltime (s) of a
+    job, and optionally the number of events it processed.  The requests
+    are a quantile of the samples times a headroom factor.  When the
+    number of events of the past jobs is known, the time is estimated per
+    event and scaled to the events expected in the new jobs.
+    '''
+
+    # Never request less than this, to absorb the startup and stage out time:
+    min_memory = 500
+    min_time = 600
+
+    def __init__(self, samples, quantile=0.95, headroom=1.25):
+        super(ResourceEstimator, self).__init__()
+        self.samples = samples
+        self.quantile = quantile
+        self.headroom = headroom
+
+    def memory(self):
+        '''Return the memory request per job in MB, or None without samples
+        '''
+        rss = [s['peak_rss'] for s in self.samples if s.get('peak_rss')]
+        if len(rss) == 0:
+            return None
+        value = quantile(rss, self.quantile) * self.headroom / 1e6
+        # Round up to the next 100 MB:
+        return max(int(math.ceil(value / 100.)) * 100, self.min_memory)
+
+    def time(self, expected_events=None):
+        '''Return the time request per job in seconds, or None without samples
+
+        Keyword Arguments:
+            expected_events {int or None} -- events each new job will process (default: {None})
+        '''
+        per_event = [s['walltime'] / s['nevents'] for s in self.samples
+                     if s.get('walltime') and s.get('nevents')]
+        if expected_events is not None and len(per_event) > 0:
+            value = quantile(per_event, self.quantile) * expected_events
+        else:
+            walltime = [s['walltime'] for s in self.samples if s.get('walltime')]
+            if len(walltime) == 0:
+                return None
+            value = quantile(walltime, self.quantile)
+        value *= self.headroom
+        # Round up to the next minute:
+        return max(int(math.ceil(value / 60.)) * 60, self.min_time)
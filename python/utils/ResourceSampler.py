@@ -0,0 +1,166 @@
+import os
+import time
+import resource
+import threading
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def _read_stat(pid):
+    '''Return (ppid, cpu seconds, rss bytes) of a process from /proc/[pid]/stat
+
+    The cpu time includes the children the process already waited for.
+    '''
+    with open('/proc/{0}/stat'.format(pid), 'r') as _stat:
+        data = _stat.read()
+    # The command name can contain spaces, the fields start after it:
+    fields = data[data.rindex(')') + 2:].split()
+    ppid = int(fields[1])
+    ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    rss = int(fields[21]) * _PAGE_SIZE
+    return ppid, float(ticks) / _CLOCK_TICKS, rss
+
+
+def _read_io(pid):
+    '''Return (read bytes, written bytes) of a process, zeros if not readable
+    '''
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/{0}/io'.format(pid), 'r') as _io:
+            for line in _io:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return read_bytes, write_bytes
+
+
+def sample_tree(root_pid):
+    '''Sum the resources used by a process and all of its descendants
+
+    Returns:
+        dict -- rss (bytes), cpu (seconds), read and write (bytes) and
+        the number of processes, or None if the process is gone
+    '''
+    stats = dict()
+    children = dict()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid, cpu, rss = _read_stat(entry)
+        except (IOError, OSError, ValueError, IndexError):
+            # Exited while we were looking
+            continue
+        pid = int(entry)
+        stats[pid] = (cpu, rss)
+        children.setdefault(ppid, []).append(pid)
+
+    if root_pid not in stats:
+        return None
+
+    sample = {'rss' : 0, 'cpu' : 0., 'read' : 0, 'write' : 0, 'processes' : 0}
+    pending = [root_pid]
+    while len(pending) > 0:
+        pid = pending.pop()
+        cpu, rss = stats[pid]
+        read_bytes, write_bytes = _read_io(pid)
+        sample['rss'] += rss
+        sample['cpu'] += cpu
+        sample['read'] += read_bytes
+        sample['write'] += write_bytes
+        sample['processes'] += 1
+        pending += children.get(pid, [])
+    return sample
+
+
+class ResourceSampler(object):
+    '''
+    Samples the memory, cpu and I/O of a process tree from /proc.
+
+    A background thread takes a sample every interval seconds and appends
+    it to a small csv file (one per fcl/script), and the peak and final
+    values are kept for the summary of the step.  The cpu time of the
+    children is also taken from getrusage once the process has been waited
+    for, so the time used after the last sample is not lost.
+    '''
+    def __init__(self, pid, csv_file=None, interval=10):
+        super(ResourceSampler, self).__init__()
+        self.pid = pid
+        self.csv_file = csv_file
+        self.interval = interval
+
+        self.started = time.time()
+        self.finished = None
+        self.peak_rss = 0
+        self.cpu = 0.
+        self.read = 0
+        self.write = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._csv = None
+        self._rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    def start(self):
+        if self.csv_file is not None:
+            try:
+                self._csv = open(self.csv_file, 'w')
+                self._csv.write('time,rss_mb,cpu_s,read_mb,write_mb,processes\n')
+            except IOError as e:
+                print("Could not write resource file {0}: {1}".format(self.csv_file, e))
+                self._csv = None
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop sampling and return the summary of the process
+
+        Call this after the process was waited for.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.finished = time.time()
+        rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (rusage.ru_utime - self._rusage.ru_utime) + (rusage.ru_stime - self._rusage.ru_stime)
+        self.cpu = max(self.cpu, cpu)
+        if self._csv is not None:
+            self._csv.close()
+            self._csv = None
+        return self.summary()
+
+    def _loop(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def sample(self):
+        sample = sample_tree(self.pid)
+        if sample is None:
+            return
+        self.peak_rss = max(self.peak_rss, sample['rss'])
+        # Counters only go up, except when a child exits before being waited for:
+        self.cpu = max(self.cpu, sample['cpu'])
+        self.read = max(self.read, sample['read'])
+        self.write = max(self.write, sample['write'])
+        if self._csv is not None:
+            self._csv.write('{0:.1f},{1:.1f},{2:.1f},{3:.1f},{4:.1f},{5}\n'.format(
+                time.time() - self.started, sample['rss'] / 1e6, sample['cpu'],
+                sample['read'] / 1e6, sample['write'] / 1e6, sample['processes']))
+            self._csv.flush()
+
+    def summary(self):
+        end = self.finished if self.finished is not None else time.time()
+        return {
+            'walltime' : end - self.started,
+            'peak_rss' : self.peak_rss,
+            'cpu'      : self.cpu,
+            'read'     : self.read,
+            'write'    : self.write,
+        }
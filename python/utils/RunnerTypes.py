@@ -1,9 +1,27 @@
-from GalleryRunner import GalleryRunner
-from LarsoftRunner import LarsoftRunner
+import importlib
 
 class RunnerTypes(dict):
+    '''
+    Map of software type to runner class.
+
+    Runner modules are imported the first time they are requested, so
+    a worker only pays for importing the runner it actually uses.
+    '''
+    modules = {
+        'larsoft' : 'LarsoftRunner',
+        'gallery' : 'GalleryRunner',
+    }
 
     def __init__(self, **kwargs):
         super(RunnerTypes, self).__init__(kwargs)
-        self['larsoft'] = LarsoftRunner
-        self['gallery'] = GalleryRunner
\ No newline at end of file
+
+    def __missing__(self, key):
+        if key not in self.modules:
+            raise KeyError(key)
+        package = __name__.rpartition('.')[0]
+        module = importlib.import_module('{0}.{1}'.format(package, self.modules[key]))
+        self[key] = getattr(module, self.modules[key])
+        return self[key]
+
+    def __contains__(self, key):
+        return key in self.modules or super(RunnerTypes, self).__contains__(key)
@@ -0,0 +1,108 @@
+import os
+
+# Arrays can't have indices over the MaxArraySize of the cluster, so large
+# stages are submitted as several arrays, each starting from 0.  The index
+# of the first task of the stage an array runs is passed in this variable:
+TASK_OFFSET_VARIABLE = 'PRODUCTION_TASK_OFFSET'
+
+
+def task_job_id(environ=None):
+    '''Return the job id of the running task, [array job id]_[task index]
+
+    The task index counts from the start of the stage, adding the offset
+    of the array to SLURM_ARRAY_TASK_ID.
+    '''
+    if environ is None:
+        environ = os.environ
+    task = int(environ['SLURM_ARRAY_TASK_ID']) + int(environ.get(TASK_OFFSET_VARIABLE, 0))
+    return '{0}_{1}'.format(environ['SLURM_ARRAY_JOB_ID'], task)
+
+
+class Scheduler(object):
+    '''
+    Interface to the batch system running the job arrays of a project.
+
+    Jobs see the same environment whatever runs them: the array job id and
+    task index in SLURM_ARRAY_JOB_ID and SLURM_ARRAY_TASK_ID (plus the
+    offset of the array, see task_job_id), the stage work directory as
+    their working directory, and the scratch directory of the scheduler
+    settings.  Implementations are listed in SchedulerTypes.
+    '''
+    def __init__(self, settings, work_dir):
+        '''
+        Arguments:
+            settings {dict} -- scheduler block of the project configuration
+            work_dir {str} -- project work directory
+        '''
+        super(Scheduler, self).__init__()
+        self.settings = settings
+        self.work_dir = work_dir
+        # Command line of the last submission, for the ledger:
+        self.last_command = None
+
+    def submit(self, array, script_name, cwd, dependency=None, memory=None, time_limit=None,
+               env=None):
+        '''Submit a job script as an array
+
+        Arguments:
+            array {str} -- slurm style array specification, like 0-9%4
+            script_name {str} -- path of the job script
+            cwd {str} -- working directory of the tasks
+
+        Keyword Arguments:
+            dependency {str or None} -- slurm style dependency, like aftercorr:1234 (default: {None})
+            memory {int or None} -- memory per task in MB (default: {None})
+            time_limit {str or None} -- slurm style time limit (default: {None})
+            env {dict or None} -- variables to add to the environment of the tasks (default: {None})
+
+        Returns:
+            int or None -- id of the array job, None if the submission failed
+        '''
+        raise NotImplementedError()
+
+    def queue_counts(self, job_ids):
+        '''Count the queued and running tasks of some arrays, by state
+
+        Returns:
+            dict or None -- {state : number of tasks}, None if none of the arrays is in the queue
+        '''
+        raise NotImplementedError()
+
+    def array_tasks(self, job_ids, offsets=None):
+        '''Return the final state of every task of some arrays
+
+        Keyword Arguments:
+            offsets {dict or None} -- {array job id : task offset of the array} (default: {None})
+
+        Returns:
+            dict -- {task index : {'array', 'jobid', 'state', 'elapsed',
+            'timelimit', 'reqmem', 'maxrss'}}, see SlurmAccounting.array_tasks
+        '''
+        raise NotImplementedError()
+
+    def queued_tasks(self):
+        '''
+        Return the number of tasks of the user queued or running, all projects included
+        '''
+        return 0
+
+    def limits(self):
+        '''Return the limits on the arrays of the user
+
+        max_array_size and max_submit_jobs in the settings take precedence
+        over the limits of the batch system.
+
+        Returns:
+            dict -- max_array_size (indices must be lower) and max_submit_jobs
+            (tasks queued or running at once), None when there is no limit
+        '''
+        return {'max_array_size'  : self.settings.get('max_array_size'),
+                'max_submit_jobs' : self.settings.get('max_submit_jobs')}
+
+    def throttle(self, job_ids, max_running):
+        '''Change the number of tasks of some arrays that can run at once
+
+        Returns:
+            list -- the array job ids that were updated
+        '''
+        raise NotImplementedError()
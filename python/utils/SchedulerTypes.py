@@ -0,0 +1,27 @@
+import importlib
+
+class SchedulerTypes(dict):
+    '''
+    Map of scheduler type to scheduler class.
+
+    Scheduler modules are imported the first time they are requested,
+    like the runners in RunnerTypes.
+    '''
+    modules = {
+        'slurm' : 'SlurmScheduler',
+        'local' : 'LocalScheduler',
+    }
+
+    def __init__(self, **kwargs):
+        super(SchedulerTypes, self).__init__(kwargs)
+
+    def __missing__(self, key):
+        if key not in self.modules:
+            raise KeyError(key)
+        package = __name__.rpartition('.')[0]
+        module = importlib.import_module('{0}.{1}'.format(package, self.modules[key]))
+        self[key] = getattr(module, self.modules[key])
+        return self[key]
+
+    def __contains__(self, key):
+        return key in self.modules or super(SchedulerTypes, self).__contains__(key)
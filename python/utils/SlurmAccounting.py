@@ -0,0 +1,193 @@
+import re
+import time
+import subprocess
+
+from ResourceEstimator import parse_slurm_time, parse_slurm_memory
+
+# Array tasks are reported as [array job id]_[task index]:
+_task_pattern = re.compile(r'^(\d+)_(\d+)$')
+
+# States of tasks that will not change anymore, and did not succeed:
+FAILED_STATES = ['FAILED', 'OUT_OF_MEMORY', 'TIMEOUT', 'NODE_FAIL',
+                 'CANCELLED', 'PREEMPTED', 'BOOT_FAIL', 'DEADLINE']
+
+
+def compact_array(indices):
+    '''Write a list of array indices as a compact slurm --array spec
+
+    [0, 1, 2, 5, 7, 8] becomes '0-2,5,7-8'
+    '''
+    ranges = []
+    for index in sorted(set(indices)):
+        if len(ranges) > 0 and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ','.join(str(a) if a == b else '{0}-{1}'.format(a, b) for a, b in ranges)
+
+
+def parse_reqmem(reqmem, ncpus):
+    '''Return the bytes of memory a task requested, from its sacct ReqMem
+
+    Older slurm versions append n (per node) or c (per cpu) to the value,
+    a request per cpu is multiplied by the cpus allocated to the task.
+    Returns None if the value is empty.
+    '''
+    if reqmem == '':
+        return None
+    if reqmem.endswith('c'):
+        return parse_slurm_memory(reqmem[:-1]) * (ncpus or 1)
+    return parse_slurm_memory(reqmem.rstrip('n'))
+
+
+def array_tasks(job_ids, offsets=None):
+    '''Query sacct for the final state of every task of some arrays
+
+    Arguments:
+        job_ids {list} -- ids of the array jobs
+
+    Keyword Arguments:
+        offsets {dict or None} -- {array job id : offset added to its task indices} (default: {None})
+
+    Returns:
+        dict -- {task index : {'jobid', 'state', 'elapsed', 'timelimit',
+        'reqmem', 'maxrss'}}, times in seconds and memory in bytes.  Task
+        indices and job ids include the offset of their array.  Tasks
+        still pending in a collapsed range are not included.  If a task
+        index is in more than one array, the last array wins.
+    '''
+    command = ['sacct', '-j', ','.join(str(j) for j in job_ids),
+               '--parsable2', '--noheader',
+               '--format=JobID,State,Elapsed,Timelimit,ReqMem,MaxRSS,AllocCPUS']
+    return parse_array_tasks(subprocess.check_output(command), job_ids, offsets)
+
+
+def parse_array_tasks(stdout, job_ids, offsets=None):
+    '''Parse the sacct output queried by array_tasks
+
+    Arguments:
+        stdout {str} -- JobID|State|Elapsed|Timelimit|ReqMem|MaxRSS|AllocCPUS lines
+        job_ids {list} -- ids of the array jobs, later arrays win
+
+    Keyword Arguments:
+        offsets {dict or None} -- {array job id : offset added to its task indices} (default: {None})
+
+    Returns:
+        dict -- {task index : task}, see array_tasks
+    '''
+    if offsets is None:
+        offsets = dict()
+    order = dict((str(j), i) for i, j in enumerate(job_ids))
+    tasks = dict()
+    for line in stdout.splitlines():
+        fields = line.split('|')
+        if len(fields) < 7:
+            continue
+        job_id, state, elapsed, timelimit, reqmem, maxrss, ncpus = fields[:7]
+        step = None
+        if '.' in job_id:
+            job_id, step = job_id.split('.', 1)
+        match = _task_pattern.match(job_id)
+        if match is None:
+            continue
+        array_id = match.group(1)
+        index = int(match.group(2)) + int(offsets.get(array_id, offsets.get(int(array_id), 0)))
+        job_id = '{0}_{1}'.format(array_id, index)
+        if index in tasks and order.get(tasks[index]['array'], -1) > order.get(array_id, -1):
+            continue
+        if index not in tasks or tasks[index]['array'] != array_id:
+            tasks[index] = {'array' : array_id, 'jobid' : job_id, 'state' : None,
+                            'elapsed' : None, 'timelimit' : None,
+                            'reqmem' : None, 'maxrss' : 0}
+        task = tasks[index]
+        if step is None:
+            # 'CANCELLED by 1234' is still cancelled:
+            task['state'] = state.split(' ')[0]
+            task['elapsed'] = parse_slurm_time(elapsed)
+            if timelimit not in ('', 'UNLIMITED', 'Partition_Limit'):
+                task['timelimit'] = parse_slurm_time(timelimit)
+            task['reqmem'] = parse_reqmem(reqmem, int(ncpus) if ncpus != '' else None)
+        elif maxrss != '':
+            task['maxrss'] = max(task['maxrss'], parse_slurm_memory(maxrss))
+    return tasks
+
+
+def parse_slurm_date(date_string):
+    '''Return the epoch time of a sacct date like 2018-03-01T12:00:00, None if unknown
+    '''
+    try:
+        return time.mktime(time.strptime(date_string, '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return None
+
+
+def task_accounting(job_ids, offsets=None):
+    '''Query sacct for the accounting of every task of some arrays
+
+    Unlike array_tasks, every attempt of a task index is kept, each under
+    its own job id.
+
+    Arguments:
+        job_ids {list} -- ids of the array jobs
+
+    Keyword Arguments:
+        offsets {dict or None} -- {array job id : offset added to its task indices} (default: {None})
+
+    Returns:
+        list -- one dict per task with array, jobid, index, state, exitcode,
+        elapsed, timelimit, totalcpu, avecpu (seconds), reqmem, maxrss
+        (bytes), ncpus, node and submit, start, end (epoch times, None if
+        unknown).  Job ids and indices include the offset of the array.
+    '''
+    if offsets is None:
+        offsets = dict()
+    fields = ['JobID', 'State', 'ExitCode', 'Elapsed', 'Timelimit', 'ReqMem', 'MaxRSS',
+              'AveCPU', 'TotalCPU', 'AllocCPUS', 'NodeList', 'Submit', 'Start', 'End']
+    command = ['sacct', '-j', ','.join(str(j) for j in job_ids),
+               '--parsable2', '--noheader', '--format=' + ','.join(fields)]
+    stdout = subprocess.check_output(command)
+
+    tasks = dict()
+    order = []
+    for line in stdout.splitlines():
+        values = line.split('|')
+        if len(values) < len(fields):
+            continue
+        record = dict(zip(fields, values))
+        job_id, step = record['JobID'], None
+        if '.' in job_id:
+            job_id, step = job_id.split('.', 1)
+        match = _task_pattern.match(job_id)
+        if match is None:
+            continue
+        array_id = match.group(1)
+        index = int(match.group(2)) + int(offsets.get(array_id, offsets.get(int(array_id), 0)))
+        job_id = '{0}_{1}'.format(array_id, index)
+        if job_id not in tasks:
+            tasks[job_id] = {'array' : array_id, 'jobid' : job_id, 'index' : index,
+                             'state' : None, 'exitcode' : None, 'elapsed' : None,
+                             'timelimit' : None, 'totalcpu' : None, 'avecpu' : None,
+                             'reqmem' : None, 'maxrss' : 0, 'ncpus' : None, 'node' : None,
+                             'submit' : None, 'start' : None, 'end' : None}
+            order.append(job_id)
+        task = tasks[job_id]
+        if step is None:
+            task['state'] = record['State'].split(' ')[0]
+            task['exitcode'] = record['ExitCode']
+            task['elapsed'] = parse_slurm_time(record['Elapsed'])
+            if record['Timelimit'] not in ('', 'UNLIMITED', 'Partition_Limit'):
+                task['timelimit'] = parse_slurm_time(record['Timelimit'])
+            if record['AllocCPUS'] != '':
+                task['ncpus'] = int(record['AllocCPUS'])
+            task['reqmem'] = parse_reqmem(record['ReqMem'], task['ncpus'])
+            if record['TotalCPU'] != '':
+                task['totalcpu'] = parse_slurm_time(record['TotalCPU'])
+            task['node'] = record['NodeList']
+            for key in ('submit', 'start', 'end'):
+                task[key] = parse_slurm_date(record[key.capitalize()])
+        else:
+            if record['MaxRSS'] != '':
+                task['maxrss'] = max(task['maxrss'], parse_slurm_memory(record['MaxRSS']))
+            if record['AveCPU'] != '':
+                task['avecpu'] = max(task['avecpu'] or 0, parse_slurm_time(record['AveCPU']))
+    return [tasks[job_id] for job_id in order]
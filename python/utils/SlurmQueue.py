@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import fcntl
+import getpass
+import tempfile
+import subprocess
+
+# Seconds a snapshot of the queue is reused before squeue is called again:
+DEFAULT_TTL = 30
+
+
+def cache_file(user=None):
+    '''
+    Return the file holding the last snapshot of the queue of a user
+    '''
+    if user is None:
+        user = getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), 'squeue_{0}.json'.format(user))
+
+
+def query_queue(user):
+    '''Ask squeue for the state of every job and array task of a user
+
+    --array lists every task on its own line, pending ones included, so
+    there is no array range to unpack.
+
+    Returns:
+        dict -- {array job id (str) : {state : number of tasks}}
+    '''
+    command = ['squeue', '--array', '--noheader', '--user', user, '--format=%F|%K|%T']
+    stdout = subprocess.check_output(command)
+    queue = dict()
+    for line in stdout.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 3:
+            continue
+        counts = queue.setdefault(fields[0], dict())
+        counts[fields[2]] = counts.get(fields[2], 0) + 1
+    return queue
+
+
+def user_queue(ttl=DEFAULT_TTL, user=None):
+    '''Return the state of the jobs of a user, from a snapshot at most ttl seconds old
+
+    The snapshot is shared by every process of the user on this machine,
+    so status queries and watch loops over many stages and projects make
+    one squeue call per ttl between them.  The process refreshing it holds
+    a lock, the others wait for the new snapshot instead of calling squeue
+    too.
+
+    Returns:
+        dict -- {array job id (str) : {state : number of tasks}}
+    '''
+    if user is None:
+        user = getpass.getuser()
+    path = cache_file(user)
+
+    def read_snapshot():
+        try:
+            if time.time() - os.path.getmtime(path) < ttl:
+                with open(path, 'r') as _snapshot:
+                    return json.load(_snapshot)
+        except (OSError, IOError, ValueError):
+            pass
+        return None
+
+    queue = read_snapshot()
+    if queue is not None:
+        return queue
+
+    with open(path + '.lock', 'a') as _lock:
+        fcntl.lockf(_lock, fcntl.LOCK_EX)
+        try:
+            # Someone else may have refreshed it while we waited:
+            queue = read_snapshot()
+            if queue is not None:
+                return queue
+            queue = query_queue(user)
+            tmp = path + '.{0}.tmp'.format(os.getpid())
+            with open(tmp, 'w') as _snapshot:
+                json.dump(queue, _snapshot)
+            os.rename(tmp, path)
+        finally:
+            fcntl.lockf(_lock, fcntl.LOCK_UN)
+    return queue
+
+
+def invalidate(user=None):
+    '''Drop the snapshot of the queue of a user, after submitting jobs
+
+    Jobs submitted after the snapshot was taken are not in it, and would
+    look finished until it expires.  The lock makes a refresh in progress,
+    which may have called squeue before the submission, finish first.
+    '''
+    path = cache_file(user)
+    with open(path + '.lock', 'a') as _lock:
+        fcntl.lockf(_lock, fcntl.LOCK_EX)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        finally:
+            fcntl.lockf(_lock, fcntl.LOCK_UN)
+
+
+def queue_counts(job_ids, ttl=DEFAULT_TTL):
+    '''Count the queued and running tasks of some arrays, by state
+
+    Arguments:
+        job_ids {list} -- array job ids
+
+    Returns:
+        dict or None -- {state : number of tasks}, None if none of the arrays is in the queue
+    '''
+    queue = user_queue(ttl)
+    counts = dict()
+    for job_id in job_ids:
+        for state, n in queue.get(str(job_id), dict()).iteritems():
+            counts[state] = counts.get(state, 0) + n
+    if len(counts) == 0:
+        return None
+    return counts
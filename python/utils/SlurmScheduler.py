@@ -0,0 +1,117 @@
+import os
+import time
+import getpass
+import subprocess
+
+from Scheduler import Scheduler
+from SlurmQueue import queue_counts, user_queue, invalidate
+from SlurmAccounting import array_tasks
+
+
+class SlurmScheduler(Scheduler):
+    '''
+    Runs the arrays with sbatch, and follows them with squeue and sacct.
+    '''
+
+    def submit(self, array, script_name, cwd, dependency=None, memory=None, time_limit=None,
+               env=None):
+        '''Submit a slurm script as a job array
+
+        Memory and time are in the #SBATCH lines of the script, and the
+        shared snapshot of the queue is dropped (see SlurmQueue.invalidate)
+        so the array shows in the next queue_counts.  Tasks whose
+        dependency can never be satisfied (an upstream task failed) are
+        cancelled by slurm instead of pending forever, so they are
+        resubmitted by makeup like any failed task.
+        '''
+        command = ['sbatch', '-a', array]
+        if dependency is not None:
+            command += ['--dependency={0}'.format(dependency), '--kill-on-invalid-dep=yes']
+        if env is not None and len(env) > 0:
+            command.append('--export=' + ','.join(['ALL'] + ['{0}={1}'.format(key, value)
+                                                             for key, value in sorted(env.items())]))
+        command.append(script_name)
+        self.last_command = ' '.join(command)
+
+        print("Submitting jobs ...")
+        # Run the command:
+        proc = subprocess.Popen(command,
+                                cwd = cwd,
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.PIPE,
+                                env = dict(os.environ))
+        retval=proc.poll()
+        # the loop executes to wait till the command finish running
+        stdout=''
+        stderr=''
+        while retval is None:
+            time.sleep(1.0)
+            # while waiting, fetch stdout (including STDERR) to avoid crogging the pipe
+            for line in iter(proc.stdout.readline, b''):
+                stdout += line
+            for line in iter(proc.stderr.readline, b''):
+                stderr += line
+            # update the return value
+            retval = proc.poll()
+
+        # Keep the output of every submission:
+        with open(cwd + '/submission_log.out', 'a') as _log:
+            _log.write(stdout)
+        with open(cwd + '/submission_log.err', 'a') as _log:
+            _log.write(stderr)
+
+
+        return_code = proc.returncode
+        if return_code == 0:
+            # The new array is not in the snapshot of the queue:
+            invalidate()
+            print("Submitted jobs successfully.")
+            return int(stdout.split(' ')[-1])
+        else:
+            print("sbatch exited with status {0}, check output logs in the work directory".format(return_code))
+            return None
+
+    def queue_counts(self, job_ids):
+        return queue_counts(job_ids)
+
+    def array_tasks(self, job_ids, offsets=None):
+        return array_tasks(job_ids, offsets)
+
+    def queued_tasks(self):
+        return sum(sum(counts.values()) for counts in user_queue().values())
+
+    def limits(self):
+        '''Return the limits on the arrays of the user
+
+        MaxArraySize comes from the slurm configuration, MaxSubmitJobs from
+        the associations of the user (the lowest one if there are several).
+        '''
+        limits = super(SlurmScheduler, self).limits()
+        if limits['max_array_size'] is None:
+            try:
+                for line in subprocess.check_output(['scontrol', 'show', 'config']).splitlines():
+                    key, _, value = line.partition('=')
+                    if key.strip() == 'MaxArraySize':
+                        limits['max_array_size'] = int(value.strip())
+            except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                print('Could not read MaxArraySize: {0}'.format(e))
+        if limits['max_submit_jobs'] is None:
+            try:
+                stdout = subprocess.check_output(['sacctmgr', '--noheader', '--parsable2', 'show', 'assoc',
+                                                  'where', 'user={0}'.format(getpass.getuser()),
+                                                  'format=MaxSubmitJobs'])
+                values = [int(line.strip()) for line in stdout.splitlines() if line.strip() != '']
+                if len(values) > 0:
+                    limits['max_submit_jobs'] = min(values)
+            except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                print('Could not read MaxSubmitJobs: {0}'.format(e))
+        return limits
+
+    def throttle(self, job_ids, max_running):
+        updated = []
+        for job_id in job_ids:
+            command = ['scontrol', 'update', 'JobId={0}'.format(job_id),
+                       'ArrayTaskThrottle={0}'.format(max_running)]
+            if subprocess.call(command) == 0:
+                updated.append(job_id)
+        return updated
@@ -0,0 +1,202 @@
+import os
+import errno
+import ctypes
+import ctypes.util
+import threading
+import Queue
+
+from Checksums import checksum_file, copy_with_checksums
+
+
+# Kernel side copies, through libc since python 2 has no os.sendfile:
+_libc = None
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    pass
+
+_copy_file_range = getattr(_libc, 'copy_file_range', None)
+if _copy_file_range is not None:
+    _copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_size_t, ctypes.c_uint]
+    _copy_file_range.restype = ctypes.c_ssize_t
+
+_sendfile = getattr(_libc, 'sendfile', None)
+if _sendfile is not None:
+    _sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                          ctypes.c_void_p, ctypes.c_size_t]
+    _sendfile.restype = ctypes.c_ssize_t
+
+# Largest amount of data moved per system call:
+CHUNK_SIZE = 64*1024*1024
+
+# Errors meaning the kernel can't copy between these two files:
+_UNSUPPORTED = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+def _kernel_copy(function, fd_in, fd_out, size):
+    '''Copy size bytes between two file descriptors with a libc call
+
+    Returns:
+        int -- number of bytes copied.  Zero bytes copied of a non empty
+        file means the call is not supported for these files.
+    '''
+    copied = 0
+    while copied < size:
+        n = min(CHUNK_SIZE, size - copied)
+        if function is _copy_file_range:
+            result = function(fd_in, None, fd_out, None, n, 0)
+        else:
+            result = function(fd_out, fd_in, None, n)
+        if result < 0:
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            if copied == 0 and error in _UNSUPPORTED:
+                return 0
+            raise OSError(error, os.strerror(error))
+        if result == 0:
+            break
+        copied += result
+    return copied
+
+
+def copy_file(source, destination):
+    '''Copy the content of source to destination, inside the kernel if possible
+
+    Uses copy_file_range, then sendfile, then a plain read/write loop.
+
+    Returns:
+        int -- number of bytes copied
+    '''
+    size = os.path.getsize(source)
+    with open(source, 'rb') as _in:
+        with open(destination, 'wb') as _out:
+            copied = 0
+            for function in (_copy_file_range, _sendfile):
+                if function is None or size == 0:
+                    continue
+                copied = _kernel_copy(function, _in.fileno(), _out.fileno(), size)
+                if copied > 0:
+                    break
+            if copied == 0:
+                while True:
+                    chunk = _in.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    _out.write(chunk)
+                    copied += len(chunk)
+            _out.flush()
+            os.fsync(_out.fileno())
+    if copied != size:
+        raise IOError("copied {0} bytes of {1}, expected {2}".format(copied, source, size))
+    return copied
+
+
+class StageOut(object):
+    '''
+    Moves the files of a finished job from scratch to the output directory.
+
+    Files are renamed when the scratch and output directories are on the
+    same device, and copied by the kernel otherwise.  Copies of multiple
+    files run in parallel threads, and each copy is written to a hidden
+    temporary file that is renamed into place once complete, so a partial
+    file is never visible in the output directory.
+
+    If checksum algorithms are given, copies go through a reused user space
+    buffer instead of the kernel so the checksums are computed in the same
+    pass as the copy.  Renamed files are read once to compute them.
+    '''
+    def __init__(self, max_transfers=4, algorithms=None):
+        super(StageOut, self).__init__()
+        self.max_transfers = max_transfers
+        self.algorithms = algorithms
+        self.bytes_copied = 0
+        self.n_renamed = 0
+        # {destination : {algorithm : checksum}}, if algorithms are set:
+        self.checksums = dict()
+        self._lock = threading.Lock()
+
+    def transfer(self, source, directory):
+        '''Move a single file into directory
+
+        Returns:
+            str -- path of the file in directory
+        '''
+        destination = os.path.join(directory, os.path.basename(source))
+        if os.stat(source).st_dev == os.stat(directory).st_dev:
+            os.rename(source, destination)
+            checksums = None
+            if self.algorithms:
+                checksums = checksum_file(destination, self.algorithms)
+            with self._lock:
+                self.n_renamed += 1
+                if checksums is not None:
+                    self.checksums[destination] = checksums
+            return destination
+
+        tmp_file = os.path.join(directory, '.' + os.path.basename(source) + '.part')
+        checksums = None
+        try:
+            if self.algorithms:
+                n_bytes, checksums = copy_with_checksums(source, tmp_file, self.algorithms)
+                if n_bytes != os.path.getsize(source):
+                    raise IOError("copied {0} bytes of {1}".format(n_bytes, source))
+            else:
+                n_bytes = copy_file(source, tmp_file)
+            os.rename(tmp_file, destination)
+        except:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+        with self._lock:
+            self.bytes_copied += n_bytes
+            if checksums is not None:
+                self.checksums[destination] = checksums
+        return destination
+
+    def stage_out(self, files, directory):
+        '''Move files into directory, in parallel
+
+        Arguments:
+            files {list} -- paths of the files to move
+            directory {str} -- destination directory, must exist
+
+        Returns:
+            list -- paths of the files in directory
+
+        Raises:
+            IOError -- if any of the files could not be moved
+        '''
+        queue = Queue.Queue()
+        for index, source in enumerate(files):
+            queue.put((index, source))
+
+        results = [None] * len(files)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    index, source = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[index] = self.transfer(source, directory)
+                except (IOError, OSError) as e:
+                    with self._lock:
+                        errors.append("{0}: {1}".format(source, e))
+
+        threads = []
+        for i in xrange(min(self.max_transfers, len(files))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise IOError("Could not stage out " + ', '.join(errors))
+        return results
@@ -0,0 +1,265 @@
+import time
+import sqlite3
+
+
+class SubmissionLedger(object):
+    '''
+    Record of every array submitted for the stages of a project.
+
+    The ledger is a sqlite file in the project work directory.  Each row is
+    one sbatch call: the stage, the array job id, the array specification,
+    the resources asked for, the dependency, and the makeup generation
+    (0 for the first submission of the stage, then one more for each
+    makeup).  Nothing is overwritten, so the status, statistics and makeup
+    of a stage can look at all of its arrays at once.
+
+    Arrays split to respect the limits of the scheduler record the index
+    of their first task in the stage (task_offset), and the arrays held
+    back by MaxSubmitJobs wait in the deferred table until they can be
+    submitted.  The results of --check, and the accounting of the tasks
+    collected by --statistics, are kept in the same file.
+    '''
+
+    def __init__(self, work_dir):
+        super(SubmissionLedger, self).__init__()
+        self.path = work_dir.rstrip('/') + '/submissions.db'
+        with self.connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS submissions (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    stage      TEXT    NOT NULL,
+                    jobid      INTEGER NOT NULL,
+                    array      TEXT    NOT NULL,
+                    memory     INTEGER,
+                    time_limit TEXT,
+                    dependency TEXT,
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    command    TEXT,
+                    submitted  REAL    NOT NULL,
+                    task_offset INTEGER NOT NULL DEFAULT 0
+                )''')
+            try:
+                # Ledgers from before arrays were split:
+                conn.execute('ALTER TABLE submissions ADD COLUMN task_offset INTEGER NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                pass
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS deferred (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    stage       TEXT    NOT NULL,
+                    script      TEXT    NOT NULL,
+                    array       TEXT    NOT NULL,
+                    n_tasks     INTEGER NOT NULL,
+                    task_offset INTEGER NOT NULL DEFAULT 0,
+                    memory      INTEGER,
+                    time_limit  TEXT,
+                    dependency  TEXT,
+                    generation  INTEGER NOT NULL DEFAULT 0
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS checks (
+                    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+                    stage          TEXT    NOT NULL,
+                    missing_events INTEGER,
+                    makeup_jobs    INTEGER,
+                    checked        REAL    NOT NULL
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS accounting (
+                    stage     TEXT    NOT NULL,
+                    jobid     TEXT    NOT NULL,
+                    array     TEXT    NOT NULL,
+                    task      INTEGER NOT NULL,
+                    state     TEXT,
+                    exitcode  TEXT,
+                    elapsed   REAL,
+                    timelimit REAL,
+                    totalcpu  REAL,
+                    avecpu    REAL,
+                    reqmem    REAL,
+                    maxrss    REAL,
+                    ncpus     INTEGER,
+                    node      TEXT,
+                    submit    REAL,
+                    start     REAL,
+                    end       REAL,
+                    nevents   INTEGER,
+                    collected REAL    NOT NULL,
+                    PRIMARY KEY (stage, jobid)
+                )''')
+
+    def connect(self):
+        # The work directory is on a shared file system, wait for other
+        # users of the ledger instead of failing:
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.text_factory = str
+        return conn
+
+    def record(self, stage, jobid, array, memory=None, time_limit=None,
+               dependency=None, generation=0, command=None, task_offset=0):
+        '''Add a submitted array to the ledger
+
+        Arguments:
+            stage {str} -- name of the stage
+            jobid {int} -- id of the array job
+            array {str} -- slurm --array specification
+
+        Keyword Arguments:
+            memory {int or None} -- memory per chain in MB (default: {None})
+            time_limit {str or None} -- slurm time limit (default: {None})
+            dependency {str or None} -- slurm dependency (default: {None})
+            generation {int} -- makeup generation (default: {0})
+            command {str or None} -- the sbatch command line (default: {None})
+            task_offset {int} -- index in the stage of the first task of the array (default: {0})
+        '''
+        with self.connect() as conn:
+            conn.execute('''
+                INSERT INTO submissions(stage, jobid, array, memory, time_limit,
+                                        dependency, generation, command, submitted, task_offset)
+                VALUES (?,?,?,?,?,?,?,?,?,?)''',
+                (stage, jobid, array, memory, time_limit,
+                 dependency, generation, command, time.time(), task_offset))
+
+    def defer(self, stage, script, array, n_tasks, task_offset=0, memory=None,
+              time_limit=None, dependency=None, generation=0):
+        '''
+        Keep an array to submit later, see record for the arguments
+        '''
+        with self.connect() as conn:
+            conn.execute('''
+                INSERT INTO deferred(stage, script, array, n_tasks, task_offset, memory,
+                                     time_limit, dependency, generation)
+                VALUES (?,?,?,?,?,?,?,?,?)''',
+                (stage, script, array, n_tasks, task_offset, memory,
+                 time_limit, dependency, generation))
+
+    def deferred(self, stage):
+        '''Return the arrays of a stage waiting to be submitted, in order
+
+        Returns:
+            list -- one dict per array, with the columns of the deferred table
+        '''
+        with self.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('SELECT * FROM deferred WHERE stage=? ORDER BY id',
+                                (stage,)).fetchall()
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def remove_deferred(self, deferred_id):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM deferred WHERE id=?', (deferred_id,))
+
+    def throttle_deferred(self, stage, max_running):
+        '''
+        Change the concurrency cap of the arrays of a stage not submitted yet, 0 removes it
+        '''
+        for array in self.deferred(stage):
+            spec = array['array'].split('%')[0]
+            if max_running > 0:
+                spec += '%{0}'.format(max_running)
+            with self.connect() as conn:
+                conn.execute('UPDATE deferred SET array=? WHERE id=?', (spec, array['id']))
+
+    def store_accounting(self, stage, tasks):
+        '''Save the accounting of tasks of a stage, replacing what was known of them
+
+        Arguments:
+            stage {str} -- name of the stage
+            tasks {list} -- dicts like SlurmAccounting.task_accounting returns,
+                with the events of the task in nevents (or None)
+        '''
+        collected = time.time()
+        with self.connect() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO accounting(stage, jobid, array, task, state, exitcode,
+                                                  elapsed, timelimit, totalcpu, avecpu, reqmem,
+                                                  maxrss, ncpus, node, submit, start, end,
+                                                  nevents, collected)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''',
+                [(stage, task['jobid'], task['array'], task['index'], task['state'],
+                  task['exitcode'], task['elapsed'], task['timelimit'], task['totalcpu'],
+                  task['avecpu'], task['reqmem'], task['maxrss'], task['ncpus'], task['node'],
+                  task['submit'], task['start'], task['end'], task.get('nevents'), collected)
+                 for task in tasks])
+
+    def accounting(self, stage=None):
+        '''Return the accounting of the tasks of a stage, or of every stage
+
+        Returns:
+            list -- one dict per task, with the columns of the accounting table
+            (task is the index of the task in the stage)
+        '''
+        with self.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            if stage is None:
+                rows = conn.execute('SELECT * FROM accounting ORDER BY stage, task').fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM accounting WHERE stage=? ORDER BY task',
+                                    (stage,)).fetchall()
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def offsets(self, stage):
+        '''
+        Return {array job id : task offset} of the arrays of a stage
+        '''
+        with self.connect() as conn:
+            rows = conn.execute('SELECT jobid, task_offset FROM submissions WHERE stage=?',
+                                (stage,)).fetchall()
+        return dict((str(jobid), offset) for jobid, offset in rows)
+
+    def record_check(self, stage, missing_events, makeup_jobs):
+        '''
+        Add the result of checking the outputs of a stage to the ledger
+        '''
+        with self.connect() as conn:
+            conn.execute('''
+                INSERT INTO checks(stage, missing_events, makeup_jobs, checked)
+                VALUES (?,?,?,?)''', (stage, missing_events, makeup_jobs, time.time()))
+
+    def job_ids(self, stage, generation=None):
+        '''Return the array job ids of a stage, in order of submission
+
+        Keyword Arguments:
+            generation {int or None} -- only this makeup generation, None for all (default: {None})
+        '''
+        with self.connect() as conn:
+            if generation is None:
+                rows = conn.execute('SELECT jobid FROM submissions WHERE stage=? ORDER BY id',
+                                    (stage,)).fetchall()
+            else:
+                rows = conn.execute('SELECT jobid FROM submissions WHERE stage=? AND generation=? ORDER BY id',
+                                    (stage, generation)).fetchall()
+        return [row[0] for row in rows]
+
+    def generation(self, stage):
+        '''
+        Return the last makeup generation of a stage, or None if it was never submitted
+        '''
+        with self.connect() as conn:
+            return conn.execute('SELECT MAX(generation) FROM submissions WHERE stage=?',
+                                (stage,)).fetchone()[0]
+
+    def submissions(self, stage=None):
+        '''Return the submissions of a stage, or of the whole project, in order
+
+        Returns:
+            list -- one dict per submitted array, with the columns of the ledger
+        '''
+        with self.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            if stage is None:
+                rows = conn.execute('SELECT * FROM submissions ORDER BY id').fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM submissions WHERE stage=? ORDER BY id',
+                                    (stage,)).fetchall()
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def forget(self, stage):
+        '''
+        Remove a stage from the ledger, when it is cleaned
+        '''
+        with self.connect() as conn:
+            conn.execute('DELETE FROM submissions WHERE stage=?', (stage,))
+            conn.execute('DELETE FROM deferred WHERE stage=?', (stage,))
+            conn.execute('DELETE FROM accounting WHERE stage=?', (stage,))
+            conn.execute('DELETE FROM checks WHERE stage=?', (stage,))
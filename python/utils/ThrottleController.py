@@ -0,0 +1,123 @@
+import time
+
+from ResourceEstimator import quantile
+
+
+def recent_metrics(heartbeats, since):
+    '''Collect the service timings published by jobs after a time
+
+    Arguments:
+        heartbeats {list} -- heartbeat dictionaries, see read_heartbeats
+        since {float} -- only keep the measurements made after this time
+
+    Returns:
+        dict -- {metric name : list of values}
+    '''
+    metrics = dict()
+    for heartbeat in heartbeats:
+        for name, (value, measured) in heartbeat.get('metrics', dict()).iteritems():
+            if measured > since and value is not None:
+                metrics.setdefault(name, []).append(value)
+    return metrics
+
+
+def events_per_hour(heartbeats, now, max_age):
+    '''
+    Return the events/hour of the jobs with a heartbeat younger than max_age seconds
+    '''
+    return 3600. * sum(heartbeat['rate'] for heartbeat in heartbeats
+                       if heartbeat['state'] == 'running' and heartbeat['rate'] is not None
+                       and now - heartbeat['updated'] < max_age)
+
+
+class ThrottleController(object):
+    '''
+    Adapts the number of tasks of a stage running at once to the load on
+    the database and the output file system.
+
+    Jobs publish in their heartbeats how long they waited to claim their
+    inputs and to declare their outputs, and how fast they staged out
+    (see ProgressMonitor.set_metric).  On every update, the medians of the
+    measurements made since the previous update are compared to the
+    targets of the stage (StageConfig.adaptive_throttle):
+     - any target missed: the limit is multiplied by backoff
+     - the events/hour of the running jobs went down after an increase:
+       the increase is taken back
+     - otherwise, if the limit is what holds tasks back, it goes up by step
+    so the limit settles around the most events/hour the services allow.
+    '''
+    def __init__(self, settings, limit):
+        '''
+        Arguments:
+            settings {dict} -- targets and bounds, see StageConfig.adaptive_throttle
+            limit {int} -- tasks running at once when the controller starts
+        '''
+        super(ThrottleController, self).__init__()
+        self.settings = settings
+        self.limit = self.bounded(limit)
+        self.last_update = time.time()
+        self.last_throughput = None
+        self.increased = False
+        # Reason of the last decision:
+        self.reason = None
+
+    def bounded(self, limit):
+        return int(max(self.settings['min_running'], min(self.settings['max_running'], limit)))
+
+    def missed_targets(self, medians):
+        '''
+        Return a description of each target the medians miss
+        '''
+        missed = []
+        if medians.get('claim_latency', 0) > self.settings['max_claim_latency']:
+            missed.append('claim latency {0:.1f} s over {1} s'.format(
+                medians['claim_latency'], self.settings['max_claim_latency']))
+        if medians.get('declare_time', 0) > self.settings['max_declare_time']:
+            missed.append('declare time {0:.1f} s over {1} s'.format(
+                medians['declare_time'], self.settings['max_declare_time']))
+        if 'stage_out_rate' in medians and \
+            medians['stage_out_rate'] < self.settings['min_stage_out_rate']:
+            missed.append('stage out {0:.1f} MB/s under {1} MB/s'.format(
+                medians['stage_out_rate'], self.settings['min_stage_out_rate']))
+        return missed
+
+    def update(self, heartbeats, n_running, max_age=900):
+        '''Decide the number of tasks running at once from the latest heartbeats
+
+        Arguments:
+            heartbeats {list} -- heartbeats of the jobs of the stage
+            n_running {int} -- tasks of the stage running now
+
+        Keyword Arguments:
+            max_age {float} -- seconds after which a heartbeat is not counted
+                in the events/hour (default: {900})
+
+        Returns:
+            tuple -- (reason of the decision, medians of the metrics, events/hour);
+            the decision is in self.limit
+        '''
+        now = time.time()
+        medians = dict((name, quantile(values, 0.5))
+                       for name, values in recent_metrics(heartbeats, self.last_update).iteritems())
+        throughput = events_per_hour(heartbeats, now, max_age)
+
+        previous = self.limit
+        missed = self.missed_targets(medians)
+        if len(missed) > 0:
+            self.limit = self.bounded(self.limit * self.settings['backoff'])
+            reason = ', '.join(missed)
+        elif self.increased and self.last_throughput is not None and throughput < self.last_throughput:
+            self.limit = self.bounded(self.limit - self.settings['step'])
+            reason = 'events/hour went down from {0:.0f} to {1:.0f} after the last increase'.format(
+                self.last_throughput, throughput)
+        elif n_running >= self.limit:
+            self.limit = self.bounded(self.limit + self.settings['step'])
+            reason = 'targets met with {0} tasks running'.format(n_running)
+        else:
+            reason = 'targets met, {0} tasks running under the limit'.format(n_running)
+
+        self.increased = self.limit > previous
+        self.last_throughput = throughput
+        self.last_update = now
+        self.reason = reason
+        return reason, medians, throughput
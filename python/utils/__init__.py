@@ -1,3 +1,3 @@
-from ProjectHandler import ProjectHandler
-from JobRunner import JobRunner
-from RunnerTypes import RunnerTypes
\ No newline at end of file
+# Nothing is imported here: importing any module of the package runs this
+# file first, and the workers only need a few of them (see RunnerTypes).
+# Import the classes from their modules, like utils.ProjectHandler.
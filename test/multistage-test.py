@@ -3,7 +3,7 @@ import os
 import yaml
 
 from config import ProjectConfig
-from utils import ProjectHandler
+from utils.ProjectHandler import ProjectHandler
 from database import DBUtil
 
 # This script tests the multistage input/output flow.
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from config import ProjectConfig
+from utils.ProgressMonitor import read_heartbeats
+
+# This script measures the startup overhead of the worker entry point.
+# Each phase runs in a fresh interpreter so the import costs are real,
+# and the time-to-first-lar of real jobs is read back from their heartbeats.
+
+def time_snippet(snippet, repeat=5):
+    '''Run a python snippet in fresh interpreters, return the best wall time
+    '''
+    code = 'import time\nt0=time.time()\n' + snippet + '\nprint(time.time()-t0)\n'
+    best = None
+    for i in xrange(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ))
+        elapsed = float(out.split()[-1])
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(config_file, stage):
+
+    config_file = os.path.abspath(config_file)
+
+    # Write a descriptor, exactly as submit does:
+    fd, descriptor = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    project = ProjectConfig(config_file)
+    project.compile(descriptor, stage=stage)
+
+    phases = [
+        ('import config',          'from config import ProjectConfig'),
+        ('import utils package',   'import utils'),
+        ('import job id helper',   'from utils.Scheduler import task_job_id'),
+        ('import runner',          'from utils.RunnerTypes import RunnerTypes\n'
+                                   'RunnerTypes()["{0}"]'.format(project.software()['type'])),
+        ('parse project yml',      'from config import ProjectConfig\n'
+                                   'ProjectConfig("{0}")'.format(config_file)),
+        ('load descriptor',        'from config import ProjectConfig\n'
+                                   'ProjectConfig("{0}")'.format(descriptor)),
+    ]
+
+    snapshot_dir = '{0}/work/{1}/'.format(project['top_dir'], stage)
+    if os.path.isfile(project.software().snapshot_file(snapshot_dir)):
+        phases.append(('load software snapshot', 'from config import ProjectConfig\n'
+                       'ProjectConfig("{0}").software().load_snapshot("{1}", return_env=True)'.format(
+                        descriptor, snapshot_dir)))
+
+    print('Startup phases (best of 5, fresh interpreter each):')
+    for name, snippet in phases:
+        print('  {0:25} {1:.3f} s'.format(name, time_snippet(snippet)))
+
+    os.remove(descriptor)
+
+    # Time to first lar as measured by the jobs themselves:
+    heartbeats = read_heartbeats(snapshot_dir + 'heartbeats/')
+    startups = sorted([hb['startup'] for hb in heartbeats if hb.get('startup') is not None])
+    if len(startups) > 0:
+        print('Time to first lar invocation over {0} jobs:'.format(len(startups)))
+        print('  min {0:.1f} s, median {1:.1f} s, max {2:.1f} s'.format(
+            startups[0], startups[len(startups)/2], startups[-1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2])
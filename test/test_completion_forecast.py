@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import utils.CompletionForecast as CompletionForecast
+
+# Checks of the scheduling of the forecast, with and without numpy, no
+# database or batch system needed.  Run with setup.sh sourced:
+# python test/test_completion_forecast.py
+
+def check_schedule():
+    # One replica, two slots: jobs 2 and 3 take the first slot that frees up
+    ends = CompletionForecast.schedule([[1., 2., 3., 4.]], [[0., 0., 0., 0.]],
+                                       [[0., 0., 0., 0.]], 2)
+    assert [list(replica) for replica in ends] == [[1., 2., 4., 6.]]
+    # Waits hold the slot, a job is not released before it is ready
+    ends = CompletionForecast.schedule([[1., 2., 3., 4.]], [[1., 0., 0., 0.]],
+                                       [[0., 0., 0., 10.]], 2)
+    assert [list(replica) for replica in ends] == [[2., 2., 5., 14.]]
+    # As many slots as jobs: everything starts at once
+    ends = CompletionForecast.schedule([[1., 2.], [3., 4.]], [[0., 0.], [1., 1.]],
+                                       [[0., 5.], [0., 0.]], 3)
+    assert [list(replica) for replica in ends] == [[1., 7.], [4., 5.]]
+    assert list(CompletionForecast.makespan(ends)) == [7., 5.]
+
+def test_schedule():
+    check_schedule()
+    numpy = CompletionForecast.numpy
+    CompletionForecast.numpy = None
+    try:
+        check_schedule()
+    finally:
+        CompletionForecast.numpy = numpy
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('{0} passed'.format(name))
@@ -1,6 +1,6 @@
 import os
 
-from utils import ProjectHandler
+from utils.ProjectHandler import ProjectHandler
 
 def main():
     a = ProjectHandler(config_file='/home/cadams/harvard_production/example_project.yml', stage='generation', action='submit')
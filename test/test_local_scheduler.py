@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+from utils.LocalScheduler import parse_array
+from utils.SlurmAccounting import compact_array
+
+# Checks of the parsing of array specs by the local backend, no database
+# or batch system needed.  Run with setup.sh sourced:
+# python test/test_local_scheduler.py
+
+def test_parse_array():
+    assert parse_array('0-2,5') == ([0, 1, 2, 5], None)
+    assert parse_array('0-3%2') == ([0, 1, 2, 3], 2)
+    assert parse_array('7') == ([7], None)
+    # What the project handler submits is read back:
+    assert parse_array(compact_array([1, 2, 3, 9]) + '%5') == ([1, 2, 3, 9], 5)
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('{0} passed'.format(name))
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+from utils.ResourceEstimator import parse_slurm_time, parse_slurm_memory
+
+# Checks of the parsing of sacct values, no database or batch system
+# needed.  Run with setup.sh sourced: python test/test_resource_estimator.py
+
+MB = 1024.**2
+
+def test_parse_slurm_time():
+    assert parse_slurm_time('00:01:30') == 90
+    assert parse_slurm_time('1-02:00:00') == 93600
+    assert parse_slurm_time('05:30.5') == 330.5
+
+def test_parse_slurm_memory():
+    assert parse_slurm_memory('1024K') == MB
+    assert parse_slurm_memory('2.5G') == 2560 * MB
+    assert parse_slurm_memory('100') == 100.
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('{0} passed'.format(name))
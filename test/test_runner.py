@@ -1,7 +1,7 @@
 import os
 
 from config import ProjectConfig
-from utils import JobRunner
+from utils.JobRunner import JobRunner
 from database import DBUtil
 
 def main():
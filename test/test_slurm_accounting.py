@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+from utils.SlurmAccounting import compact_array, parse_reqmem, parse_array_tasks
+
+# Checks of the sacct parsing, on output written here instead of queried,
+# no database or batch system needed.  Run with setup.sh sourced:
+# python test/test_slurm_accounting.py
+
+MB = 1024.**2
+
+# JobID|State|Elapsed|Timelimit|ReqMem|MaxRSS|AllocCPUS, as sacct prints them:
+SACCT = '\n'.join([
+    '100_0|COMPLETED|00:10:00|01:00:00|1000Mc||2',
+    '100_0.batch|COMPLETED|00:10:00||1000Mc|500M|2',
+    '100_1|OUT_OF_MEMORY|00:05:00|01:00:00|1000Mc||2',
+    '101_0|FAILED|00:01:00|01:00:00|2G||1',
+    '102_1|COMPLETED|00:02:00|01:00:00|2G||1',
+    '100_1|CANCELLED by 42|00:00:00|01:00:00|1000Mc||2',
+])
+
+def test_compact_array():
+    assert compact_array([0, 1, 2, 5, 7, 8]) == '0-2,5,7-8'
+    assert compact_array([8, 7, 7, 3]) == '3,7-8'
+    assert compact_array([4]) == '4'
+    assert compact_array([]) == ''
+
+def test_parse_reqmem():
+    assert parse_reqmem('4000M', 4) == 4000 * MB
+    assert parse_reqmem('4000Mn', 4) == 4000 * MB
+    # Per cpu requests are for the whole task:
+    assert parse_reqmem('2000Mc', 4) == 8000 * MB
+    assert parse_reqmem('2000Mc', None) == 2000 * MB
+    assert parse_reqmem('', 4) is None
+
+def test_parse_array_tasks():
+    tasks = parse_array_tasks(SACCT, [100, 101, 102])
+    assert sorted(tasks) == [0, 1]
+    assert tasks[0]['jobid'] == '101_0' and tasks[0]['state'] == 'FAILED'
+    assert tasks[1]['jobid'] == '102_1'
+    tasks = parse_array_tasks(SACCT, [100])
+    assert tasks[0]['jobid'] == '100_0'
+    assert tasks[0]['elapsed'] == 600
+    assert tasks[0]['timelimit'] == 3600
+    assert tasks[0]['reqmem'] == 2000 * MB
+    assert tasks[0]['maxrss'] == 500 * MB
+    assert tasks[1]['state'] == 'CANCELLED'
+
+def test_parse_array_tasks_offsets():
+    # 101 and 102 are a makeup of task 5 and the second array of the stage from 10:
+    tasks = parse_array_tasks(SACCT, [100, 101, 102], {'100' : 0, '101' : 5, '102' : 10})
+    assert sorted(tasks) == [0, 1, 5, 11]
+    assert tasks[0]['jobid'] == '100_0'
+    assert tasks[5]['jobid'] == '101_5' and tasks[5]['state'] == 'FAILED'
+    assert tasks[11]['jobid'] == '102_11'
+    # The ledger may hand the job ids as integers:
+    assert sorted(parse_array_tasks(SACCT, [100, 101], {100 : 0, 101 : 5})) == [0, 1, 5]
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('{0} passed'.format(name))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import time
+
+from utils.ThrottleController import ThrottleController
+
+# Checks of how the running tasks of a stage follow the load, on
+# heartbeats written here, no database or batch system needed.  Run with
+# setup.sh sourced: python test/test_throttle_controller.py
+
+SETTINGS = {'max_claim_latency' : 5., 'max_declare_time' : 10., 'min_stage_out_rate' : 10.,
+            'min_running' : 2, 'max_running' : 20, 'step' : 4, 'backoff' : 0.5}
+
+def heartbeat(claim_latency, rate):
+    now = time.time() + 1
+    return {'state' : 'running', 'rate' : rate, 'updated' : now,
+            'metrics' : {'claim_latency' : [claim_latency, now]}}
+
+def test_throttle_controller():
+    controller = ThrottleController(SETTINGS, 10)
+    # Targets met and the limit holds tasks back: one step up
+    controller.update([heartbeat(1., 1.)] * 10, 10)
+    assert controller.limit == 14
+    # Events/hour went down after the increase: the step is taken back
+    controller.update([heartbeat(1., 0.5)] * 10, 14)
+    assert controller.limit == 10
+    # Under the limit, nothing changes
+    controller.update([heartbeat(1., 0.5)] * 5, 5)
+    assert controller.limit == 10
+    # Latency over the target: backoff, and never under min_running
+    controller.update([heartbeat(9., 0.5)] * 10, 10)
+    assert controller.limit == 5
+    controller.update([heartbeat(9., 0.5)] * 5, 5)
+    controller.update([heartbeat(9., 0.5)] * 5, 5)
+    assert controller.limit == 2
+    assert 'claim latency' in controller.reason
+
+def test_throttle_controller_bounds():
+    assert ThrottleController(SETTINGS, 100).limit == 20
+    assert ThrottleController(SETTINGS, 1).limit == 2
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('{0} passed'.format(name))